@@ -1,10 +1,6 @@
-import os
-import json
+import save_cache
 from BitUtils import BitBuffer
-from Items import  Starting_Mounts, Starting_Pets, Starting_Charms, Starting_Materials, Starting_Consumables, Active_master_Class, Starter_Weapons, Active_Abilities
-from constants import inventory_gears
-from default_abilities import default_learned_abilities
-from constants import Mastery_Class
+from char_template import TemplatedCharacter
 #Hints Do not delete
 """
 
@@ -72,30 +68,23 @@ DEFAULT_GEAR = {
     ],
 }
 
-CHAR_SAVE_DIR = "saves"
-
 def load_characters(user_id: str) -> list[dict]:
-    """Load the list of characters for a given user_id."""
-    path = os.path.join(CHAR_SAVE_DIR, f"{user_id}.json")
-    if not os.path.exists(path):
+    """
+    Load the list of characters for a given user_id. The list is the one
+    inside the cached save document, so it stays in sync with player_data.
+    """
+    data = save_cache.load_save(user_id)
+    if data is None:
         return []
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get("characters", [])
+    return data.setdefault("characters", [])
 
 def save_characters(user_id: str, char_list: list[dict]):
     """Save the list of characters for a given user_id, preserving other fields."""
-    os.makedirs(CHAR_SAVE_DIR, exist_ok=True)
-    path = os.path.join(CHAR_SAVE_DIR, f"{user_id}.json")
-    # Load existing to preserve email
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    else:
+    data = save_cache.load_save(user_id)
+    if data is None:
         data = {"email": None, "characters": []}
     data["characters"] = char_list
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    save_cache.write_save(user_id, data)
 
 def make_character_dict_from_tuple(character):
     """
@@ -126,15 +115,7 @@ def make_character_dict_from_tuple(character):
         default = DEFAULT_GEAR.get(cls, [[0]*6]*6)
         gear_list = [list(slot) for slot in default]
 
-    starting_inventory = inventory_gears.get(cls, [])
-    starting_abilities = default_learned_abilities.get(cls, [])
-    starting_talent = Active_master_Class.get(cls, [])
-    Starting_Mastery = Mastery_Class.get(cls, [])
-    starter_gear = Starter_Weapons.get(cls, [])
-    Starting_Active_Abilities = Active_Abilities.get(cls, [])
-
-    char_dict = {
-        "CurrentLevel": "BridgeTown",
+    return TemplatedCharacter(cls, {
         "name":       name,
         "class":      class_name,
         "level":      level,
@@ -147,220 +128,7 @@ def make_character_dict_from_tuple(character):
         "skinColor":  skin_color,
         "shirtColor": shirt_color,
         "pantColor":  pant_color,
-        "equippedGears": starter_gear,
-        "xp":             10,
-        "gold":           100000,
-        "Gems":           100000,# this is the XP for the magic forge
-        "DragonOre":      100000,
-        "mammothIdols":   100000,
-        "DragonKeys":     100000,
-        "SilverSigils":   100000,
-        "showHigher":     True,
-        "MasterClass": starting_talent,
-        "Mastery" : Starting_Mastery,
-        #=================
-        "magicForge": {
-            "stats": [
-                10,
-                0,
-                10,
-                10,
-                10,
-                10,
-                10
-            ],
-            "hasSession": False,
-            "primary": 0,
-            "secondary": 0,
-            "status": 0,
-            "duration": 0,
-            "var_8": 0,
-            "usedlist": 0,
-            "var_2675": 0,
-            "var_2316": 0,
-            "var_2434": False
-        },
-        #===================
-        "activeAbilities": Starting_Active_Abilities,
-        "craftTalentPoints": [5, 5, 5, 5, 5],# these are the Magic Forge upgrade points Max value is 10 each
-        "towerPoints": [50, 50, 50],# Talent upgrade 50 Max each
-
-        "equippedMount": 5,
-        "equippedPetID": 1,
-        "petIteration": 0,
-        "activeConsumableID": 13,
-        "queuedConsumableID": 12,
-        "research": {
-        "abilityID": 0,
-        "ReadyTime": 0
-        },
-        "buildingResearch": {
-        "slotID": 0,
-        "finishTime": 0
-        },
-        "towerResearch": {
-        "masterClassID": 0,
-        "endTime": 0
-        },
-        "eggData": {
-        "typeID": 0,
-        "resetEndTime": 0
-        },
-        "eggPetIDs": [1, 2, 30, 27, 5,35,20,17],
-        "activeEggCount": 8,
-        "restingPets": [
-            {"typeID": 1, "level": 1, "extraValue": 0},
-            {"typeID": 2, "level": 1, "extraValue": 0},
-            {"typeID": 30, "level": 1, "extraValue": 0},
-            {"typeID": 27, "level": 1, "extraValue": 0}
-        ],
-        "missions": {
-            "1": {
-                "state": 0
-            },
-            "2": {
-                "state": 0
-            },
-            "3": {
-                "state": 0
-            }
-        },
-        "learnedAbilities": starting_abilities,
-        "inventoryGears":  starting_inventory,
-        "lockboxes": [{"lockboxID": 1, "count": 100}],
-        "gearSets": [
-        ],
-        "mounts":Starting_Mounts,
-        "pets":Starting_Pets,
-        "charms":Starting_Charms,
-        "materials":Starting_Materials,
-        "consumables":Starting_Consumables,
-        "friends": [
-            {
-                "name": "Neutral",
-                "className": "Paladin",
-                "level": 40,
-                "stateVersion": 5
-            },
-            {
-                "name": "Neo",
-                "className": "Mage",
-                "level": 20,
-                "stateVersion": 5
-            },
-            {
-                "name": "Tired",
-                "className": "Rogue",
-                "level": 23,
-                "stateVersion": 5
-            },
-            {
-                "name": "Telahair",
-                "className": "Mage",
-                "level": 23,
-                "stateVersion": 5
-            }
-        ],
-        "guild": {
-            "name": "KnightsOfValor",
-            "rank": 2,
-            "onlineMembers": [
-                {
-                    "name": "Teggdel",
-                    "classID": 0,
-                    "level": 45,
-                    "status": 1
-                },
-                {
-                    "name": "ProGooner",
-                    "classID": 1,
-                    "level": 50,
-                    "status": 3
-                },
-                {
-                    "name": "Fitler",
-                    "classID": 2,
-                    "level": 47,
-                    "status": 3
-                },
-                {
-                    "name": "DrHouse",
-                    "classID": 2,
-                    "level": 22,
-                    "status": 3
-                },
-                {
-                    "name": "FriendlyNephit",
-                    "classID": 1,
-                    "level": 43,
-                    "status": 3
-                },
-                {
-                    "name": "SneakyMcStab",
-                    "classID": 1,
-                    "level": 48,
-                    "status": 1
-                },
-                {
-                    "name": "HolyTickler",
-                    "classID": 0,
-                    "level": 42,
-                    "status": 1
-                },
-                {
-                    "name": "WizzyMcFizzle",
-                    "classID": 2,
-                    "level": 46,
-                    "status": 0
-                },
-                {
-                    "name": "PwnyThePaladin",
-                    "classID": 0,
-                    "level": 40,
-                    "status": 1
-                },
-                {
-                    "name": "StabbyMcSneak",
-                    "classID": 1,
-                    "level": 44,
-                    "status": 0
-                },
-                {
-                    "name": "SparkleFart",
-                    "classID": 2,
-                    "level": 39,
-                    "status": 1
-                },
-                {
-                    "name": "SirGiggles",
-                    "classID": 0,
-                    "level": 41,
-                    "status": 2
-                },
-                {
-                    "name": "RogueyMcRoguface",
-                    "classID": 1,
-                    "level": 47,
-                    "status": 2
-                },
-                {
-                    "name": "MagicTickler",
-                    "classID": 2,
-                    "level": 43,
-                    "status": 1
-                },
-                {
-                    "name": "ShieldyMcBloop",
-                    "classID": 0,
-                    "level": 38,
-                    "status": 0
-                }
-            ]
-        },
-
-    }
-
-    return char_dict
+    })
 
 def build_paperdoll_packet(character_dict):
 
@@ -1,10 +1,12 @@
-import json, struct
+import struct
 from bitreader import BitReader
 from constants import GearType, EntType, class_64, class_1, DyeType, class_118, method_277, GAME_CONST_209, \
     CLASS_118_CONST_127, class_111, class_1_const_254, class_8, class_3
 from BitUtils import BitBuffer
-from constants import get_dye_color
-SAVE_PATH_TEMPLATE = "saves/{user_id}.json"
+from constants import get_dye_color, LockboxType
+import loot
+import save_cache
+import timers
 
 def handle_hotbar_packet(session, raw_data):
     payload = raw_data[4:]
@@ -43,12 +45,10 @@ def handle_hotbar_packet(session, raw_data):
         print(f"[WARNING] Character {session.current_character} not found in save!")
         return
 
-    # 6) Persist full JSON
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+    # 6) Persist
+    save_cache.save_character(session.user_id, session.player_data, char, ["activeAbilities"])
 
-    print(f"[Save] activeAbilities for {session.current_character} = {active} saved to {save_path}")
+    print(f"[Save] activeAbilities for {session.current_character} = {active} saved to {save_cache.save_path(session.user_id)}")
 
 def send_mastery_packet(session, entity_id):
     # 1) Fetch slots for current MasterClass
@@ -105,8 +105,7 @@ def handle_masterclass_packet(session, raw_data):
     else:
         return
 
-    with open(SAVE_PATH_TEMPLATE.format(user_id=session.user_id), "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
+    save_cache.save_character(session.user_id, pd, char, ["MasterClass"])
 
     bb = BitBuffer()
     bb.write_method_4(entity_id)
@@ -122,12 +121,11 @@ def handle_research_packet(session, raw_data):
     chars = pd.get("characters", pd if isinstance(pd, list) else [])
     for char in chars:
         if char.get("name") == session.current_character:
+            timers.stop_timer(session.user_id, char, "towerResearch")
             char["towerResearch"] = {"masterClassID": 0, "endTime": 0}
+            save_cache.save_character(session.user_id, pd, char, ["towerResearch"])
             break
 
-    with open(SAVE_PATH_TEMPLATE.format(user_id=session.user_id), "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-
     session.conn.sendall(struct.pack(">HH", 0xDF, 0))
     print(f"[Reply 0xDF] Cleared research for {session.current_character}")
 
@@ -179,12 +177,10 @@ def handle_gear_packet(session, raw_data):
         if not any(g.get("gearID") == gear_id for g in inv):
             inv.append(gear_data.copy())  # keep dye/rune info consistent
 
+        # Save
+        save_cache.save_character(session.user_id, pd, char, ["inventoryGears", "equippedGears"])
         break
 
-    # Save
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
     print(f"[Save] slot {slot} updated with gear {gear_id}, inventory count = {len(inv)}")
 
     # Echo back to client
@@ -239,13 +235,11 @@ def handle_apply_dyes(session, entity_id, dyes_by_slot, preview_only, primary_dy
             else:
                 print(f"[Warning] Unknown secondary dye ID: {secondary_dye}")
 
+        # Save updated data
+        save_cache.save_character(session.user_id, pd, char,
+                                  ["equippedGears", "inventoryGears", "shirtColor", "pantColor"])
         break  # Done updating current character
 
-    # Save updated data
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-
     print("[Save] Dye info applied and synced to inventory.")
     char_data = next((c for c in chars if c.get("name") == session.current_character), {})
     shirt_rgb = char_data.get("shirtColor")
@@ -393,9 +387,7 @@ def handle_rune_packet(session, raw_data):
 
 
     # Save updated data
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
+    save_cache.save_character(session.user_id, pd, char, ["equippedGears", "inventoryGears", "charms"])
     print(f"[Save] Rune {rune_id} applied to slot {rune_slot} for gear {gear_id} (tier {gear_tier})")
 
     # Echo response to client
@@ -484,12 +476,11 @@ def handle_change_look(session, raw_data, all_sessions):
             char["gender"] = gender
             char["hairColor"] = hair_color
             char["skinColor"] = skin_color
-            break
 
-    # Save updated data to disk
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+            # Save updated data to disk
+            save_cache.save_character(session.user_id, session.player_data, char,
+                                      ["headSet", "hairSet", "mouthSet", "faceSet", "gender", "hairColor", "skinColor"])
+            break
 
     # Send the look update packet to the requesting client
     entity_id = session.clientEntID  # The entity ID of the character
@@ -534,10 +525,8 @@ def handle_create_gearset(session, raw_data):
         return
 
     # persist
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-    print(f"[Save] Created gearset slot {slot_idx} in {save_path}")
+    save_cache.save_character(session.user_id, pd, char, ["gearSets"])
+    print(f"[Save] Created gearset slot {slot_idx} in {save_cache.save_path(session.user_id)}")
 
     # echo back so the client will show the "Enter name" popup
     session.conn.sendall(raw_data)
@@ -585,10 +574,8 @@ def handle_name_gearset(session, raw_data):
         return
 
     # Persist
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-    print(f"[Save] Renamed gearset slot {slot_idx} to “{name}” in {save_path}")
+    save_cache.save_character(session.user_id, pd, char, ["gearSets"])
+    print(f"[Save] Renamed gearset slot {slot_idx} to “{name}” in {save_cache.save_path(session.user_id)}")
 
     # Echo back to client
     session.conn.sendall(raw_data)
@@ -627,10 +614,8 @@ def handle_apply_gearset(session, raw_data):
         return
 
     # Persist
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-    print(f"[Save] Assigned equipped gears to gearset slot {slot_idx} in {save_path}")
+    save_cache.save_character(session.user_id, pd, char, ["gearSets"])
+    print(f"[Save] Assigned equipped gears to gearset slot {slot_idx} in {save_cache.save_path(session.user_id)}")
 
     # Echo back to client
     session.conn.sendall(raw_data)
@@ -688,14 +673,23 @@ def handle_update_equipment(session, raw_data):
         return
 
     # Persist
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pd, f, indent=2)
-    print(f"[Save] Updated equippedGears for {session.current_character} in {save_path}")
+    save_cache.save_character(session.user_id, pd, char, ["equippedGears", "inventoryGears"])
+    print(f"[Save] Updated equippedGears for {session.current_character} in {save_cache.save_path(session.user_id)}")
 
     # Echo back to client
     session.conn.sendall(raw_data)
 
+def forge_update_packet(mf):
+    """0xCD “forge update”: the forge finished (sped up, or its timer ran out)."""
+    bb = BitBuffer()
+    bb.write_method_6(mf.get("primary", 0), class_1_const_254)
+    bb.write_method_91(mf.get("var_2675", 0))
+    bb.write_method_91(mf.get("var_2316", 0))
+    bb._append_bits(0, 1)  # no secondary/usedlist
+
+    resp_payload = bb.to_bytes()
+    return struct.pack(">HH", 0xcd, len(resp_payload)) + resp_payload
+
 def magic_forge_packet(session, data):
     from constants import LinkUpdater, class_111, class_1_const_254, class_64_const_218, class_111_const_432
 
@@ -721,23 +715,13 @@ def magic_forge_packet(session, data):
         # Mark forge as sped‑up
         mf["status"]   = class_111.const_264  # completed via speed‑up
         mf["duration"] = 0
+        timers.stop_timer(session.user_id, char, "magicForge")
 
 
         # Persist save
-        save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(session.player_data, f, indent=2)
+        save_cache.save_character(session.user_id, session.player_data, char, ["magicForge", "mammothIdols"])
 
-        # Build the 0xCD “forge update” response
-        bb = BitBuffer()
-        bb.write_method_6(mf.get("primary", 0), class_1_const_254)
-        bb.write_method_91(mf.get("var_2675", 0))
-        bb.write_method_91(mf.get("var_2316", 0))
-        bb._append_bits(0, 1)  # no secondary/usedlist
-
-        resp_payload = bb.to_bytes()
-        resp = struct.pack(">HH", 0xcd, len(resp_payload)) + resp_payload
-        session.conn.sendall(resp)
+        session.conn.sendall(forge_update_packet(mf))
         print(f"[{session.addr}] Sent 0xCD forge‑update (speed‑up applied)")
 
     else:
@@ -781,6 +765,7 @@ def collect_forge_charm(session, data):
         #print(f"[{session.addr}] Granted charmID={charm_id}. New counts: {char['charms']}")
 
     # 3) Clear the forge session
+    timers.stop_timer(session.user_id, char, "magicForge")
     mf["hasSession"] = False
     mf["primary"]    = 0
     mf["secondary"]  = 0
@@ -791,10 +776,8 @@ def collect_forge_charm(session, data):
     mf["var_2434"]   = False
     mf["status"]     = 0
 
-    # 4) Persist the full save file
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+    # 4) Persist the forge and charms
+    save_cache.save_character(session.user_id, session.player_data, char, ["magicForge", "charms"])
     #print(f"[{session.addr}] Forge session cleared and save updated")
 
     # 5) Reply with an empty 0xD0 packet to ACK
@@ -877,11 +860,11 @@ def start_forge_packet(session, data):
         "var_2316": 0,
         "var_2434": True
     })
+    timers.start_timer(session.user_id, char, "magicForge", mf["duration"] / 1000)
 
-    # 8) Persist the full save
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+    # 8) Persist what changed
+    save_cache.save_character(session.user_id, session.player_data, char,
+                              ["materials", "consumables", "magicForge"])
     print(f"[{session.addr}] Materials and consumables deducted and forge session saved")
 
 
@@ -901,6 +884,7 @@ def cancel_forge_packet(session, data):
 
     # 2) Clear the forge session (no gem, no secondary, no timer)
     mf = char.setdefault("magicForge", {})
+    timers.stop_timer(session.user_id, char, "magicForge")
     mf["hasSession"] = False
     mf["status"]     = 0
     mf["duration"]   = 0
@@ -913,9 +897,7 @@ def cancel_forge_packet(session, data):
     mf["var_2434"]   = False
 
     # 3) Persist the change
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+    save_cache.save_character(session.user_id, session.player_data, char, ["magicForge"])
     print(f"[{session.addr}] Forge session canceled and save updated")
 
 def allocate_talent_points(session, data):
@@ -941,9 +923,30 @@ def allocate_talent_points(session, data):
     char["craftTalentPoints"] = points
 
     # Persist
-    save_path = SAVE_PATH_TEMPLATE.format(user_id=session.user_id)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(session.player_data, f, indent=2)
+    save_cache.save_character(session.user_id, session.player_data, char, ["craftTalentPoints"])
     print(f"[{session.addr}] Saved new craftTalentPoints for {char['name']}")
 
 
+def handle_open_lockbox(session, data):
+    """
+    Handle 0x107: the client opened one lockbox (it already took the box
+    and a Dragon Key off its own count). Replies 0x108 per reward.
+    """
+    payload = data[4:]
+    lockbox_id = BitReader(payload).read_bits(LockboxType.OPEN_BITS) if payload else 1
+
+    chars = session.player_data.get("characters", [])
+    char = next((c for c in chars if c.get("name") == session.current_character), None)
+    if char is None:
+        print(f"[{session.addr}] Character {session.current_character} not found")
+        return
+
+    rewards, changed = loot.open_lockboxes(char, lockbox_id, 1)
+    if not rewards:
+        print(f"[{session.addr}] Lockbox {lockbox_id}: no box or no key left")
+        return
+    session.conn.sendall(b"".join(loot.reward_packet(entry) for entry in rewards))
+    save_cache.save_character(session.user_id, session.player_data, char, sorted(changed))
+    for entry in rewards:
+        print(f"[{session.addr}] Lockbox reward: pack={entry.pack_id} pos={entry.position} "
+              f"{entry.reward_type} {entry.name} ({entry.rarity})")
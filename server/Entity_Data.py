@@ -1,20 +1,51 @@
+import copy
 import json
+import os
+import struct
 
-def load_npc_data_for_level(level_name: str, json_path: str = r"data/npc_data.json") -> list:
+import boot
+from entity import Send_Entity_Data
+
+NPC_DATA_PATH = os.path.join(boot.DATA_DIR, "npc_data.json")
+
+_npc_spawns = None          # level name -> list of NPC dicts, never handed out directly
+
+
+def read_npc_spawns(json_path: str = NPC_DATA_PATH) -> dict:
+    try:
+        with open(json_path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error loading NPC data: {e}")
+        return {}
+
+
+def encode_spawn_packets(npcs: list) -> bytes:
+    out = bytearray()
+    for npc in npcs:
+        payload = Send_Entity_Data(npc, is_player=False)
+        out += struct.pack(">HH", 0x0F, len(payload)) + payload
+    return bytes(out)
+
+
+def _spawns() -> dict:
+    global _npc_spawns
+    if _npc_spawns is None:
+        _npc_spawns = boot.section("npc_spawns") or read_npc_spawns()
+    return _npc_spawns
+
+
+def load_npc_data_for_level(level_name: str, json_path: str = None) -> list:
     """
     Args:
         level_name (str): The level identifier (e.g., 'TutorialBoat').
-        json_path (str): Path to the JSON file containing NPC data.
+        json_path (str): Path to a JSON file to read instead of the cached data/npc_data.json.
 
     Returns:
         list: List of dictionaries, each containing NPC data for the given level.
+              The caller owns them (npc_sim.LevelSim shares them across the level).
     """
-    try:
-        with open(json_path, 'r') as file:
-            npc_data = json.load(file)
-        return npc_data.get(level_name, [])
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading NPC data: {e}")
-        return []
-
+    if json_path is not None:
+        return read_npc_spawns(json_path).get(level_name, [])
+    return copy.deepcopy(_spawns().get(level_name, []))
 
@@ -1,53 +1,49 @@
 # accounts.py
 
-import os
-import json
-import tempfile
 from threading import Lock
 from uuid import uuid4
 
-_ACCOUNTS_PATH = "Accounts.json"
-_SAVES_DIR     = "saves"
+import save_cache
+from storage import get_storage
+
 _lock          = Lock()
+_index         = None   # cached email -> user_id
+_index_version = None
 
-def _atomic_write(path: str, data) -> None:
+def _cached_index() -> dict[str, str]:
     """
-    Atomically write JSON-serializable `data` to `path`.
-    Writes to a temp file then renames it into place.
+    The email→user_id map, re-read only when the stored accounts changed
+    (another worker process registered someone). Caller holds _lock.
     """
-    # Ensure directory exists
-    dirpath = os.path.dirname(path) or "."
-    os.makedirs(dirpath, exist_ok=True)
-
-    # Write to a temp file in the same directory
-    with tempfile.NamedTemporaryFile("w", dir=dirpath, delete=False, encoding="utf-8") as tf:
-        json.dump(data, tf, ensure_ascii=False, indent=2)
-        tf.flush()
-        os.fsync(tf.fileno())
-
-    # Atomically replace the target
-    os.replace(tf.name, path)
+    global _index, _index_version
+    storage = get_storage()
+    version = storage.accounts_version()
+    if _index is None or version != _index_version:
+        _index = storage.read_accounts()
+        _index_version = version
+    return _index
 
 def load_accounts() -> dict[str, str]:
     """
-    Load Accounts.json and return a dict mapping email → user_id.
-    If the file is missing or corrupted, returns an empty dict.
+    Return a dict mapping email → user_id.
+    If Accounts.json is missing or corrupted, returns an empty dict.
     """
-    try:
-        with open(_ACCOUNTS_PATH, "r", encoding="utf-8") as f:
-            entries = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-    # entries is a list of {"email":..., "user_id":...}
-    return { e["email"]: e["user_id"] for e in entries }
+    with _lock:
+        return dict(_cached_index())
+
+def lookup_user_id(email: str):
+    """user_id for `email`, or None if it has no account."""
+    with _lock:
+        return _cached_index().get(email.strip().lower())
 
 def save_accounts_index(index: dict[str, str]) -> None:
     """
-    Persist the email→user_id map to Accounts.json atomically.
+    Persist the email→user_id map (Accounts.json is written atomically).
     """
-    entries = [ {"email": email, "user_id": uid} for email, uid in index.items() ]
+    global _index
     with _lock:
-        _atomic_write(_ACCOUNTS_PATH, entries)
+        get_storage().write_accounts(index)
+        _index = None
 
 def get_or_create_user_id(email: str) -> str:
     """
@@ -55,21 +51,16 @@ def get_or_create_user_id(email: str) -> str:
     Always lowercases the email for consistency.
     """
     email = email.strip().lower()
-    accounts = load_accounts()
-
-    if email in accounts:
-        return accounts[email]
+    with _lock:
+        accounts = _cached_index()
+        if email in accounts:
+            return accounts[email]
 
-    # New registration
-    user_id = uuid4().hex[:12]
-    accounts[email] = user_id
-    save_accounts_index(accounts)
+        # New registration
+        user_id = uuid4().hex[:12]
+        get_storage().add_account(email, user_id)
 
-    # Initialize an empty save file
-    os.makedirs(_SAVES_DIR, exist_ok=True)
-    save_path = os.path.join(_SAVES_DIR, f"{user_id}.json")
-    _atomic_write(save_path, {"email": email, "characters": []})
+    # Initialize an empty save
+    save_cache.write_save(user_id, {"email": email, "characters": []})
 
     return user_id
-
-
@@ -0,0 +1,216 @@
+# aoi.py
+"""
+Area of interest: which players can see which entities inside a level.
+
+Positions come from the level's entity store (entity_store.py), which
+movement writes to; its vectorized within() answers the radius queries.
+A LevelGrid keeps only which entities are players and who sees whom. A
+player sees every other player within VIEW_RADIUS, and keeps
+seeing it until it is farther than VIEW_RADIUS * LEAVE_FACTOR, so someone
+standing on the edge doesn't flicker. Visibility is symmetric, so one set
+per player answers both "who do I see" and "who sees me".
+
+Movement (queued per observer, see movement.py), power casts and hits go
+only to the players that can see the entity. A player coming into view
+is sent as 0x0F, one leaving view is removed with 0x0D. NPCs are spawned for the whole level at 0x08, so they
+never get enter/leave events; their updates go to the players near them.
+
+    grid = level_grid(session.current_level)
+    send_visibility(grid.update(session, ent_id, x, y))
+    grid.send_to_observers(ent_id, packet, exclude=session)
+    send_visibility(grid.remove(ent_id))             # on disconnect
+
+DBZ_VIEW_RADIUS overrides the radius (in level units).
+"""
+import os
+import struct
+import threading
+
+import entity_store
+import movement
+from BitUtils import BitBuffer
+from entity import Send_Entity_Data
+
+VIEW_RADIUS = float(os.environ.get("DBZ_VIEW_RADIUS", 1600))
+LEAVE_FACTOR = 1.25
+
+ENTER = "enter"
+LEAVE = "leave"
+
+_counters = {"enter": 0, "leave": 0, "sent": 0, "culled": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(**deltas) -> None:
+    with _counters_lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def counters() -> dict:
+    """Visibility events and fan-out totals since start (a metrics gauge)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+class LevelGrid:
+    def __init__(self, level_name: str, radius: float = VIEW_RADIUS):
+        self.level_name = level_name
+        self.radius = radius
+        self.leave_radius = radius * LEAVE_FACTOR
+        self.store = entity_store.level_store(level_name)
+        self._lock = threading.Lock()
+        self._sessions = {}    # player entity ID -> session
+        self._visible = {}     # player entity ID -> player entity IDs it sees (and is seen by)
+
+    # ─── players ─────────────────────────────────────────────────────────
+    def update(self, session, ent_id, x: float, y: float) -> list:
+        """
+        Place or move a player. Its position must already be in the store
+        (the caller wrote it, or add_entity() did at 0x08). Returns the
+        visibility events it caused: (observer session, ENTER or LEAVE,
+        subject session, subject ID).
+        """
+        events = []
+        with self._lock:
+            self._sessions[ent_id] = session
+            visible = self._visible.setdefault(ent_id, set())
+
+            for other in self.store.within(x, y, self.radius):
+                if other == ent_id or other in visible or other not in self._sessions:
+                    continue
+                visible.add(other)
+                self._visible[other].add(ent_id)
+                other_session = self._sessions[other]
+                events.append((session, ENTER, other_session, other))
+                events.append((other_session, ENTER, session, ent_id))
+
+            staying = set(self.store.within(x, y, self.leave_radius))
+            for other in [o for o in visible if o not in staying]:
+                visible.discard(other)
+                self._visible[other].discard(ent_id)
+                other_session = self._sessions[other]
+                events.append((session, LEAVE, other_session, other))
+                events.append((other_session, LEAVE, session, ent_id))
+        return events
+
+    def remove(self, ent_id) -> list:
+        """Drop a player; everyone who saw it gets a LEAVE event."""
+        events = []
+        with self._lock:
+            if ent_id not in self._sessions:
+                return events
+            session = self._sessions.pop(ent_id)
+            for other in self._visible.pop(ent_id, ()):
+                self._visible[other].discard(ent_id)
+                events.append((self._sessions[other], LEAVE, session, ent_id))
+        return events
+
+    # ─── queries and fan-out ─────────────────────────────────────────────
+    def observers(self, ent_id) -> list:
+        """Sessions that should receive updates about `ent_id`."""
+        with self._lock:
+            if ent_id in self._sessions:
+                return [self._sessions[o] for o in self._visible.get(ent_id, ())]
+            where = self.store.position(ent_id)
+            if where is None:
+                return []
+            return [self._sessions[o] for o in self.store.within(where[0], where[1], self.radius)
+                    if o in self._sessions]
+
+    def players(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def position(self, ent_id):
+        """(x, y) of an entity in the level, or None."""
+        return self.store.position(ent_id)
+
+    def session_of(self, ent_id):
+        """The session playing `ent_id`, or None for NPCs and players elsewhere."""
+        return self._sessions.get(ent_id)
+
+    def sessions(self) -> list:
+        """Every player session in the level."""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def player_positions(self) -> list:
+        """(x, y) of every player in the level."""
+        with self._lock:
+            players = list(self._sessions)
+        return self.store.positions(players)
+
+    def send_to_observers(self, ent_id, packet: bytes, exclude=None) -> int:
+        """Send `packet` to every session that sees `ent_id`. Returns how many got it."""
+        observers = self.observers(ent_id)
+        sent = 0
+        for other in observers:
+            if other is not exclude and other.world_loaded:
+                try:
+                    other.conn.sendall(packet)
+                except OSError:
+                    continue    # its own handler notices the dead socket
+                sent += 1
+        # Everyone else in the level would have received it before
+        _count(sent=sent, culled=max(0, self.players() - sent - (exclude is not None)))
+        return sent
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def level_grid(level_name: str) -> LevelGrid:
+    grid = _grids.get(level_name)
+    if grid is None:
+        with _grids_lock:
+            grid = _grids.setdefault(level_name, LevelGrid(level_name))
+    return grid
+
+
+def players_per_level() -> dict:
+    with _grids_lock:
+        grids = list(_grids.items())
+    return {name: grid.players() for name, grid in grids}
+
+
+# ─── packets ─────────────────────────────────────────────────────────────
+def destroy_packet(ent_id) -> bytes:
+    """0x0D PKTTYPE_ENT_DESTROY: the client drops the entity."""
+    bb = BitBuffer()
+    bb.write_method_4(ent_id)
+    bb.write_bits(0, 1)
+    payload = bb.to_bytes()
+    return struct.pack(">HH", 0x0D, len(payload)) + payload
+
+
+def send_visibility(events) -> None:
+    """Deliver the 0x0F / 0x0D packets for events from update()/remove()."""
+    if not events:
+        return
+    encoded = {}
+    enters = leaves = 0
+    for observer, kind, subject, subject_id in events:
+        # 0x0F carries the full state and 0x0D ends it: a queued move is stale either way
+        movement.discard(observer, subject_id)
+        if kind == ENTER:
+            entity = subject.entities.get(subject_id) if subject is not None else None
+            if entity is None:
+                continue
+            key = (ENTER, subject_id)
+            if key not in encoded:
+                payload = Send_Entity_Data(entity, is_player=True)
+                encoded[key] = struct.pack(">HH", 0x0F, len(payload)) + payload
+            enters += 1
+        else:
+            key = (LEAVE, subject_id)
+            if key not in encoded:
+                encoded[key] = destroy_packet(subject_id)
+            leaves += 1
+        if observer.world_loaded:
+            try:
+                observer.conn.sendall(encoded[key])
+            except OSError:
+                pass    # its own handler notices the dead socket
+    _count(enter=enters, leave=leaves)
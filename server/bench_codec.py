@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the bit codec and the hot packet builders.
+
+Every case returns the bytes it produced, and those bytes are compared
+against bench_golden.json so an optimised codec can be checked
+byte-for-byte against the current one.
+
+    python bench_codec.py                  # benchmark + golden check
+    python bench_codec.py --check          # golden check only (exit 1 on mismatch)
+    python bench_codec.py --update-golden  # rewrite the stored baseline
+    python bench_codec.py -k entity        # only cases whose name contains "entity"
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import types
+from contextlib import contextmanager
+
+import WorldEnter
+from BitUtils import BitBuffer
+from bitreader import BitReader
+from Character import make_character_dict_from_tuple, build_login_character_list_bitpacked
+from entity import Send_Entity_Data
+from WorldEnter import Player_Data_Packet, build_enter_world_packet
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_golden.json")
+
+# Player_Data_Packet stamps the wall clock into the packet; pin it so the
+# output is reproducible.
+FROZEN_TIME = 1_700_000_000
+
+
+@contextmanager
+def frozen_clock(now=FROZEN_TIME):
+    real = WorldEnter.time
+    WorldEnter.time = types.SimpleNamespace(time=lambda: now)
+    try:
+        yield
+    finally:
+        WorldEnter.time = real
+
+
+# ─── fixtures ────────────────────────────────────────────────────────────
+INTS = [0, 1, 3, 7, 100, 255, 1023, 4096, 65535, 1 << 20, (1 << 30) - 1]
+SIGNED = [0, -1, 5, -300, 1458, -65535, 1 << 20]
+STRINGS = ["", "a", "CraftTown", "LevelsNR.swf/a_Level_NewbieRoad", "Ünïcödé ✓"]
+FLOATS = [0.0, 1.5, -3.25, 1458.99, 1e6]
+
+NPC = {
+    "id": 1, "name": "GreenKnightHard", "x": 6294.25, "y": 618.99, "z": 10.0,
+    "team": 0, "entState": 0, "untargetable": False, "behavior_id": 1,
+    "behavior_speed": 1.0, "level_str": "CraftTown", "var_1958": "testing",
+    "var_1879": "the guard", "level": 50, "power_id": 2, "facing_left": True,
+    "health_delta": 1, "buffs": [],
+}
+
+BUFFS = [
+    {"type_id": 12, "param1": 3, "param2": 0, "param3": 40, "param4": 1, "extra_data": []},
+    {"type_id": 87, "param1": 1, "param2": 2, "param3": 0, "param4": 0,
+     "extra_data": [{"id": 4, "values": [1.0, 2.5]}, {"id": 9, "values": [0.25]}]},
+]
+
+PLAYER = {
+    "id": 4321, "name": "BenchHero", "x": 360.0, "y": 1458.99, "z": 0.0,
+    "team": 1, "flag1": True, "flag2": False, "player_data1": 3, "player_data2": 17,
+    "mount_data": 0, "additional_data": 0, "has_additional_player_data": False,
+    "level": 50, "entState": 3, "facing_left": False, "player_level": 50,
+    "class_type": "Paladin", "health_delta": 0, "buffs": [],
+}
+
+EQUIPMENT = {str(slot): {"index": slot % 6, "value": slot % 4} for slot in (0, 1, 3, 6, 9, 14, 20)}
+
+CHARACTER_TUPLE = (
+    "BenchHero", "Paladin", 50,
+    "Male", "Head01", "Hair01", "Mouth01", "Face01",
+    0x3A2B1C, 0xE0B090, 0x224488, 0x333333,
+    None,
+)
+
+
+def _character():
+    return make_character_dict_from_tuple(CHARACTER_TUPLE)
+
+
+# ─── cases ───────────────────────────────────────────────────────────────
+def write_method_4():
+    bb = BitBuffer()
+    for v in INTS:
+        bb.write_method_4(v)
+    return bb.to_bytes()
+
+
+def write_method_6():
+    bb = BitBuffer()
+    for v in INTS:
+        bb.write_method_6(v, 31)
+    return bb.to_bytes()
+
+
+def write_signed_method_45():
+    bb = BitBuffer()
+    for v in SIGNED:
+        bb.write_signed_method_45(v)
+    return bb.to_bytes()
+
+
+def write_method_13():
+    bb = BitBuffer()
+    for s in STRINGS:
+        bb.write_method_13(s)
+    return bb.to_bytes()
+
+
+def write_utf_string():
+    bb = BitBuffer()
+    for s in STRINGS:
+        bb.write_utf_string(s)
+    return bb.to_bytes()
+
+
+def write_float():
+    bb = BitBuffer()
+    for f in FLOATS:
+        bb.write_float(f)
+    return bb.to_bytes()
+
+
+_M4_BYTES = write_method_4()
+_M45_BYTES = write_signed_method_45()
+_M13_BYTES = write_method_13()
+_UTF_BYTES = write_utf_string()
+_FLOAT_BYTES = write_float()
+
+
+def read_method_4():
+    br = BitReader(_M4_BYTES)
+    return repr([br.read_method_4() for _ in INTS]).encode()
+
+
+def read_method_45():
+    br = BitReader(_M45_BYTES)
+    return repr([br.read_method_45() for _ in SIGNED]).encode()
+
+
+def read_method_13():
+    br = BitReader(_M13_BYTES)
+    return repr([br.read_method_13() for _ in STRINGS]).encode()
+
+
+def read_string():
+    br = BitReader(_UTF_BYTES)
+    return repr([br.read_string() for _ in STRINGS]).encode()
+
+
+def read_float():
+    br = BitReader(_FLOAT_BYTES)
+    return repr([br.read_float() for _ in FLOATS]).encode()
+
+
+def entity_npc():
+    return Send_Entity_Data(NPC, is_player=False)
+
+
+def entity_npc_buffs():
+    return Send_Entity_Data(dict(NPC, buffs=BUFFS), is_player=False)
+
+
+def entity_player():
+    return Send_Entity_Data(PLAYER, is_player=True)
+
+
+def entity_player_equipment():
+    return Send_Entity_Data(dict(PLAYER, has_equipment=True, equipment=EQUIPMENT), is_player=True)
+
+
+def entity_player_equipment_buffs():
+    return Send_Entity_Data(dict(PLAYER, has_equipment=True, equipment=EQUIPMENT, buffs=BUFFS), is_player=True)
+
+
+_CHAR = _character()
+
+
+def player_data_packet():
+    with frozen_clock():
+        return Player_Data_Packet(_CHAR, transfer_token=4321)
+
+
+def player_data_packet_fresh():
+    # Includes building the character, as the 0x17 -> 0x1F path does
+    with frozen_clock():
+        return Player_Data_Packet(_character(), transfer_token=4321)
+
+
+def enter_world_packet():
+    return build_enter_world_packet(
+        transfer_token=4321, old_level_id=0, old_swf="", has_old_coord=False, old_x=0, old_y=0,
+        host="127.0.0.1", port=8080,
+        new_level_swf="LevelsNR.swf/a_Level_NewbieRoad", new_map_lvl=1, new_base_lvl=1,
+        new_internal="NewbieRoad", new_moment="", new_alter="", new_is_inst=False,
+        new_has_coord=False, new_x=0, new_y=0, char=_CHAR,
+    )
+
+
+_LOGIN_CHARS = [dict(_CHAR, name=f"BenchHero{i}", level=i * 7 % 51) for i in range(8)]
+
+
+def login_character_list_1():
+    return build_login_character_list_bitpacked(_LOGIN_CHARS[:1])
+
+
+def login_character_list_8():
+    return build_login_character_list_bitpacked(_LOGIN_CHARS)
+
+
+CASES = [
+    write_method_4, write_method_6, write_signed_method_45, write_method_13, write_utf_string, write_float,
+    read_method_4, read_method_45, read_method_13, read_string, read_float,
+    entity_npc, entity_npc_buffs, entity_player, entity_player_equipment, entity_player_equipment_buffs,
+    player_data_packet, player_data_packet_fresh, enter_world_packet,
+    login_character_list_1, login_character_list_8,
+]
+
+
+# ─── runner ──────────────────────────────────────────────────────────────
+def load_golden(path=GOLDEN_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_golden(outputs, path=GOLDEN_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: out.hex() for name, out in outputs.items()}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def check_golden(outputs, golden):
+    """Returns a list of human-readable mismatches."""
+    problems = []
+    for name, out in outputs.items():
+        expected = golden.get(name)
+        if expected is None:
+            problems.append(f"{name}: no baseline (run with --update-golden)")
+            continue
+        expected = bytes.fromhex(expected)
+        if out != expected:
+            first = next((i for i, (a, b) in enumerate(zip(out, expected)) if a != b), min(len(out), len(expected)))
+            problems.append(f"{name}: differs at byte {first} (got {len(out)} bytes, expected {len(expected)})")
+    return problems
+
+
+def bench(fn, min_time):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=5, number=number)) / number
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Codec / packet builder microbenchmarks")
+    ap.add_argument("-k", dest="filter", default="", help="only run cases containing this substring")
+    ap.add_argument("--check", action="store_true", help="golden check only, no timing")
+    ap.add_argument("--update-golden", action="store_true", help="rewrite the stored baseline")
+    ap.add_argument("--min-time", type=float, default=0.2, help="approx seconds per timing round")
+    args = ap.parse_args()
+
+    cases = [fn for fn in CASES if args.filter in fn.__name__]
+    outputs = {fn.__name__: fn() for fn in cases}
+
+    if args.update_golden:
+        golden = load_golden()
+        golden = {k: bytes.fromhex(v) for k, v in golden.items()}
+        golden.update(outputs)
+        save_golden(golden)
+        print(f"[Bench] Wrote {len(outputs)} baselines to {GOLDEN_PATH}")
+        return 0
+
+    problems = check_golden(outputs, load_golden())
+
+    if not args.check:
+        print(f"{'case':<32}{'bytes':>8}{'µs/op':>12}{'ops/s':>14}")
+        for fn in cases:
+            per_op = bench(fn, args.min_time)
+            print(f"{fn.__name__:<32}{len(outputs[fn.__name__]):>8}{per_op * 1e6:>12.2f}{1 / per_op:>14,.0f}")
+
+    if problems:
+        print("\n[Bench] Golden mismatches:")
+        for p in problems:
+            print("  " + p)
+        return 1
+    print(f"\n[Bench] Golden check passed for {len(outputs)} cases")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
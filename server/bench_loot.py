@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Draws per second for the loot tables (loot.py), against the old
+random.choice over a rebuilt dict, plus a check that the observed
+odds match the rarity weights.
+
+    python bench_loot.py                  # timing + odds check
+    python bench_loot.py --draws 1000000  # larger odds sample
+"""
+import argparse
+import random
+import sys
+import timeit
+from collections import Counter
+
+import loot
+from char_template import TemplatedCharacter
+
+BATCH = 1000
+
+
+def bench(fn, min_time):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Loot table benchmark")
+    ap.add_argument("--draws", type=int, default=200_000, help="draws for the odds check")
+    ap.add_argument("--min-time", type=float, default=0.2, help="approx seconds per timing round")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    table = loot.lockbox_table(1)
+    rng = random.Random(args.seed)
+    entries = table.entries
+
+    def uniform_rebuilt():
+        # what the 0x107 handler used to do per packet
+        reward_map = {e.position: (e.name, e.reward_type != "Gold") for e in entries}
+        return rng.choice(list(reward_map.items()))
+
+    def single():
+        return table.draw(rng)
+
+    def batch():
+        return table.draw_many(BATCH, rng)
+
+    def open_batch():
+        char = TemplatedCharacter("paladin", {"name": "Bench", "class": "Paladin"})
+        char["lockboxes"] = [{"lockboxID": 1, "count": BATCH}]
+        return loot.open_lockboxes(char, 1, BATCH, rng)
+
+    cases = [("uniform_rebuilt", uniform_rebuilt, 1), ("alias_draw", single, 1),
+             (f"alias_draw_many_{BATCH}", batch, BATCH), (f"open_lockboxes_{BATCH}", open_batch, BATCH)]
+    print(f"{'case':<28}{'µs/op':>12}{'draws/s':>16}")
+    for name, fn, draws in cases:
+        per_op = bench(fn, args.min_time)
+        print(f"{name:<28}{per_op * 1e6:>12.2f}{draws / per_op:>16,.0f}")
+
+    counts = Counter(table.draw_many(args.draws, rng))
+    worst = 0.0
+    print(f"\n{'entry':<28}{'rarity':>7}{'expected':>10}{'observed':>10}")
+    for entry in entries:
+        expected = table.chance(entry)
+        observed = counts[entry] / args.draws
+        worst = max(worst, abs(observed - expected))
+        print(f"{entry.name:<28}{entry.rarity:>7}{expected:>10.4f}{observed:>10.4f}")
+    # ~5 standard deviations of the largest share
+    tolerance = 5 * (0.25 / args.draws) ** 0.5
+    if worst > tolerance:
+        print(f"\n[Bench] Odds off by {worst:.4f} (tolerance {tolerance:.4f})")
+        return 1
+    print(f"\n[Bench] Odds match the rarity weights (worst deviation {worst:.4f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Time one NPC world-tick step (npc_sim.py) for 10, 100 and 1000 NPCs,
+on NumPy arrays when NumPy is installed and on the plain loop, and
+check that both give the same positions and dirty sets.
+
+    python bench_npc.py
+    python bench_npc.py --npcs 10 100 1000 10000 --players 32 --ticks 200
+"""
+import argparse
+import random
+import sys
+import time
+
+import npc_sim
+
+
+def make_npcs(n, rng, width=20000.0):
+    npcs = []
+    for i in range(n):
+        npcs.append({
+            "id": i + 1,
+            "x": rng.uniform(0, width),
+            "y": rng.choice((0.0, 400.0, 800.0)),
+            "behavior_speed": rng.choice((0.0, 0.5, 1.0, 1.0)),
+            "facing_left": rng.random() < 0.5,
+        })
+    return npcs
+
+
+def make_players(n, rng, width=20000.0):
+    return [(rng.uniform(0, width), rng.choice((0.0, 400.0, 800.0))) for _ in range(n)]
+
+
+def walk(players, rng, dt):
+    return [(x + rng.uniform(-300, 300) * dt, y) for x, y in players]
+
+
+def run(npcs, players, ticks, dt, seed):
+    """Step a fresh sim `ticks` times with players wandering. Returns (s/step, dirty sets, sim)."""
+    sim = npc_sim.LevelSim("Bench", [dict(n) for n in npcs])
+    rng = random.Random(seed)
+    dirty_log = []
+    elapsed = 0.0
+    for _ in range(ticks):
+        players = walk(players, rng, dt)
+        t0 = time.perf_counter()
+        dirty = sim.step(dt, players)
+        elapsed += time.perf_counter() - t0
+        dirty_log.append(dirty)
+    return elapsed / ticks, dirty_log, sim
+
+
+def main():
+    ap = argparse.ArgumentParser(description="NPC world-tick benchmark")
+    ap.add_argument("--npcs", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--players", type=int, default=16)
+    ap.add_argument("--ticks", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    dt = npc_sim.TICK_INTERVAL
+    numpy = npc_sim.np
+    backends = [("numpy", numpy), ("loop", None)] if numpy is not None else [("loop", None)]
+    if numpy is None:
+        print("[Bench] NumPy not installed: timing the loop fallback only")
+
+    print(f"{'npcs':>6}{'backend':>9}{'µs/step':>12}{'ns/npc':>10}{'dirty/step':>12}{'tick budget':>13}")
+    mismatch = False
+    for n in args.npcs:
+        rng = random.Random(args.seed)
+        npcs = make_npcs(n, rng)
+        players = make_players(args.players, rng)
+        results = {}
+        for name, module in backends:
+            npc_sim.np = module
+            try:
+                per_step, dirty_log, sim = run(npcs, players, args.ticks, dt, args.seed)
+            finally:
+                npc_sim.np = numpy
+            results[name] = (dirty_log, [float(x) for x in sim.x])
+            dirty = sum(map(len, dirty_log)) / len(dirty_log)
+            print(f"{n:>6}{name:>9}{per_step * 1e6:>12.1f}{per_step * 1e9 / n:>10.0f}"
+                  f"{dirty:>12.1f}{per_step / dt:>12.2%}")
+        if len(results) == 2:
+            (d1, x1), (d2, x2) = results["numpy"], results["loop"]
+            if d1 != d2 or any(abs(a - b) > 1e-6 for a, b in zip(x1, x2)):
+                print(f"[Bench] {n} NPCs: numpy and loop steps disagree")
+                mismatch = True
+    if len(backends) == 2 and not mismatch:
+        print("\n[Bench] numpy and loop steps agree")
+    return 1 if mismatch else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
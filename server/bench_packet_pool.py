@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+A burst of logins against packet_pool.py: --logins threads each build a
+0x15 and a 0x10 at once, while a stand-in for the movement flusher
+wakes every 5 ms. Reports how long the burst took and how late the
+flusher woke up, with packets built inline and with the pool, and
+checks the pool's bytes (pipe and shared memory) match inline builds.
+
+    python bench_packet_pool.py
+    python bench_packet_pool.py --logins 64 --workers 4
+"""
+import argparse
+import sys
+import threading
+import time
+
+import packet_pool
+from bench_codec import _character, frozen_clock
+from Character import build_login_character_list_bitpacked
+from metrics import Histogram
+from WorldEnter import Player_Data_Packet
+
+TICK = 0.005
+
+
+def check(char) -> list:
+    problems = []
+    packet_pool.INLINE_BELOW = 0      # everything goes to the pool
+    with frozen_clock():
+        want = Player_Data_Packet(char, transfer_token=4321)
+        if packet_pool.player_data(char, transfer_token=4321) != want:
+            problems.append("0x10 built in the pool differs")
+    chars = [dict(char, name=f"BenchHero{i}", level=i * 7 % 51) for i in range(8)]
+    if packet_pool.character_list(chars) != build_login_character_list_bitpacked(chars):
+        problems.append("0x15 built in the pool differs")
+    threshold, packet_pool.SHM_THRESHOLD = packet_pool.SHM_THRESHOLD, 0
+    try:
+        if packet_pool._receive(packet_pool._return(want)) != want:
+            problems.append("0x10 read back from shared memory differs")
+    finally:
+        packet_pool.SHM_THRESHOLD = threshold
+    return problems
+
+
+def burst(chars, inline_below):
+    packet_pool.INLINE_BELOW = inline_below
+    lag = Histogram()
+    done = threading.Event()
+
+    def flusher():
+        due = time.perf_counter() + TICK
+        while not done.is_set():
+            time.sleep(max(0.0, due - time.perf_counter()))
+            lag.observe(max(0.0, time.perf_counter() - due))
+            due += TICK
+
+    def login(char):
+        packet_pool.character_list([char])
+        packet_pool.player_data(char, transfer_token=1)
+
+    ticker = threading.Thread(target=flusher)
+    ticker.start()
+    time.sleep(0.05)
+    threads = [threading.Thread(target=login, args=(c,)) for c in chars]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    ticker.join()
+    return elapsed, lag.quantile(0.99), lag.max
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Packet build pool benchmark")
+    ap.add_argument("--logins", type=int, default=32)
+    ap.add_argument("--workers", type=int, default=2)
+    args = ap.parse_args()
+
+    chars = [_character() for _ in range(args.logins)]
+    inline_below = packet_pool.INLINE_BELOW
+    inline = burst(chars, inline_below=10 ** 9)
+    packet_pool.start(args.workers)
+    problems = check(chars[0])
+    pooled = burst(chars, inline_below=inline_below)
+
+    print(f"{'':>8}{'burst ms':>10}{'flusher lag p99 ms':>20}{'max ms':>9}")
+    for name, (elapsed, p99, worst) in (("inline", inline), ("pool", pooled)):
+        print(f"{name:>8}{elapsed * 1e3:>10.1f}{p99 * 1e3:>20.2f}{worst * 1e3:>9.2f}")
+    print(f"\n{args.logins} logins, {args.workers} workers; counters: {packet_pool.counters()}")
+    for p in problems:
+        print(f"[Bench] {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
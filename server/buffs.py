@@ -0,0 +1,336 @@
+# buffs.py
+"""
+Active buffs per level, expired on the world tick.
+
+A buff is identified by (target, buff type, caster): the same buff from
+two casters stacks, as on the client (Buff.method_1515). Each level keeps
+its buffs as tuples in a dict per target, and their deadlines in one
+min-heap, so the tick only looks at buffs that are actually due.
+Replacing or removing a buff leaves its old heap entry behind; it is
+skipped when popped, and the heap is rebuilt if those pile up.
+
+Changes are batched per tick: flush() compares each changed target's
+buffs with what they were at the last flush, so a buff added and gone
+within one tick is never sent, and a target hit by ten buffs costs its
+observers one write with ten entries instead of ten writes.
+
+    0x0B  PKTTYPE_ENT_ADD_BUFF     target, caster, buff type, 3 params, mods
+    0x0C  PKTTYPE_ENT_REMOVE_BUFF  target, caster, buff type
+
+A client that casts a buff has already applied it and is not sent it
+back. The client doesn't say how long a buff lasts (durations are in its
+BuffTypes data) and sends 0x0C when one ends; a buff it never ends goes
+after DEFAULT_DURATION, and that removal is sent to everyone but the
+target's and the caster's clients, which end it themselves. The entity's "buffs" list, which 0x0F carries to
+players who see it later, is rewritten on flush.
+
+    level_buffs("CraftTown").apply(entity, buff_type, caster, duration=5.0)
+    tick()                          # from the world tick (npc_sim.py)
+
+counters() is a metrics gauge. `python bench_buffs.py` measures a fight.
+"""
+import heapq
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import aoi
+import movement
+from BitUtils import BitBuffer
+from bitreader import BitReader
+
+DEFAULT_DURATION = 60.0     # seconds a client buff lasts if the client never removes it
+STALE_FACTOR = 2            # rebuild the heap when it holds this many entries per live buff
+
+# caster, the three params in Send_Entity_Data's order (CombatState.method_522
+# reads param2 as the stack count and param3 as the power type), the
+# powerNode modifiers ((id, (floats...)), ...), when it runs out (monotonic)
+# and whether a client's 0x0B applied it
+Buff = namedtuple("Buff", "caster param2 param3 param4 mods deadline client")
+
+EXPIRED = "expired"         # origin of a removal the server made on its own
+
+_counters = {"applied": 0, "removed": 0, "expired": 0, "cancelled_in_tick": 0,
+             "entities_sent": 0, "packets": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(**deltas) -> None:
+    with _counters_lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def counters() -> dict:
+    """Buffs applied/removed/expired and update packets since start (a metrics gauge)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+# ─── packets ─────────────────────────────────────────────────────────────
+def _write_add(bb: BitBuffer, target, type_id: int, buff: Buff) -> None:
+    # LinkUpdater.method_1902 hands these to method_522 as (caster, 3rd, 2nd, 1st)
+    bb.write_method_4(target)
+    bb.write_method_4(buff.caster)
+    bb.write_method_4(type_id)
+    bb.write_method_4(buff.param3)
+    bb.write_method_4(buff.param4)
+    bb.write_method_4(buff.param2)
+    bb.write_bits(1 if buff.mods else 0, 1)
+    if buff.mods:
+        bb.write_method_4(len(buff.mods))
+        for node_id, values in buff.mods:
+            bb.write_method_4(node_id)
+            bb.write_method_4(len(values))
+            for value in values:
+                bb.write_float(value)
+
+
+def add_packet(target, type_id: int, buff: Buff) -> bytes:
+    bb = BitBuffer()
+    _write_add(bb, target, type_id, buff)
+    payload = bb.to_bytes()
+    return struct.pack(">HH", 0x0B, len(payload)) + payload
+
+
+def remove_packet(target, type_id: int, caster) -> bytes:
+    bb = BitBuffer()
+    bb.write_method_4(target)
+    bb.write_method_4(caster)
+    bb.write_method_4(type_id)
+    payload = bb.to_bytes()
+    return struct.pack(">HH", 0x0C, len(payload)) + payload
+
+
+def entity_buffs(active: dict) -> list:
+    """A target's buffs as Send_Entity_Data's "buffs" list."""
+    return [{"type_id": type_id, "param1": b.caster, "param2": b.param2, "param3": b.param3,
+             "param4": b.param4,
+             "extra_data": [{"id": node_id, "values": list(values)} for node_id, values in b.mods]}
+            for (type_id, _), b in active.items()]
+
+
+# ─── per level ───────────────────────────────────────────────────────────
+class LevelBuffs:
+    def __init__(self, level_name: str):
+        self.level_name = level_name
+        self.lock = threading.Lock()
+        self.active = {}        # target ID -> {(buff type, caster): Buff}
+        self.entities = {}      # target ID -> the entity dict its 0x0F is encoded from
+        self.heap = []          # (deadline, target ID, buff type, caster)
+        self.changed = {}       # target ID -> {(buff type, caster): Buff or None at the last flush}
+        self.origin = {}        # (target ID, buff type, caster) -> session whose packet changed it
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(b) for b in self.active.values())
+
+    def _before(self, target, key, origin) -> None:
+        # remember the buff as it was at the last flush, the first time it changes this tick
+        before = self.changed.setdefault(target, {})
+        if key not in before:
+            before[key] = self.active.get(target, {}).get(key)
+        if origin is not None:
+            self.origin[(target, *key)] = origin
+        else:
+            self.origin.pop((target, *key), None)
+
+    def apply(self, entity: dict, type_id: int, caster=0, param2: int = 1, param3: int = 0,
+              param4: int = 0, mods=(), duration: float = DEFAULT_DURATION, now: float = None,
+              origin=None) -> Buff:
+        """Add the buff (or refresh it: a new deadline and params) on the entity."""
+        target = entity["id"]
+        now = time.monotonic() if now is None else now
+        buff = Buff(caster, param2, param3, param4, tuple(mods), now + duration, origin is not None)
+        key = (type_id, caster)
+        with self.lock:
+            self._before(target, key, origin)
+            self.active.setdefault(target, {})[key] = buff
+            self.entities[target] = entity
+            heapq.heappush(self.heap, (buff.deadline, target, type_id, caster))
+        _count(applied=1)
+        return buff
+
+    def remove(self, target, type_id: int, caster=0, origin=None) -> bool:
+        with self.lock:
+            active = self.active.get(target)
+            if not active or (type_id, caster) not in active:
+                return False
+            self._before(target, (type_id, caster), origin)
+            del active[(type_id, caster)]
+        _count(removed=1)
+        return True
+
+    def forget(self, target) -> None:
+        """The entity left the level: drop its buffs without telling anyone."""
+        with self.lock:
+            self.active.pop(target, None)
+            self.entities.pop(target, None)
+            self.changed.pop(target, None)
+            for key in [k for k in self.origin if k[0] == target]:
+                del self.origin[key]
+
+    def expire(self, now: float = None) -> int:
+        """Remove every buff whose deadline has passed. Returns how many."""
+        now = time.monotonic() if now is None else now
+        expired = 0
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                deadline, target, type_id, caster = heapq.heappop(heap)
+                active = self.active.get(target)
+                buff = active.get((type_id, caster)) if active else None
+                if buff is None or buff.deadline != deadline:
+                    continue    # removed or refreshed since: a stale entry
+                # a client's own buff: its client ends it too, don't send it the removal
+                self._before(target, (type_id, caster), EXPIRED if buff.client else None)
+                del active[(type_id, caster)]
+                expired += 1
+            live = sum(len(b) for b in self.active.values())
+            if len(heap) > STALE_FACTOR * live + 64:
+                self.heap = [(b.deadline, t, type_id, caster) for t, bs in self.active.items()
+                             for (type_id, caster), b in bs.items()]
+                heapq.heapify(self.heap)
+        if expired:
+            _count(expired=expired)
+        return expired
+
+    def take_changes(self) -> list:
+        """
+        [(target, [(packet, caster, origin), ...])] for targets whose buffs
+        differ from the last flush, and rewrite their entities' "buffs" lists.
+        """
+        out = []
+        cancelled = 0
+        with self.lock:
+            changed, self.changed = self.changed, {}
+            origins, self.origin = self.origin, {}
+            for target, before in changed.items():
+                active = self.active.get(target, {})
+                packets = []
+                for (type_id, caster), old in before.items():
+                    new = active.get((type_id, caster))
+                    if new is None:
+                        if old is None:
+                            cancelled += 1      # added and removed within the tick
+                        else:
+                            packets.append((remove_packet(target, type_id, caster), caster,
+                                            origins.get((target, type_id, caster))))
+                    elif old is None or new[:5] != old[:5]:
+                        packets.append((add_packet(target, type_id, new), caster,
+                                        origins.get((target, type_id, caster))))
+                entity = self.entities.get(target)
+                if entity is not None:
+                    entity["buffs"] = entity_buffs(active)
+                if not active:
+                    self.active.pop(target, None)
+                    self.entities.pop(target, None)
+                if packets:
+                    out.append((target, packets))
+        if cancelled:
+            _count(cancelled_in_tick=cancelled)
+        return out
+
+    def flush(self, now: float = None) -> int:
+        """Expire due buffs and send this tick's changes. Returns how many targets changed."""
+        self.expire(now)
+        changes = self.take_changes()
+        if not changes:
+            return 0
+        grid = aoi.level_grid(self.level_name)
+        batches = {}        # observer -> packets
+        packets = 0
+        for target, target_packets in changes:
+            packets += len(target_packets)
+            owner = grid.session_of(target)
+            sessions = grid.observers(target)
+            if owner is not None and owner not in sessions:
+                sessions.append(owner)
+            for packet, caster, origin in target_packets:
+                if origin is EXPIRED:
+                    skip = (owner, grid.session_of(caster))
+                else:
+                    skip = (origin,)
+                for session in sessions:
+                    if session not in skip and session.world_loaded:
+                        batches.setdefault(session, []).append(packet)
+        for observer, batch in batches.items():
+            movement.push(observer, b"".join(batch))
+        _count(entities_sent=len(changes), packets=packets)
+        return len(changes)
+
+
+_levels = {}
+_levels_lock = threading.Lock()
+
+
+def level_buffs(level_name: str) -> LevelBuffs:
+    buffs = _levels.get(level_name)
+    if buffs is None:
+        with _levels_lock:
+            buffs = _levels.setdefault(level_name, LevelBuffs(level_name))
+    return buffs
+
+
+def tick(now: float = None) -> int:
+    """Expire and send every level's buff changes (on the world tick)."""
+    changed = 0
+    with _levels_lock:
+        levels = list(_levels.values())
+    for buffs in levels:
+        try:
+            changed += buffs.flush(now)
+        except Exception as e:
+            print(f"[Buffs] Flush failed for {buffs.level_name}: {e}")
+    return changed
+
+
+def active_per_level() -> dict:
+    """Active buffs per level (a metrics gauge)."""
+    with _levels_lock:
+        levels = list(_levels.items())
+    return {name: len(b) for name, b in levels if b.active}
+
+
+# ─── handlers ────────────────────────────────────────────────────────────
+def _target_entity(session, target):
+    if target == session.clientEntID:
+        return session.entities.get(target)
+    import npc_sim
+    npc = npc_sim.level_sim(session.current_level).by_id.get(target)
+    if npc is not None:
+        return npc
+    owner = aoi.level_grid(session.current_level).session_of(target)
+    return owner.entities.get(target) if owner is not None else None
+
+
+def handle_add_buff(session, data: bytes) -> None:
+    """0x0B from the client: it applied a buff (LinkUpdater.method_1262)."""
+    br = BitReader(data[4:])
+    target = br.read_method_4()
+    caster = br.read_method_4()
+    type_id = br.read_method_4()
+    param3 = br.read_method_4()
+    param4 = br.read_method_4()
+    param2 = br.read_method_4()
+    mods = []
+    if br.read_bit():
+        for _ in range(br.read_method_4()):
+            node_id = br.read_method_4()
+            mods.append((node_id, tuple(br.read_float() for _ in range(br.read_method_4()))))
+    entity = _target_entity(session, target)
+    if entity is None or not session.current_level:
+        return
+    level_buffs(session.current_level).apply(entity, type_id, caster, param2, param3, param4,
+                                             mods, origin=session)
+
+
+def handle_remove_buff(session, data: bytes) -> None:
+    """0x0C from the client: a buff it applied ran out (LinkUpdater.method_1837)."""
+    br = BitReader(data[4:])
+    target = br.read_method_4()
+    caster = br.read_method_4()
+    type_id = br.read_method_4()
+    if session.current_level:
+        level_buffs(session.current_level).remove(target, type_id, caster, origin=session)
@@ -0,0 +1,472 @@
+# char_template.py
+"""
+Per-class starting data shared by every new character.
+
+A fresh character used to carry its own copy of the starting mounts, pets,
+charms, materials, consumables, inventory gears and guild roster, and all
+of it went into every save. Now each class template is built once and a
+TemplatedCharacter keeps only what differs from it:
+
+  - reading a template field copies nothing: a list or dict comes back
+    as a read-through view of the template, and the first change made
+    through it (at any depth) copies that one field into the character
+  - view() is a read-only mapping over character + template for packet
+    builders, which read everything and change nothing
+  - to_saved() is what gets persisted: {"template": <class>,
+    "templateVersion": <hash>, ...fields that differ from the template};
+    from_saved() turns that back into a TemplatedCharacter and leaves old
+    full saves as plain dicts
+
+The template is built from Items.py, data/*_gears.json and the dict
+below, so editing any of them changes it. Each version is archived under
+its hash in the storage backend (storage.py) the first time it's built,
+next to the saves that need it. A save made
+against another version is rebased on load: the character is rebuilt
+from the archived template it was saved against and re-diffed against
+the current one, so data edits only reach new characters. (Saves from
+before versions were recorded are taken to match the current template.)
+"""
+import copy
+import hashlib
+import json
+from collections import ChainMap
+from collections.abc import MutableMapping, MutableSequence
+from types import MappingProxyType
+
+from Items import Starting_Mounts, Starting_Pets, Starting_Charms, Starting_Materials, Starting_Consumables, Active_master_Class, Starter_Weapons, Active_Abilities
+from constants import get_starting_mastery
+from default_abilities import default_learned_abilities
+from static_data import STATIC
+
+TEMPLATE_KEY = "template"
+REMOVED_KEY = "templateRemoved"
+VERSION_KEY = "templateVersion"
+
+_templates = {}
+_versions = {}
+
+
+def _build_template(cls: str) -> dict:
+    starting_inventory = [gear.to_dict() for gear in STATIC.gears(cls)]
+    starting_abilities = default_learned_abilities.get(cls, [])
+    starting_talent = Active_master_Class.get(cls, [])
+    Starting_Mastery = get_starting_mastery(cls)
+    starter_gear = Starter_Weapons.get(cls, [])
+    Starting_Active_Abilities = Active_Abilities.get(cls, [])
+
+    return {
+        "CurrentLevel": "BridgeTown",
+        "equippedGears": starter_gear,
+        "xp":             10,
+        "gold":           100000,
+        "Gems":           100000,# this is the XP for the magic forge
+        "DragonOre":      100000,
+        "mammothIdols":   100000,
+        "DragonKeys":     100000,
+        "SilverSigils":   100000,
+        "showHigher":     True,
+        "MasterClass": starting_talent,
+        "Mastery" : Starting_Mastery,
+        #=================
+        "magicForge": {
+            "stats": [
+                10,
+                0,
+                10,
+                10,
+                10,
+                10,
+                10
+            ],
+            "hasSession": False,
+            "primary": 0,
+            "secondary": 0,
+            "status": 0,
+            "duration": 0,
+            "var_8": 0,
+            "usedlist": 0,
+            "var_2675": 0,
+            "var_2316": 0,
+            "var_2434": False
+        },
+        #===================
+        "activeAbilities": Starting_Active_Abilities,
+        "craftTalentPoints": [5, 5, 5, 5, 5],# these are the Magic Forge upgrade points Max value is 10 each
+        "towerPoints": [50, 50, 50],# Talent upgrade 50 Max each
+
+        "equippedMount": 5,
+        "equippedPetID": 1,
+        "petIteration": 0,
+        "activeConsumableID": 13,
+        "queuedConsumableID": 12,
+        "research": {
+        "abilityID": 0,
+        "ReadyTime": 0
+        },
+        "buildingResearch": {
+        "slotID": 0,
+        "finishTime": 0
+        },
+        "towerResearch": {
+        "masterClassID": 0,
+        "endTime": 0
+        },
+        "eggData": {
+        "typeID": 0,
+        "resetEndTime": 0
+        },
+        "eggPetIDs": [1, 2, 30, 27, 5,35,20,17],
+        "activeEggCount": 8,
+        "restingPets": [
+            {"typeID": 1, "level": 1, "extraValue": 0},
+            {"typeID": 2, "level": 1, "extraValue": 0},
+            {"typeID": 30, "level": 1, "extraValue": 0},
+            {"typeID": 27, "level": 1, "extraValue": 0}
+        ],
+        "missions": {
+            "1": {
+                "state": 0
+            },
+            "2": {
+                "state": 0
+            },
+            "3": {
+                "state": 0
+            }
+        },
+        "learnedAbilities": starting_abilities,
+        "inventoryGears":  starting_inventory,
+        "lockboxes": [{"lockboxID": 1, "count": 100}],
+        "gearSets": [
+        ],
+        "mounts":Starting_Mounts,
+        "pets":Starting_Pets,
+        "charms":Starting_Charms,
+        "materials":Starting_Materials,
+        "consumables":Starting_Consumables,
+        "friends": [
+            {
+                "name": "Neutral",
+                "className": "Paladin",
+                "level": 40,
+                "stateVersion": 5
+            },
+            {
+                "name": "Neo",
+                "className": "Mage",
+                "level": 20,
+                "stateVersion": 5
+            },
+            {
+                "name": "Tired",
+                "className": "Rogue",
+                "level": 23,
+                "stateVersion": 5
+            },
+            {
+                "name": "Telahair",
+                "className": "Mage",
+                "level": 23,
+                "stateVersion": 5
+            }
+        ],
+        # membership only; the roster lives in the storage backend (guilds.py)
+        "guild": {
+            "name": "KnightsOfValor",
+            "rank": 2
+        },
+
+    }
+
+
+def class_template(template_id: str) -> dict:
+    """The shared starting data for a class (lower-case class name). Do not mutate."""
+    template = _templates.get(template_id)
+    if template is None:
+        encoded = json.dumps(_build_template(template_id), sort_keys=True, separators=(",", ":"))
+        # As a save would read it back (lists, not tuples), so diffs compare like with like
+        built = json.loads(encoded)
+        version = hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:12]
+        from storage import get_storage
+        try:
+            get_storage().save_template(template_id, version, built)
+        except Exception as e:
+            print(f"[Template] Failed to archive {template_id} template {version}: {e}")
+        _versions.setdefault(template_id, version)
+        template = _templates.setdefault(template_id, built)
+    return template
+
+
+def template_version(template_id: str) -> str:
+    """Hash of the class's current template, as recorded in saves."""
+    class_template(template_id)
+    return _versions[template_id]
+
+
+def _archived_template(template_id: str, version: str):
+    from storage import get_storage
+    return get_storage().load_template(template_id, version)
+
+
+# ─── read-through views of template fields ───────────────────────────────
+class _Shadow:
+    """
+    A list or dict inside a template field, read through a character.
+    Reads see the template (or the character's copy, once it has one);
+    any change first copies the whole field into the character.
+    """
+
+    __slots__ = ("_char", "_key", "_path")
+
+    def __init__(self, char, key, path):
+        self._char = char
+        self._key = key
+        self._path = path
+
+    def _target(self, write=False):
+        value = self._char._own(self._key) if write else self._char._peek(self._key)
+        for part in self._path:
+            value = value[part]
+        return value
+
+    def _child(self, part, value):
+        return _shadow(self._char, self._key, (*self._path, part), value)
+
+    def __len__(self):
+        return len(self._target())
+
+    def __eq__(self, other):
+        return self._target() == (other._target() if isinstance(other, _Shadow) else other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._target())
+
+    def copy(self):
+        return copy.deepcopy(self._target())
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._target(), memo)
+
+    def __reduce__(self):
+        return copy.deepcopy, (self._target(),)
+
+
+class _ShadowDict(_Shadow, MutableMapping):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return self._child(key, self._target()[key])
+
+    def __setitem__(self, key, value):
+        self._target(True)[key] = _plain(value)
+
+    def __delitem__(self, key):
+        del self._target(True)[key]
+
+    def __iter__(self):
+        return iter(list(self._target()))
+
+    def __contains__(self, key):
+        return key in self._target()
+
+
+class _ShadowList(_Shadow, MutableSequence):
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        value = self._target()
+        if isinstance(index, slice):
+            return copy.deepcopy(value[index])
+        if index < 0:
+            index += len(value)
+        return self._child(index, value[index])
+
+    def __setitem__(self, index, value):
+        self._target(True)[index] = [_plain(v) for v in value] if isinstance(index, slice) else _plain(value)
+
+    def __delitem__(self, index):
+        del self._target(True)[index]
+
+    def insert(self, index, value):
+        self._target(True).insert(index, _plain(value))
+
+    def __iter__(self):
+        for i in range(len(self._target())):
+            yield self[i]
+
+    def __contains__(self, value):
+        return value in self._target()
+
+    def __add__(self, other):
+        return self.copy() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self.copy()
+
+    def sort(self, *args, **kwargs):
+        self._target(True).sort(*args, **kwargs)
+
+
+def _shadow(char, key, path, value):
+    if isinstance(value, dict):
+        return _ShadowDict(char, key, path)
+    if isinstance(value, list):
+        return _ShadowList(char, key, path)
+    return value
+
+
+def _plain(value):
+    """What to store for `value`: a view stored elsewhere becomes its own copy."""
+    return copy.deepcopy(value._target()) if isinstance(value, _Shadow) else value
+
+
+class TemplatedCharacter(MutableMapping):
+    """A character dict stored as its class template plus the fields that differ."""
+
+    __slots__ = ("template_id", "_template", "_data", "_removed", "rebased")
+
+    def __init__(self, template_id: str, data=None, removed=()):
+        self.template_id = template_id
+        self._template = class_template(template_id)
+        self._data = dict(data or {})
+        self._removed = set(removed)
+        # Loaded from a save against another template version: the next
+        # save has to rewrite every field, not just the ones that changed
+        self.rebased = False
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            pass
+        if key in self._removed or key not in self._template:
+            raise KeyError(key)
+        # Nothing is copied until something is changed through the view (_own)
+        return _shadow(self, key, (), self._template[key])
+
+    def _peek(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            return self._template[key]
+
+    def _own(self, key):
+        """The character's own copy of a field, made from the template the first time."""
+        try:
+            return self._data[key]
+        except KeyError:
+            value = self._data[key] = copy.deepcopy(self._template[key])
+            self._removed.discard(key)
+            return value
+
+    def __setitem__(self, key, value):
+        if isinstance(value, _Shadow) and value._char is self and value._key == key and not value._path:
+            self._own(key)      # char[k] = char[k] after changing it in place
+            return
+        self._data[key] = _plain(value)
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        if key in self._template and key not in self._removed:
+            self._data.pop(key, None)
+            self._removed.add(key)
+        else:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data or (key in self._template and key not in self._removed)
+
+    def __iter__(self):
+        yield from self._data
+        for key in self._template:
+            if key not in self._data and key not in self._removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"TemplatedCharacter({self.template_id!r}, {self._data!r})"
+
+    def __reduce__(self):
+        # Pickled (e.g. onto a worker handoff queue) without the template
+        return from_saved, (self.to_saved(),)
+
+    def copy(self):
+        return TemplatedCharacter(self.template_id, self._data, self._removed)
+
+    def view(self):
+        """Read-only mapping of every field, without copying template data."""
+        if self._removed:
+            rest = {k: v for k, v in self._template.items() if k not in self._removed}
+        else:
+            rest = self._template
+        return MappingProxyType(ChainMap(self._data, rest))
+
+    def to_saved(self) -> dict:
+        saved = {TEMPLATE_KEY: self.template_id, VERSION_KEY: template_version(self.template_id)}
+        for key, value in self._data.items():
+            if key in self._template and value == self._template[key]:
+                continue
+            saved[key] = value
+        if self._removed:
+            saved[REMOVED_KEY] = sorted(self._removed)
+        return saved
+
+
+def _rebase(template_id: str, version: str, data: dict, removed) -> TemplatedCharacter:
+    """A character saved against template `version`, re-diffed against the current one."""
+    old = _archived_template(template_id, version)
+    if old is None:
+        print(f"[Template] No archived {template_id} template {version}; reading it against the current one")
+        return TemplatedCharacter(template_id, data, removed)
+    full = {k: v for k, v in old.items() if k not in removed}
+    full.update(data)
+    current = class_template(template_id)
+    char = TemplatedCharacter(
+        template_id,
+        {k: v for k, v in full.items() if k not in current or v != current[k]},
+        [k for k in current if k not in full])
+    char.rebased = True
+    return char
+
+
+def from_saved(char):
+    """A character as loaded from storage; only templated saves are wrapped."""
+    if isinstance(char, dict) and TEMPLATE_KEY in char:
+        template_id = char[TEMPLATE_KEY]
+        data = {k: v for k, v in char.items() if k not in (TEMPLATE_KEY, REMOVED_KEY, VERSION_KEY)}
+        removed = char.get(REMOVED_KEY, ())
+        version = char.get(VERSION_KEY)
+        if version is not None and version != template_version(template_id):
+            return _rebase(template_id, version, data, removed)
+        return TemplatedCharacter(template_id, data, removed)
+    return char
+
+
+def character_view(char):
+    """What packet builders should read from: no copies for templated characters."""
+    if isinstance(char, TemplatedCharacter):
+        return char.view()
+    return char
+
+
+def stored_form(char) -> dict:
+    """The dict that is actually persisted for `char`."""
+    if isinstance(char, TemplatedCharacter):
+        return char.to_saved()
+    return char
+
+
+def to_saved(obj):
+    """json `default=` hook so save documents serialise templated characters."""
+    if isinstance(obj, TemplatedCharacter):
+        return obj.to_saved()
+    if isinstance(obj, _Shadow):
+        return obj._target()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
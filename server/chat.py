@@ -0,0 +1,197 @@
+# chat.py
+"""
+Chat channels, flood control and delivery.
+
+    level    0x2C in -> 0x2C (entity ID, message) to the rest of the level
+    whisper  0x46 in (name, message) -> 0x47 (sender, message) to the
+             target, 0x48 (target, message) back to the sender
+    guild    0x5F in -> 0x60 (sender, message) to online guildmates
+    officer  0x61 in -> 0x62 to online officers and the guild master
+
+Each message is encoded once and the same bytes are queued for every
+recipient through its outbox (movement.push), so chat shares the
+observer's socket writes without delaying movement updates.
+
+Every sender has a token bucket (BURST messages, refilled at RATE per
+second); a message over the limit is dropped and the sender is told once
+until its bucket refills. counters() is a metrics gauge.
+"""
+import struct
+import threading
+import time
+
+import aoi
+import guilds
+import movement
+import presence
+from BitUtils import BitBuffer
+from bitreader import BitReader
+
+RATE = 1.0          # messages per second a sender earns
+BURST = 5           # messages a quiet sender may send back to back
+MAX_LENGTH = 256    # longer messages are cut
+
+THROTTLED_TEXT = "You are sending messages too quickly."
+
+_counters = {"messages": 0, "deliveries": 0, "throttled": 0, "undeliverable": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(**deltas) -> None:
+    with _counters_lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def counters() -> dict:
+    """Chat messages, deliveries and throttled messages since start (a metrics gauge)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp", "warned")
+
+    def __init__(self, rate: float = RATE, burst: int = BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.warned = False     # told the sender it's throttled since the last allowed message
+
+    def take(self, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.warned = False
+            return True
+        return False
+
+
+_buckets = {}       # session -> TokenBucket
+_buckets_lock = threading.Lock()
+
+
+def _allow(session) -> bool:
+    bucket = _buckets.get(session)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(session, TokenBucket())
+    if bucket.take():
+        return True
+    _count(throttled=1)
+    if not bucket.warned:
+        bucket.warned = True
+        movement.push(session, status_packet(THROTTLED_TEXT))
+    return False
+
+
+def close(session) -> None:
+    with _buckets_lock:
+        _buckets.pop(session, None)
+
+
+# ─── packets ─────────────────────────────────────────────────────────────
+def _packet(pkt_id: int, *texts, ent_id=None) -> bytes:
+    bb = BitBuffer()
+    if ent_id is not None:
+        bb.write_method_4(ent_id)
+    for text in texts:
+        bb.write_method_13(text)
+    payload = bb.to_bytes()
+    return struct.pack(">HH", pkt_id, len(payload)) + payload
+
+
+def level_packet(ent_id: int, message: str) -> bytes:
+    return _packet(0x2C, message, ent_id=ent_id)
+
+
+def status_packet(text: str) -> bytes:
+    """0x44 PKTTYPE_CHAT_STATUS: a system line in the chat window."""
+    return _packet(0x44, text)
+
+
+def _deliver(sessions, packet: bytes) -> int:
+    n = 0
+    for other in sessions:
+        movement.push(other, packet)
+        n += 1
+    _count(messages=1, deliveries=n)
+    return n
+
+
+# ─── channels ────────────────────────────────────────────────────────────
+def say(session, message: str) -> int:
+    """Level chat, spoken by the session's own entity. Returns how many players it went to."""
+    if not message or session.clientEntID is None or not _allow(session):
+        return 0
+    packet = level_packet(session.clientEntID, message[:MAX_LENGTH])
+    recipients = [s for s in aoi.level_grid(session.current_level).sessions()
+                  if s is not session and s.world_loaded]
+    return _deliver(recipients, packet)
+
+
+def whisper(session, target: str, message: str) -> int:
+    if not message or not _allow(session):
+        return 0
+    message = message[:MAX_LENGTH]
+    sessions = presence.sessions_of(target)
+    if not sessions:
+        _count(undeliverable=1)
+        movement.push(session, status_packet(f"{target} is not online."))
+        return 0
+    sender = session.current_character or ""
+    n = _deliver(sessions, _packet(0x47, sender, message))
+    movement.push(session, _packet(0x48, target, message))
+    return n
+
+
+def _guild_chat(session, message: str, pkt_id: int, max_rank: int) -> int:
+    if not message or not _allow(session):
+        return 0
+    char = session.current_char_dict or {}
+    guild, rank = guilds.guild_of(char)
+    if guild is None:
+        movement.push(session, status_packet("You are not in a guild."))
+        return 0
+    if rank == guilds.RANK_SILENCED:
+        movement.push(session, status_packet("You have been silenced in your guild."))
+        return 0
+    if rank > max_rank:
+        movement.push(session, status_packet("Only guild officers can use this channel."))
+        return 0
+    packet = _packet(pkt_id, session.current_character or "", message[:MAX_LENGTH])
+    recipients = [s for m in guilds.online_members(guild.name) if m.rank <= max_rank
+                  for s in presence.sessions_of(m.name)]
+    return _deliver(recipients, packet)
+
+
+def guild_chat(session, message: str) -> int:
+    return _guild_chat(session, message, 0x60, guilds.RANK_SILENCED)
+
+
+def officer_chat(session, message: str) -> int:
+    return _guild_chat(session, message, 0x62, guilds.RANK_OFFICER)
+
+
+# ─── handlers ────────────────────────────────────────────────────────────
+def handle_level_chat(session, data: bytes) -> None:
+    br = BitReader(data[4:])
+    br.read_method_4()      # the speaker's entity ID: a client only speaks as itself
+    say(session, br.read_method_13())
+
+
+def handle_whisper(session, data: bytes) -> None:
+    br = BitReader(data[4:])
+    target = br.read_method_13()
+    whisper(session, target, br.read_method_13())
+
+
+def handle_guild_chat(session, data: bytes) -> None:
+    guild_chat(session, BitReader(data[4:]).read_method_13())
+
+
+def handle_officer_chat(session, data: bytes) -> None:
+    officer_chat(session, BitReader(data[4:]).read_method_13())
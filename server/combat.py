@@ -0,0 +1,176 @@
+# combat.py
+"""
+Power hits, resolved once per world tick against the level's
+authoritative HP (entity_store.py).
+
+The 0x0A handler only queues the hit. On the tick, each level's queued
+hits are added up per target, applied to the store in one apply_damage()
+call, and every target that was hit goes out as a single 0x0F through
+the observers' outboxes (movement.publish), however many hits it took.
+An AoE that lands on twelve NPCs for four players costs one update per
+NPC per observer, not one per hit.
+
+0x0F's health_delta is what the client subtracts from the entity's max
+HP (LinkUpdater: currHP -= it), so a target is sent with health_delta =
+max_hp - hp: all its damage so far, this tick's included.
+
+    combat.queue_hit(session, target_id, source_id, damage, power_id)
+    combat.tick()                   # from the world tick (npc_sim.py)
+
+The hitting client has already shown its own hit, so a target hit by
+only one client this tick isn't sent back to it. counters(),
+hits_per_second() and resolve_seconds() are metrics gauges.
+"""
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+import aoi
+import entity_store
+import movement
+from entity import Send_Entity_Data
+from metrics import Histogram
+
+RATE_WINDOW = 10.0      # seconds hits_per_second() averages over
+
+Hit = namedtuple("Hit", "source target damage power_id crit origin")
+
+_counters = {"hits": 0, "targets": 0, "kills": 0, "unknown_target": 0, "ticks": 0}
+_counters_lock = threading.Lock()
+_resolve_times = Histogram()
+_recent = deque()       # (monotonic time, hits resolved) per tick with hits, last RATE_WINDOW s
+
+
+def _count(**deltas) -> None:
+    with _counters_lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def counters() -> dict:
+    """Hits, targets updated and kills since start (a metrics gauge)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def hits_per_second() -> float:
+    """Hits resolved per second over the last RATE_WINDOW seconds (a metrics gauge)."""
+    now = time.monotonic()
+    with _counters_lock:
+        return sum(n for t, n in _recent if now - t <= RATE_WINDOW) / RATE_WINDOW
+
+
+def resolve_seconds() -> dict:
+    """Time a tick with hits spends resolving them, by quantile (a metrics gauge)."""
+    with _counters_lock:
+        return {"0.5": _resolve_times.quantile(0.5), "0.99": _resolve_times.quantile(0.99),
+                "max": _resolve_times.max}
+
+
+def _record(hits: int, seconds: float) -> None:
+    now = time.monotonic()
+    with _counters_lock:
+        _resolve_times.observe(seconds)
+        _recent.append((now, hits))
+        while _recent and now - _recent[0][0] > RATE_WINDOW:
+            _recent.popleft()
+
+
+class LevelCombat:
+    def __init__(self, level_name: str):
+        self.level_name = level_name
+        self.lock = threading.Lock()
+        self.queue = []         # Hit, in arrival order
+        self.entities = {}      # target ID -> the entity dict its 0x0F is encoded from
+
+    def queue_hit(self, entity: dict, source, damage: int, power_id: int = 0, crit: bool = False,
+                  origin=None) -> None:
+        with self.lock:
+            self.queue.append(Hit(source, entity["id"], damage, power_id, crit, origin))
+            self.entities[entity["id"]] = entity
+
+    def resolve(self) -> int:
+        """Apply the queued hits and publish one update per target. Returns hits resolved."""
+        with self.lock:
+            hits, self.queue = self.queue, []
+            entities, self.entities = self.entities, {}
+        if not hits:
+            return 0
+        totals = {}         # target ID -> damage this tick
+        last = {}           # target ID -> its last Hit
+        origins = {}        # target ID -> the one session that hit it, or None for several
+        for hit in hits:
+            totals[hit.target] = totals.get(hit.target, 0) + hit.damage
+            last[hit.target] = hit
+            origins[hit.target] = hit.origin if origins.get(hit.target, hit.origin) is hit.origin else None
+
+        store = entity_store.level_store(self.level_name)
+        ids = list(totals)
+        dead = set(store.apply_damage(ids, [totals[t] for t in ids]))
+        grid = aoi.level_grid(self.level_name)
+        kills = 0
+        for target in ids:
+            entity = entities[target]
+            entity.setdefault("max_hp", 100)
+            hp = store.hp_of(target)
+            if hp is None:      # not in the store (left the level this tick)
+                hp = max(0, entity.get("hp", entity["max_hp"]) - totals[target])
+            kills += target in dead
+            entity["hp"] = hp
+            entity["damage_taken"] = entity.get("damage_taken", 0) + totals[target]
+            entity["health_delta"] = max(0, entity["max_hp"] - hp)
+            entity["attacker_id"] = last[target].source
+            payload = Send_Entity_Data(entity, is_player=grid.session_of(target) is not None)
+            where = grid.position(target) or (entity.get("x", 0.0), entity.get("y", 0.0))
+            movement.publish(grid, target, struct.pack(">HH", 0x0F, len(payload)) + payload,
+                             where[0], where[1], exclude=origins[target])
+        _count(hits=len(hits), targets=len(ids), kills=kills)
+        return len(hits)
+
+
+_levels = {}
+_levels_lock = threading.Lock()
+
+
+def level_combat(level_name: str) -> LevelCombat:
+    combat = _levels.get(level_name)
+    if combat is None:
+        with _levels_lock:
+            combat = _levels.setdefault(level_name, LevelCombat(level_name))
+    return combat
+
+
+def tick() -> int:
+    """Resolve every level's queued hits (on the world tick). Returns hits resolved."""
+    t0 = time.perf_counter()
+    resolved = 0
+    with _levels_lock:
+        levels = list(_levels.values())
+    for combat in levels:
+        try:
+            resolved += combat.resolve()
+        except Exception as e:
+            print(f"[Combat] Resolving hits failed for {combat.level_name}: {e}")
+    _count(ticks=1)
+    if resolved:
+        _record(resolved, time.perf_counter() - t0)
+    return resolved
+
+
+def _target_entity(session, target):
+    # a player's own dict, else the level's shared NPC dict in the session's entities
+    owner = aoi.level_grid(session.current_level).session_of(target)
+    if owner is not None:
+        return owner.entities.get(target)
+    return session.entities.get(target)
+
+
+def queue_hit(session, target, source, damage: int, power_id: int = 0, crit: bool = False) -> bool:
+    """Queue a hit reported by the session's client. False if the target is unknown."""
+    entity = _target_entity(session, target) if session.current_level else None
+    if entity is None:
+        _count(unknown_target=1)
+        return False
+    level_combat(session.current_level).queue_hit(entity, source, damage, power_id, crit, origin=session)
+    return True
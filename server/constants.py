@@ -1,6 +1,5 @@
 # constants.py
-import json
-import os
+from static_data import STATIC
 NUM_TALENT_SLOTS = 27
 CONST_529 = [5,2,3,5,5,3,2,3,2,5,2,3,5,5,3,2,3,2,5,2,3,5,5,3,2,3,2]
 CLASS_118_CONST_127 = 6
@@ -110,6 +109,11 @@ class class_111 :
 
 class LockboxType:
     ID_BITS = 8
+    OPEN_BITS = 2           # class_15.const_300: the lockbox ID in 0x107
+
+class RewardpackType:
+    PACK_BITS = 3           # class_18.var_1846
+    POSITION_BITS = 6       # class_18.var_1776
 
 class EntType:
     MAX_SLOTS = 7
@@ -141,34 +145,8 @@ NEWS_EVENTS = {
                #Loaders
 ################################################################
 
-# load the JSON file into a dict
-with open("data/DyeTypes.json", "r", encoding="utf-8") as f:
-    DYE_DATA = json.load(f)
-
 def get_dye_color(dye_id):
-    dye = DYE_DATA.get(str(dye_id))
-    if dye:
-        return dye["color"]
-    return None
-
-
-def load_gear_data(class_name):
-    path = os.path.join("data", f"{class_name.lower()}_gears.json")
-    try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Failed to load {class_name} gear data: {e}")
-        return []
-
-inventory_gears = {
-    "paladin": load_gear_data("paladin"),
-    "mage": load_gear_data("mage"),
-    "rogue": load_gear_data("rogue"),
-}
-
-with open("data/MasteryClass.json", "r", encoding="utf-8") as f:
-    Mastery_Class = json.load(f)
+    return STATIC.dye_color(dye_id)
 
 def get_starting_mastery(cls):
-    return Mastery_Class.get(cls, [])
\ No newline at end of file
+    return {str(t.master_class_id): t.to_dict() for t in STATIC.mastery_trees(cls)}
\ No newline at end of file
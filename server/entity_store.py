@@ -0,0 +1,312 @@
+# entity_store.py
+"""
+Per-level entity state as a structure of arrays: one column per field,
+one row per entity, so work over a whole level (the AOI radius queries,
+the tick's dirty scan, a batch of combat damage) is one vectorized pass
+instead of a walk over entity dicts. This is the authoritative position,
+state and HP: movement (0x07, npc_sim) writes here, aoi.py and npc_sim
+read here, and combat.py resolves its hits here.
+
+    store = level_store("BridgeTown")
+    store.add(ent_id, x, y, team=1, hp=100, max_hp=100)
+    store.set_position(ent_id, x, y, vy=velocity)
+    store.within(x, y, 800)              -> entity IDs in range
+    store.apply_damage([a, b], [30, 5])  -> IDs this call killed
+    store.take_dirty()                   -> [(ent_id, DIRTY_* bits)], cleared
+
+Rows of removed entities go on a free list and are reused. Columns are
+NumPy arrays when NumPy is installed; without it they are array.array
+and the same methods run as plain loops, so the server works either way.
+The session's entity dicts remain what packets are encoded from.
+"""
+import threading
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DIRTY_POS = 1
+DIRTY_STATE = 2
+DIRTY_HP = 4
+DIRTY_ALL = DIRTY_POS | DIRTY_STATE | DIRTY_HP
+
+# Movement flags from 0x07, packed into the `flags` column
+FLAG_BITS = {"left": 1, "running": 2, "jumping": 4, "dropping": 8, "backpedal": 16}
+
+# name -> (array.array typecode, NumPy dtype)
+COLUMNS = {
+    "x": ("d", "float64"),
+    "y": ("d", "float64"),
+    "vx": ("d", "float64"),
+    "vy": ("d", "float64"),
+    "state": ("h", "int16"),
+    "team": ("b", "int8"),
+    "hp": ("l", "int64"),
+    "max_hp": ("l", "int64"),
+    "flags": ("B", "uint8"),
+    "dirty": ("B", "uint8"),
+    "used": ("B", "bool"),      # the row holds an entity
+    "alive": ("B", "bool"),     # ...with HP left
+}
+
+INITIAL_CAPACITY = 64
+
+
+def _flag_bits(flags) -> int:
+    if isinstance(flags, dict):
+        return sum(bit for name, bit in FLAG_BITS.items() if flags.get(name))
+    return flags
+
+
+def _column(typecode, dtype, n):
+    if np is not None:
+        return np.zeros(n, dtype=dtype)
+    return array(typecode, bytes(array(typecode).itemsize * n))
+
+
+def _grown(col, typecode, dtype, n):
+    if np is not None:
+        out = np.zeros(n, dtype=dtype)
+        out[:len(col)] = col
+        return out
+    col.extend(array(typecode, bytes(col.itemsize * (n - len(col)))))
+    return col
+
+
+class EntityStore:
+    def __init__(self, name: str = "", capacity: int = INITIAL_CAPACITY):
+        self.name = name
+        self.capacity = capacity
+        self.lock = threading.RLock()
+        for col, (typecode, dtype) in COLUMNS.items():
+            setattr(self, col, _column(typecode, dtype, capacity))
+        self._rows = {}             # entity ID -> row
+        self._ids = [None] * capacity   # row -> entity ID
+        self._free = []             # rows given back by remove()
+        self._high = 0              # rows below this have been used at least once
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, ent_id):
+        return ent_id in self._rows
+
+    def row(self, ent_id):
+        return self._rows.get(ent_id)
+
+    def ids(self):
+        with self.lock:
+            return list(self._rows)
+
+    def _grow(self) -> None:
+        n = self.capacity * 2
+        for col, (typecode, dtype) in COLUMNS.items():
+            setattr(self, col, _grown(getattr(self, col), typecode, dtype, n))
+        self._ids.extend([None] * (n - self.capacity))
+        self.capacity = n
+
+    # ─── rows ────────────────────────────────────────────────────────────
+    def add(self, ent_id, x=0.0, y=0.0, team=0, hp=0, max_hp=0, state=0, flags=0) -> int:
+        """Give `ent_id` a row (or reset its existing one). Returns the row."""
+        with self.lock:
+            row = self._rows.get(ent_id)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    if self._high == self.capacity:
+                        self._grow()
+                    row = self._high
+                    self._high += 1
+                self._rows[ent_id] = row
+                self._ids[row] = ent_id
+            self.x[row], self.y[row] = x, y
+            self.vx[row] = self.vy[row] = 0.0
+            self.state[row], self.team[row] = state, team
+            self.hp[row], self.max_hp[row] = hp, max_hp or hp
+            self.flags[row] = _flag_bits(flags)
+            self.dirty[row] = DIRTY_ALL
+            self.used[row] = 1
+            self.alive[row] = hp > 0
+            return row
+
+    def add_entity(self, ent_id, entity: dict) -> int:
+        """add() from a session entity dict (NPC spawn or player)."""
+        max_hp = entity.get("max_hp", 100)     # 0x0A's default for entities without HP
+        return self.add(ent_id, entity.get("x", 0.0), entity.get("y", 0.0), entity.get("team", 0),
+                        entity.get("hp", max_hp), max_hp, entity.get("entState", 0),
+                        {"left": entity.get("facing_left", False)})
+
+    def remove(self, ent_id) -> bool:
+        with self.lock:
+            row = self._rows.pop(ent_id, None)
+            if row is None:
+                return False
+            self._ids[row] = None
+            self.used[row] = self.alive[row] = 0
+            self.dirty[row] = 0
+            self._free.append(row)
+            return True
+
+    # ─── single entities ─────────────────────────────────────────────────
+    def set_position(self, ent_id, x, y, vx=None, vy=None) -> None:
+        with self.lock:
+            row = self._rows.get(ent_id)
+            if row is None:
+                return
+            if self.x[row] != x or self.y[row] != y:
+                self.x[row], self.y[row] = x, y
+                self.dirty[row] |= DIRTY_POS
+            if vx is not None:
+                self.vx[row] = vx
+            if vy is not None:
+                self.vy[row] = vy
+
+    def set_state(self, ent_id, state, flags=None) -> None:
+        """`flags` is a dict like 0x07's {"left": bool, ...} or an int bit set."""
+        with self.lock:
+            row = self._rows.get(ent_id)
+            if row is None:
+                return
+            flags = self.flags[row] if flags is None else _flag_bits(flags)
+            if self.state[row] != state or self.flags[row] != flags:
+                self.state[row], self.flags[row] = state, flags
+                self.dirty[row] |= DIRTY_STATE
+
+    def position(self, ent_id):
+        """(x, y), or None."""
+        with self.lock:
+            row = self._rows.get(ent_id)
+            return (float(self.x[row]), float(self.y[row])) if row is not None else None
+
+    def positions(self, ent_ids) -> list:
+        """(x, y) for each of `ent_ids` that has a row."""
+        with self.lock:
+            rows = [self._rows[e] for e in ent_ids if e in self._rows]
+            xs, ys = self.x, self.y
+            return [(float(xs[r]), float(ys[r])) for r in rows]
+
+    def get(self, ent_id):
+        """One entity's columns as a dict, or None."""
+        with self.lock:
+            row = self._rows.get(ent_id)
+            if row is None:
+                return None
+            return {col: getattr(self, col)[row].item() if np is not None else getattr(self, col)[row]
+                    for col in COLUMNS}
+
+    def hp_of(self, ent_id):
+        with self.lock:
+            row = self._rows.get(ent_id)
+            return int(self.hp[row]) if row is not None else None
+
+    # ─── batch operations ────────────────────────────────────────────────
+    def set_positions(self, ent_ids, xs, ys, lefts) -> None:
+        """set_position() and the facing flag for many entities (npc_sim's tick)."""
+        left = FLAG_BITS["left"]
+        with self.lock:
+            rows = self._rows
+            for ent_id, x, y, facing_left in zip(ent_ids, xs, ys, lefts):
+                row = rows.get(ent_id)
+                if row is None:
+                    continue
+                if self.x[row] != x or self.y[row] != y:
+                    self.x[row], self.y[row] = x, y
+                    self.dirty[row] |= DIRTY_POS
+                flags = (self.flags[row] | left) if facing_left else (self.flags[row] & ~left & 0xFF)
+                if self.flags[row] != flags:
+                    self.flags[row] = flags
+                    self.dirty[row] |= DIRTY_STATE
+
+    def within(self, x, y, radius) -> list:
+        """IDs of every entity within `radius` of (x, y), dead or alive."""
+        r2 = radius * radius
+        with self.lock:
+            n = self._high
+            if np is not None:
+                dx = self.x[:n] - x
+                dy = self.y[:n] - y
+                rows = np.flatnonzero((dx * dx + dy * dy <= r2) & self.used[:n]).tolist()
+            else:
+                xs, ys, used = self.x, self.y, self.used
+                rows = [r for r in range(n) if used[r] and (xs[r] - x) ** 2 + (ys[r] - y) ** 2 <= r2]
+            ids = self._ids
+            return [ids[r] for r in rows]
+
+    def take_dirty(self, mask: int = DIRTY_ALL) -> list:
+        """[(ent_id, dirty bits & mask)] for every dirty entity; those bits are cleared."""
+        with self.lock:
+            n = self._high
+            if np is not None:
+                dirty = self.dirty[:n]
+                rows = np.flatnonzero(dirty & mask)
+                bits = (dirty[rows] & mask).tolist()
+                dirty[rows] &= ~mask & 0xFF
+                rows = rows.tolist()
+            else:
+                dirty = self.dirty
+                rows, bits = [], []
+                for r in range(n):
+                    b = dirty[r] & mask
+                    if b:
+                        rows.append(r)
+                        bits.append(b)
+                        dirty[r] &= ~mask & 0xFF
+            ids = self._ids
+            return [(ids[r], b) for r, b in zip(rows, bits)]
+
+    def apply_damage(self, ent_ids, amounts) -> list:
+        """
+        Subtract each amount from its entity's HP (clamped at 0; an ID may
+        repeat). Unknown IDs are skipped. Returns the IDs this call killed:
+        ones that were alive and are now at 0 HP, not ones already dead.
+        """
+        with self.lock:
+            pairs = [(self._rows[e], a) for e, a in zip(ent_ids, amounts) if e in self._rows]
+            if not pairs:
+                return []
+            if np is not None:
+                rows = np.fromiter((r for r, _ in pairs), dtype=np.int64, count=len(pairs))
+                hits = np.fromiter((a for _, a in pairs), dtype=np.int64, count=len(pairs))
+                np.subtract.at(self.hp, rows, hits)
+                touched = np.unique(rows)
+                self.hp[touched] = np.maximum(self.hp[touched], 0)
+                self.dirty[touched] |= DIRTY_HP
+                killed = touched[(self.hp[touched] == 0) & self.alive[touched]]
+                self.alive[killed] = 0
+                dead = killed.tolist()
+            else:
+                touched = set()
+                for r, a in pairs:
+                    self.hp[r] -= a
+                    touched.add(r)
+                dead = []
+                for r in sorted(touched):
+                    if self.hp[r] <= 0:
+                        self.hp[r] = 0
+                        if self.alive[r]:
+                            self.alive[r] = 0
+                            dead.append(r)
+                    self.dirty[r] |= DIRTY_HP
+            ids = self._ids
+            return [ids[r] for r in dead]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def level_store(level_name: str) -> EntityStore:
+    store = _stores.get(level_name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(level_name, EntityStore(level_name))
+    return store
+
+
+def entities_per_level() -> dict:
+    with _stores_lock:
+        stores = list(_stores.items())
+    return {name: len(store) for name, store in stores}
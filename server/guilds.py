@@ -0,0 +1,273 @@
+# guilds.py
+"""
+Guilds, stored once in the storage backend (storage.py) instead of as a
+roster inside every character.
+
+A character's "guild" field only names its guild ({"name": ...}); the
+guild holds each member's class, level and rank, and a character is put
+on the roster when it first comes online. Which members are online is
+kept per guild from presence.py's login/logout events, and changes go
+out as deltas to the online guildmates only:
+
+    0x97  a guildmate logged on (name, class, level, rank)
+    0x98  a guildmate logged off (name)
+    0x56  the online roster, sent when a member's level changes (the
+          client has no per-member update for that)
+
+0x10 carries just the online members, so a large guild costs nothing
+extra in a welcome packet or a save file.
+
+    guild, rank = guilds.guild_of(char)
+    guilds.online_members(guild.name, exclude=char["name"])  -> [Member]
+    guilds.roster_packet(guild, rank)   -> 0x56 for a member of that rank
+
+Each process caches the rosters it has read. A roster change goes
+through storage.update_guild(), which rereads the stored roster under
+the backend's lock and writes the one member back, so changes from
+other --workers processes aren't overwritten; the cached guild is then
+refreshed from what was stored.
+"""
+import struct
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+
+import presence
+from BitUtils import BitBuffer
+from constants import CLASS_NAME_TO_ID, ENTITY_CONST_244, MAX_CHAR_LEVEL_BITS
+from storage import get_storage
+
+# Entity.method_850: rank IDs, written in RANK_BITS (Entity.const_172)
+RANK_GUILDMASTER, RANK_OFFICER, RANK_MEMBER, RANK_INITIATE, RANK_SILENCED = range(5)
+RANK_BITS = 3
+
+Member = namedtuple("Member", "name class_id level rank")
+
+# The demo guild every new character starts in (was copied into each character)
+DEFAULT_GUILD = "KnightsOfValor"
+_SEED = {
+    DEFAULT_GUILD: [
+        ("Teggdel", 0, 45, 1), ("ProGooner", 1, 50, 3), ("Fitler", 2, 47, 3),
+        ("DrHouse", 2, 22, 3), ("FriendlyNephit", 1, 43, 3), ("SneakyMcStab", 1, 48, 1),
+        ("HolyTickler", 0, 42, 1), ("WizzyMcFizzle", 2, 46, 0), ("PwnyThePaladin", 0, 40, 1),
+        ("StabbyMcSneak", 1, 44, 0), ("SparkleFart", 2, 39, 1), ("SirGiggles", 0, 41, 2),
+        ("RogueyMcRoguface", 1, 47, 2), ("MagicTickler", 2, 43, 1), ("ShieldyMcBloop", 0, 38, 0),
+    ],
+}
+
+
+class Guild:
+    def __init__(self, name: str, members=None):
+        self.name = name
+        self.members = members or {}    # character name -> Member
+        self.online = set()             # names of members with a session
+
+    def to_json(self) -> dict:
+        return {"members": {m.name: _member_json(m) for m in self.members.values()}}
+
+    @classmethod
+    def from_json(cls, name: str, doc: dict):
+        return cls(name, _members(doc))
+
+
+def _member_json(m: Member) -> dict:
+    return {"classID": m.class_id, "level": m.level, "rank": m.rank}
+
+
+def _members(doc: dict) -> dict:
+    return {n: Member(n, m.get("classID", 0), m.get("level", 1), m.get("rank", RANK_MEMBER))
+            for n, m in doc.get("members", {}).items()}
+
+
+def _seed(name: str) -> Guild:
+    return Guild(name, {m[0]: Member(*m) for m in _SEED.get(name, ())})
+
+
+_lock = threading.RLock()
+_guilds = None      # guild name -> Guild, loaded on first use
+_member_of = {}     # online character name -> guild name
+
+
+def _load() -> dict:
+    global _guilds
+    if _guilds is None:
+        with _lock:
+            if _guilds is None:
+                guilds = {name: _seed(name) for name in _SEED}
+                try:
+                    stored = get_storage().load_guilds()
+                except Exception as e:
+                    print(f"[Guild] Failed to load guilds: {e}")
+                    stored = {}
+                guilds.update((name, Guild.from_json(name, g)) for name, g in stored.items())
+                _guilds = guilds
+    return _guilds
+
+
+def _store_member(guild_name: str, member: Member) -> None:
+    """Write one member to the stored guild and refresh our copy from it."""
+    def update(doc):
+        if doc is None:     # never stored: start from the seed roster, if it has one
+            doc = _seed(guild_name).to_json()
+        doc.setdefault("members", {})[member.name] = _member_json(member)
+        return doc
+
+    try:
+        doc = get_storage().update_guild(guild_name, update)
+    except Exception as e:
+        print(f"[Guild] Failed to save {guild_name}: {e}")
+        return
+    with _lock:
+        guild = _load().get(guild_name)
+        if guild is not None:
+            guild.members = _members(doc)
+
+
+def get(name: str):
+    return _load().get(name)
+
+
+def _ref(char):
+    ref = char.get("guild")
+    if not ref:
+        return None, RANK_MEMBER
+    if isinstance(ref, Mapping):     # a dict, or a template view of one (char_template.py)
+        return ref.get("name"), ref.get("rank", RANK_MEMBER)
+    return ref, RANK_MEMBER
+
+
+def guild_of(char) -> tuple:
+    """(Guild, the character's rank) or (None, 0). Doesn't change anything."""
+    guild_name, rank = _ref(char)
+    if not guild_name:
+        return None, 0
+    guild = _load().get(guild_name)
+    if guild is None:
+        return Guild(guild_name), rank
+    member = guild.members.get(char.get("name"))
+    return guild, member.rank if member is not None else rank
+
+
+def join(char):
+    """
+    Put the character on its guild's roster (new characters, old saves)
+    and bring its class and level up to date. Returns its Member or None.
+    """
+    guild_name, rank = _ref(char)
+    if not guild_name:
+        return None
+    with _lock:
+        guild = _load().get(guild_name)
+        if guild is None:
+            guild = _guilds[guild_name] = Guild(guild_name)
+        old = guild.members.get(char["name"])
+        member = Member(char["name"], CLASS_NAME_TO_ID.get(char.get("class"), 0), char.get("level", 1),
+                        old.rank if old is not None else rank)
+        guild.members[member.name] = member
+    if member != old:
+        _store_member(guild_name, member)
+    return member
+
+
+def online_members(guild_name: str, exclude: str = None) -> list:
+    with _lock:
+        guild = _load().get(guild_name)
+        if guild is None:
+            return []
+        return [guild.members[n] for n in sorted(guild.online) if n != exclude and n in guild.members]
+
+
+# ─── packets ─────────────────────────────────────────────────────────────
+def _write_member(buf: BitBuffer, m: Member) -> None:
+    buf.write_utf_string(m.name)
+    buf.write_method_6(m.class_id, ENTITY_CONST_244)
+    buf.write_method_6(m.level, MAX_CHAR_LEVEL_BITS)
+    buf.write_method_6(m.rank, RANK_BITS)
+
+
+def _packet(pkt_id: int, buf: BitBuffer) -> bytes:
+    payload = buf.to_bytes()
+    return struct.pack(">HH", pkt_id, len(payload)) + payload
+
+
+def roster_packet(guild, rank: int) -> bytes:
+    """0x56 PKTTYPE_GUILD_UPDATE: guild name, the receiver's rank, online members."""
+    buf = BitBuffer()
+    buf.write_bits(1, 1)
+    buf.write_utf_string(guild.name)
+    buf.write_method_6(rank, RANK_BITS)
+    members = online_members(guild.name)
+    buf.write_method_4(len(members))
+    for m in members:
+        _write_member(buf, m)
+    return _packet(0x56, buf)
+
+
+def member_online_packet(m: Member) -> bytes:
+    buf = BitBuffer()
+    _write_member(buf, m)
+    return _packet(0x97, buf)
+
+
+def member_offline_packet(name: str) -> bytes:
+    buf = BitBuffer()
+    buf.write_utf_string(name)
+    return _packet(0x98, buf)
+
+
+def _send_to_online(guild_name: str, packet_for, exclude: str = None) -> int:
+    """Send packet_for(member) to each online member's sessions (except `exclude`)."""
+    sent = 0
+    for m in online_members(guild_name, exclude=exclude):
+        packet = packet_for(m)
+        for session in presence.sessions_of(m.name):
+            try:
+                session.conn.sendall(packet)
+                sent += 1
+            except OSError:
+                pass    # its own handler notices the dead socket
+    return sent
+
+
+# ─── presence events ─────────────────────────────────────────────────────
+def _on_presence(kind: str, p, char) -> None:
+    if kind == presence.ONLINE:
+        member = join(char)
+        if member is None:
+            return
+        guild_name, _ = _ref(char)
+        with _lock:
+            _guilds[guild_name].online.add(p.name)
+            _member_of[p.name] = guild_name
+        packet = member_online_packet(member)
+        _send_to_online(guild_name, lambda m: packet, exclude=p.name)
+        return
+
+    member = None
+    with _lock:
+        guild = _load().get(_member_of.get(p.name))
+        if guild is None:
+            return
+        if kind == presence.OFFLINE:
+            guild.online.discard(p.name)
+            del _member_of[p.name]
+        elif kind == presence.LEVEL and p.name in guild.members:
+            member = guild.members[p.name] = guild.members[p.name]._replace(level=p.level)
+    if kind == presence.OFFLINE:
+        packet = member_offline_packet(p.name)
+        _send_to_online(guild.name, lambda m: packet)
+    elif kind == presence.LEVEL:
+        if member is not None:
+            _store_member(guild.name, member)
+        by_rank = {}
+        _send_to_online(guild.name, lambda m: by_rank.get(m.rank) or
+                        by_rank.setdefault(m.rank, roster_packet(guild, m.rank)))
+
+
+presence.listen(_on_presence)
+
+
+def online_counts() -> dict:
+    """Online members per guild (a metrics gauge)."""
+    with _lock:
+        return {name: len(g.online) for name, g in (_guilds or {}).items() if g.online}
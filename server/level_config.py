@@ -1,3 +1,5 @@
+import boot
+
 _raw_level_config  = {
     "CraftTown": "LevelsHome.swf/a_Level_Home 1 1 true",
     "CraftTownTutorial": "LevelsHome.swf/a_Level_HomeTutorial 1 1 true",
@@ -465,16 +467,20 @@ DOOR_MAP = {
     ('TutorialDungeon', 2): 'NewbieRoad',
 }
 
-LEVEL_CONFIG = {}
-for name, spec in _raw_level_config.items():
-    parts = spec.split()
-    if len(parts) < 4 or not parts[0]:
-        # skip blank entries or separators
-        continue
+def _parse_level_config():
+    config = {}
+    for name, spec in _raw_level_config.items():
+        parts = spec.split()
+        if len(parts) < 4 or not parts[0]:
+            # skip blank entries or separators
+            continue
+
+        swf_path    = parts[0]
+        map_lvl     = int(parts[1])
+        base_lvl    = int(parts[2])
+        is_inst     = parts[3].lower() == "true"
+        # (we ignore any extra “Hard” token here)
+        config[name] = (swf_path, map_lvl, base_lvl, is_inst)
+    return config
 
-    swf_path    = parts[0]
-    map_lvl     = int(parts[1])
-    base_lvl    = int(parts[2])
-    is_inst     = parts[3].lower() == "true"
-    # (we ignore any extra “Hard” token here)
-    LEVEL_CONFIG[name] = (swf_path, map_lvl, base_lvl, is_inst)
\ No newline at end of file
+LEVEL_CONFIG = boot.section("level_config") or _parse_level_config()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Headless bot client / load generator.
+
+Each bot speaks the real game protocol: handshake (0x11), login (0x13),
+character creation (0x17) when needed, character select (0x16), world
+enter on the transfer target (0x11 + 0x1F, 0x08), then streams movement
+(0x07), power casts (0x09) and chat (0x2C) and periodically walks through
+a door (0x41 -> 0x2D -> 0x1D -> reconnect). Per-step latencies and overall
+throughput are printed at the end.
+
+Bots log in as bot<N>@<domain> and create characters through the server,
+so point this at a scratch copy of the server (its saves/ and Accounts.json
+are written to).
+
+    python loadgen.py --bots 100 --duration 60 --ramp 10
+"""
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+
+from BitUtils import BitBuffer
+from bitreader import BitReader
+from constants import Entity
+from level_config import DOOR_MAP, LEVEL_CONFIG
+from metrics import Histogram
+
+CLASSES = ("Paladin", "Rogue", "Mage")
+CHAT_LINES = ("hello", "lfg", "anyone for the boss?", "brb", "gg")
+
+
+class StepTimeout(Exception):
+    pass
+
+
+class LoadStats:
+    """Shared by every bot: step latencies, failures and wire totals."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = {}       # step name -> Histogram (seconds)
+        self.failures = {}    # step name -> count
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.opcodes_in = {}  # opcode -> count
+
+    def observe(self, step, seconds):
+        with self.lock:
+            hist = self.steps.get(step)
+            if hist is None:
+                hist = self.steps[step] = Histogram()
+            hist.observe(seconds)
+
+    def fail(self, step):
+        with self.lock:
+            self.failures[step] = self.failures.get(step, 0) + 1
+
+    def sent(self, nbytes):
+        with self.lock:
+            self.packets_out += 1
+            self.bytes_out += nbytes
+
+    def received(self, opcode, nbytes):
+        with self.lock:
+            self.packets_in += 1
+            self.bytes_in += nbytes
+            self.opcodes_in[opcode] = self.opcodes_in.get(opcode, 0) + 1
+
+    def report(self, elapsed):
+        with self.lock:
+            lines = [
+                f"{'step':<14}{'count':>8}{'fail':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+            ]
+            for step in sorted(set(self.steps) | set(self.failures)):
+                hist = self.steps.get(step) or Histogram()
+                lines.append(
+                    f"{step:<14}{hist.total:>8}{self.failures.get(step, 0):>6}"
+                    f"{hist.quantile(0.5) * 1000:>10.2f}{hist.quantile(0.95) * 1000:>10.2f}"
+                    f"{hist.quantile(0.99) * 1000:>10.2f}{hist.max * 1000:>10.2f}"
+                )
+            lines.append("")
+            lines.append(f"elapsed     {elapsed:.1f}s")
+            lines.append(f"sent        {self.packets_out} packets ({self.packets_out / elapsed:.0f}/s), "
+                         f"{self.bytes_out} bytes ({self.bytes_out / elapsed / 1024:.1f} KiB/s)")
+            lines.append(f"received    {self.packets_in} packets ({self.packets_in / elapsed:.0f}/s), "
+                         f"{self.bytes_in} bytes ({self.bytes_in / elapsed / 1024:.1f} KiB/s)")
+            top = sorted(self.opcodes_in.items(), key=lambda kv: -kv[1])[:8]
+            lines.append("top inbound " + ", ".join(f"0x{op:02X}={n}" for op, n in top))
+        return "\n".join(lines)
+
+
+def _frame(opcode, payload=b""):
+    return struct.pack(">HH", opcode, len(payload)) + payload
+
+
+def parse_character_names(payload):
+    """Names from a 0x15 login character list."""
+    br = BitReader(payload)
+    br.read_method_4()              # user id
+    br.read_method_393()            # max chars
+    count = br.read_method_393()
+    names = []
+    for _ in range(count):
+        names.append(br.read_method_13())
+        br.read_method_13()         # class
+        br.read_method_6(6)         # level
+    return names
+
+
+def parse_enter_world(payload):
+    """(token, host, port, level) from a 0x21 ENTER_WORLD packet."""
+    br = BitReader(payload)
+    token = br.read_method_4()
+    br.read_method_4()              # old level id
+    br.read_method_13()             # old swf
+    if br.read_bit():
+        br.read_method_4()
+        br.read_method_4()
+    host = br.read_method_13()
+    port = br.read_method_4()
+    br.read_method_13()             # new swf
+    br.read_method_6(6)
+    br.read_method_6(6)
+    level = br.read_method_13()
+    return token, host, port, level
+
+
+class Bot(threading.Thread):
+    def __init__(self, index, args, stats, stop_at):
+        super().__init__(daemon=True)
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.stop_at = stop_at
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.email = f"bot{index:04d}@{args.domain}"
+        self.char_name = f"{args.prefix}{index:04d}"
+        self.sock = None
+        self.ent_id = None
+        self.level = None
+
+        # Frames whose opcode is in `_waiting` are handed to the waiter;
+        # everything else is only counted so server broadcasts never pile up.
+        self._cond = threading.Condition()
+        self._waiting = set()
+        self._arrived = None
+
+    # ─── wire ────────────────────────────────────────────────────────────
+    def connect(self, host, port):
+        self.close()
+        sock = socket.create_connection((host, port), timeout=self.args.timeout)
+        sock.settimeout(None)
+        self.sock = sock
+        threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                # shutdown first: close() alone leaves the connection up
+                # while the read loop is still blocked in recv()
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _read_exact(self, sock, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def _read_loop(self, sock):
+        try:
+            while True:
+                hdr = self._read_exact(sock, 4)
+                if hdr is None:
+                    break
+                opcode, length = struct.unpack(">HH", hdr)
+                payload = self._read_exact(sock, length) if length else b""
+                if payload is None:
+                    break
+                self.stats.received(opcode, 4 + length)
+                with self._cond:
+                    if opcode in self._waiting and self._arrived is None:
+                        self._arrived = (opcode, payload)
+                        self._cond.notify()
+        except OSError:
+            pass
+
+    def send(self, opcode, payload=b""):
+        frame = _frame(opcode, payload)
+        self.sock.sendall(frame)
+        self.stats.sent(len(frame))
+
+    def step(self, name, opcode, payload, expect, timeout=None, before=()):
+        """
+        Send one packet and wait for the first reply whose opcode is in
+        `expect`. Packets in `before` go out first and are part of the timing.
+        """
+        timeout = self.args.timeout if timeout is None else timeout
+        with self._cond:
+            self._waiting = set(expect)
+            self._arrived = None
+        start = time.perf_counter()
+        for pre_opcode, pre_payload in before:
+            self.send(pre_opcode, pre_payload)
+        self.send(opcode, payload)
+        with self._cond:
+            got = self._cond.wait_for(lambda: self._arrived is not None, timeout)
+            arrived, self._arrived = self._arrived, None
+            self._waiting = set()
+        if not got:
+            self.stats.fail(name)
+            raise StepTimeout(f"{name}: no reply to 0x{opcode:02X} within {timeout}s")
+        self.stats.observe(name, time.perf_counter() - start)
+        return arrived
+
+    # ─── protocol steps ──────────────────────────────────────────────────
+    def handshake(self):
+        self.step("handshake", 0x11, struct.pack(">H", self.index & 0xFFFF), {0x12})
+
+    def login(self):
+        bb = BitBuffer()
+        bb.write_utf_string(self.email)
+        opcode, payload = self.step("login", 0x13, b"\x00" * 4 + bb.to_bytes(), {0x15, 0x1B})
+        if opcode != 0x15:
+            raise StepTimeout("login: rejected")
+        return parse_character_names(payload)
+
+    def create_character(self):
+        bb = BitBuffer()
+        bb.write_utf_string(self.char_name)
+        bb.write_utf_string(self.rng.choice(CLASSES))
+        for _ in range(5):          # gender, head, hair, mouth, face -> server defaults
+            bb.write_utf_string("")
+        for _ in range(4):          # hair, skin, shirt, pant colours
+            bb.write_bits(self.rng.getrandbits(24), 24)
+        self.step("create", 0x17, bb.to_bytes(), {0x15})
+
+    def select_character(self):
+        bb = BitBuffer()
+        bb.write_utf_string(self.char_name)
+        _, payload = self.step("select", 0x16, bb.to_bytes(), {0x21})
+        return parse_enter_world(payload)
+
+    def enter_world(self, token, host, port, level):
+        self.connect(host, port)
+        self.handshake()
+        self.step("enter_world", 0x1F, struct.pack(">I", token), {0x10})
+        self.ent_id = token
+        self.level = level
+        # 0x08 has no reply of its own (levels without NPCs send nothing), so
+        # a handshake queued behind it marks the point the server finished it.
+        self.step("world_loaded", 0x11, struct.pack(">H", self.index & 0xFFFF), {0x12},
+                  before=[(0x08, b"")])
+
+    def move(self):
+        bb = BitBuffer()
+        bb.write_method_4(self.ent_id)
+        bb.write_signed_method_45(self.rng.randint(-40, 40))   # dx
+        bb.write_signed_method_45(self.rng.randint(-5, 5))     # dy
+        bb.write_signed_method_45(self.rng.randint(0, 30))     # frame accumulator
+        bb.write_method_6(Entity.const_78, Entity.const_316)
+        running = self.rng.random() < 0.7
+        bb.write_bits(self.rng.random() < 0.5, 1)   # left
+        bb.write_bits(running, 1)                   # running
+        bb.write_bits(0, 1)                         # jumping
+        bb.write_bits(0, 1)                         # dropping
+        bb.write_bits(0, 1)                         # backpedal
+        bb.write_bits(0, 1)                         # no vertical velocity
+        self.send(0x07, bb.to_bytes())
+
+    def cast(self):
+        bb = BitBuffer()
+        bb.write_method_4(self.ent_id)
+        bb.write_method_4(self.rng.randint(1, 60))  # power type
+        bb.write_bits(0, 1)  # charged
+        bb.write_bits(0, 1)  # target point
+        bb.write_bits(0, 1)  # target entity
+        bb.write_bits(0, 1)  # queued
+        bb.write_bits(0, 1)  # extra entity
+        self.step("cast", 0x09, bb.to_bytes(), {0x0A})
+
+    def chat(self):
+        bb = BitBuffer()
+        bb.write_method_4(self.ent_id)
+        bb.write_method_13(f"{self.char_name}: {self.rng.choice(CHAT_LINES)}")
+        self.send(0x2C, bb.to_bytes())
+
+    def take_door(self):
+        doors = [door for (lvl, door), target in DOOR_MAP.items()
+                 if lvl == self.level and door > 0 and target in LEVEL_CONFIG]
+        if not doors:
+            return False
+        door_id = self.rng.choice(doors)
+
+        bb = BitBuffer()
+        bb.write_method_9(door_id)
+        self.step("door_state", 0x41, bb.to_bytes(), {0x42})
+
+        bb = BitBuffer()
+        bb.write_method_9(door_id)
+        opcode, payload = self.step("door_open", 0x2D, bb.to_bytes(), {0x2E, 0x1B})
+        if opcode != 0x2E:
+            return False
+        br = BitReader(payload)
+        br.read_method_4()
+        target = br.read_method_13()
+        if target not in LEVEL_CONFIG:
+            return False
+
+        bb = BitBuffer()
+        bb.write_method_9(door_id)
+        bb.write_method_13(target)
+        start = time.perf_counter()
+        _, payload = self.step("door_transfer", 0x1D, bb.to_bytes(), {0x21})
+        token, host, port, level = parse_enter_world(payload)
+        self.enter_world(token, host, port, level)
+        self.stats.observe("door_total", time.perf_counter() - start)
+        return True
+
+    # ─── main loop ───────────────────────────────────────────────────────
+    def run(self):
+        args = self.args
+        try:
+            self.connect(args.host, args.port)
+            self.handshake()
+            if self.char_name not in self.login():
+                self.create_character()
+            self.enter_world(*self.select_character())
+
+            now = time.monotonic()
+            next_move = now
+            next_cast = now + self.rng.uniform(0, 1.0 / args.cast_hz) if args.cast_hz else None
+            next_chat = now + self.rng.uniform(0, args.chat_interval) if args.chat_interval else None
+            next_door = now + self.rng.uniform(0.5, 1.0) * args.door_interval if args.door_interval else None
+            while (now := time.monotonic()) < self.stop_at:
+                if now >= next_move:
+                    self.move()
+                    next_move += 1.0 / args.move_hz
+                if next_cast is not None and now >= next_cast:
+                    try:
+                        self.cast()
+                    except StepTimeout:
+                        pass
+                    next_cast = now + 1.0 / args.cast_hz
+                if next_chat is not None and now >= next_chat:
+                    self.chat()
+                    next_chat = now + args.chat_interval
+                if next_door is not None and now >= next_door:
+                    self.take_door()
+                    next_door = time.monotonic() + args.door_interval
+                    next_move = time.monotonic()
+                due = [t for t in (next_move, next_cast, next_chat, next_door) if t is not None]
+                time.sleep(max(0.0, min(due) - time.monotonic()))
+        except (StepTimeout, OSError, ValueError) as e:
+            print(f"[LoadGen] bot {self.index} stopped: {e}")
+            self.stats.fail("bot")
+        finally:
+            self.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Headless Dungeon Blitz load generator")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--bots", type=int, default=10)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of in-world traffic")
+    ap.add_argument("--ramp", type=float, default=5.0, help="seconds over which bots are started")
+    ap.add_argument("--move-hz", type=float, default=10.0, help="0x07 updates per second per bot")
+    ap.add_argument("--cast-hz", type=float, default=1.0, help="0x09 casts per second per bot (0 = off)")
+    ap.add_argument("--chat-interval", type=float, default=10.0, help="seconds between chats (0 = off)")
+    ap.add_argument("--door-interval", type=float, default=20.0, help="seconds between door transfers (0 = off)")
+    ap.add_argument("--timeout", type=float, default=10.0, help="per-step reply timeout")
+    ap.add_argument("--prefix", default="Bot", help="character name prefix")
+    ap.add_argument("--domain", default="loadgen.local", help="bot e-mail domain")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    stats = LoadStats()
+    started = time.monotonic()
+    stop_at = started + args.ramp + args.duration
+    bots = []
+    print(f"[LoadGen] Starting {args.bots} bots against {args.host}:{args.port}")
+    for i in range(args.bots):
+        bot = Bot(i, args, stats, stop_at)
+        bot.start()
+        bots.append(bot)
+        if args.ramp and args.bots > 1:
+            time.sleep(args.ramp / args.bots)
+    try:
+        for bot in bots:
+            bot.join(max(0.0, stop_at - time.monotonic()) + args.timeout * 2)
+    except KeyboardInterrupt:
+        print("[LoadGen] Interrupted")
+    print(stats.report(time.monotonic() - started))
+
+
+if __name__ == "__main__":
+    main()
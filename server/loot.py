@@ -0,0 +1,203 @@
+# loot.py
+"""
+Weighted reward draws for lockboxes and reward packs.
+
+Every pack in data/rewardpack_types.json (the client's RewardpackTypes,
+so positions match what 0x108 sends) is compiled once into an alias
+table: a draw is one random() and a lookup, whatever the pack size.
+An entry's weight comes from its rarity (RARITY_WEIGHTS).
+
+    table = loot_table(1)                 # Lockbox01
+    entry = table.draw()                  # RewardEntry
+    rewards, changed = open_lockboxes(char, lockbox_id=1, count=10)
+    save_cache.save_character(user_id, doc, char, changed)
+
+`python bench_loot.py` measures draws per second.
+"""
+import random
+import struct
+
+from BitUtils import BitBuffer
+from constants import RewardpackType
+from static_data import STATIC
+
+# Relative odds per rarity letter (L legendary, R rare, M common)
+RARITY_WEIGHTS = {"L": 1, "R": 6, "M": 20}
+
+# Entries the client can't show without data we don't build yet (eggs
+# want an egg type, gear a rolled gear), so they're never drawn
+UNSUPPORTED_TYPES = frozenset({"Egg", "Gear"})
+
+# LockboxTypes in Game.swz: lockbox ID -> the reward pack it opens
+LOCKBOX_PACKS = {1: "Lockbox01"}
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) per draw."""
+
+    __slots__ = ("_prob", "_alias", "_n")
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("alias table needs at least one positive weight")
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Whatever is left is 1.0 up to rounding
+        self._prob = prob
+        self._alias = alias
+        self._n = n
+
+    def draw(self, rng=random) -> int:
+        u = rng.random() * self._n
+        i = int(u)
+        return i if u - i < self._prob[i] else self._alias[i]
+
+    def draw_many(self, count: int, rng=random) -> list:
+        rand, n, prob, alias = rng.random, self._n, self._prob, self._alias
+        out = []
+        for _ in range(count):
+            u = rand() * n
+            i = int(u)
+            out.append(i if u - i < prob[i] else alias[i])
+        return out
+
+
+class LootTable:
+    """The drawable entries of one reward pack."""
+
+    __slots__ = ("pack_id", "entries", "_alias")
+
+    def __init__(self, pack_id: int, entries):
+        self.pack_id = pack_id
+        self.entries = tuple(entries)
+        self._alias = AliasTable([RARITY_WEIGHTS[e.rarity] for e in self.entries])
+
+    def draw(self, rng=random):
+        return self.entries[self._alias.draw(rng)]
+
+    def draw_many(self, count: int, rng=random) -> list:
+        entries = self.entries
+        return [entries[i] for i in self._alias.draw_many(count, rng)]
+
+    def chance(self, entry) -> float:
+        total = sum(RARITY_WEIGHTS[e.rarity] for e in self.entries)
+        return RARITY_WEIGHTS[entry.rarity] / total if entry in self.entries else 0.0
+
+
+def _compile_tables() -> dict:
+    tables = {}
+    for pack_id in sorted({e.pack_id for e in STATIC.reward_packs}):
+        entries = [e for e in STATIC.reward_pack(pack_id)
+                   if e.reward_type not in UNSUPPORTED_TYPES and RARITY_WEIGHTS.get(e.rarity, 0) > 0]
+        if entries:
+            tables[pack_id] = LootTable(pack_id, entries)
+    return tables
+
+
+_TABLES = _compile_tables()
+
+
+def loot_table(pack_id):
+    return _TABLES.get(pack_id)
+
+
+def lockbox_table(lockbox_id: int):
+    return loot_table(STATIC.reward_pack_id(LOCKBOX_PACKS.get(lockbox_id)))
+
+
+# ─── granting ────────────────────────────────────────────────────────────
+def _add_stack(items: list, id_key: str, item_id: int, count: int) -> None:
+    for item in items:
+        if item.get(id_key) == item_id:
+            item["count"] = item.get("count", 0) + count
+            return
+    items.append({id_key: item_id, "count": count})
+
+
+def _owned(char, entry) -> bool:
+    if entry.reward_type == "Mount":
+        return entry.item_id in char.get("mounts", [])
+    if entry.reward_type == "Pet":
+        return any(p.get("typeID") == entry.item_id for p in char.get("pets", []))
+    return False
+
+
+def grant(char, entry) -> tuple:
+    """Add one reward to the character. Returns the fields it changed."""
+    kind = entry.reward_type
+    if kind == "Gold":
+        char["gold"] = char.get("gold", 0) + (entry.value or 0)
+        return ("gold",)
+    if entry.item_id is None:
+        return ()       # dye packs and the like: nothing stored per character
+    if kind == "Mount":
+        char.setdefault("mounts", []).append(entry.item_id)
+        return ("mounts",)
+    if kind == "Pet":
+        char.setdefault("pets", []).append({"typeID": entry.item_id, "level": 1, "xp": 0, "attr2": 0})
+        return ("pets",)
+    if kind == "Charm":
+        _add_stack(char.setdefault("charms", []), "charmID", entry.item_id, entry.value or 1)
+        return ("charms",)
+    if kind == "Consumable":
+        _add_stack(char.setdefault("consumables", []), "consumableID", entry.item_id, entry.value or 1)
+        return ("consumables",)
+    return ()
+
+
+def open_lockboxes(char, lockbox_id: int, count: int = 1, rng=random):
+    """
+    Open up to `count` lockboxes of one type, each using a Dragon Key,
+    and grant the rewards. A mount or pet the character already owns is
+    swapped for a draw from the entry's AlternateRewardpack.
+
+    Returns (rewards, changed fields); rewards is empty if the character
+    had no box or no key.
+    """
+    table = lockbox_table(lockbox_id)
+    boxes = char.get("lockboxes", [])
+    box = next((b for b in boxes if b.get("lockboxID") == lockbox_id), None)
+    keys = char.get("DragonKeys", 0)
+    count = min(count, box.get("count", 0) if box else 0, keys)
+    if table is None or count <= 0:
+        return [], set()
+
+    box["count"] -= count
+    if box["count"] <= 0:
+        boxes.remove(box)
+    char["DragonKeys"] = keys - count
+    changed = {"lockboxes", "DragonKeys"}
+
+    rewards = []
+    for entry in table.draw_many(count, rng):
+        if entry.alternate and _owned(char, entry):
+            alternate = loot_table(STATIC.reward_pack_id(entry.alternate))
+            if alternate is not None:
+                entry = alternate.draw(rng)
+        changed.update(grant(char, entry))
+        rewards.append(entry)
+    return rewards, changed
+
+
+def reward_packet(entry) -> bytes:
+    """0x108: the reward the lockbox screen reveals."""
+    bb = BitBuffer()
+    bb.write_method_6(entry.pack_id, RewardpackType.PACK_BITS)
+    bb.write_method_6(entry.position, RewardpackType.POSITION_BITS)
+    needs_str = entry.reward_type != "Gold"
+    bb.write_bits(1 if needs_str else 0, 1)
+    if needs_str:
+        bb.write_utf_string(entry.name)
+    payload = bb.to_bytes()
+    return struct.pack(">HH", 0x108, len(payload)) + payload
@@ -0,0 +1,317 @@
+# metrics.py
+import bisect
+import os
+import select
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency bucket upper bounds in seconds: 5µs doubling-ish up to ~20s
+_BUCKET_BOUNDS = [5e-6 * (1.5 ** i) for i in range(38)]
+
+_lock = threading.Lock()
+_opcodes = {}        # opcode -> _OpcodeStats
+_gauges = {}         # name -> (callable returning a number or {label: number}, label name)
+_queue_depths = {}   # session key -> outbound packets waiting on the socket
+_started_at = time.time()
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with interpolated quantiles."""
+
+    def __init__(self, bounds=_BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if not count:
+                continue
+            if seen + count >= rank:
+                lower = self.bounds[idx - 1] if idx > 0 else 0.0
+                upper = self.bounds[idx] if idx < len(self.bounds) else self.max
+                frac = (rank - seen) / count
+                return min(lower + (upper - lower) * frac, self.max)
+            seen += count
+        return self.max
+
+
+class _OpcodeStats:
+    __slots__ = ("packets_in", "bytes_in", "packets_out", "bytes_out", "parse_errors", "latency")
+
+    def __init__(self):
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.parse_errors = 0
+        self.latency = Histogram()
+
+
+def _stats(opcode: int) -> _OpcodeStats:
+    st = _opcodes.get(opcode)
+    if st is None:
+        st = _opcodes[opcode] = _OpcodeStats()
+    return st
+
+
+def record_inbound(opcode: int, nbytes: int, seconds: float) -> None:
+    """Count one handled client packet and the time its handler took."""
+    with _lock:
+        st = _stats(opcode)
+        st.packets_in += 1
+        st.bytes_in += nbytes
+        st.latency.observe(seconds)
+
+
+def record_outbound(opcode: int, nbytes: int) -> None:
+    with _lock:
+        st = _stats(opcode)
+        st.packets_out += 1
+        st.bytes_out += nbytes
+
+
+def record_parse_error(opcode: int) -> None:
+    with _lock:
+        _stats(opcode).parse_errors += 1
+
+
+@contextmanager
+def handling(opcode: int, nbytes: int):
+    """
+    Time the handler for one inbound packet. A ValueError escaping the
+    handler (BitReader running out of bits) is counted as a parse error.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except ValueError:
+        record_parse_error(opcode)
+        raise
+    finally:
+        record_inbound(opcode, nbytes, time.perf_counter() - start)
+
+
+def register_gauge(name: str, fn, label: str = "label") -> None:
+    """
+    Register a gauge sampled at render time. `fn` returns either a number
+    or a dict mapping a `label` value to a number.
+    """
+    with _lock:
+        _gauges[name] = (fn, label)
+
+
+def set_queue_depth(key: str, depth: int) -> None:
+    with _lock:
+        _queue_depths[key] = depth
+
+
+def clear_session(key: str) -> None:
+    with _lock:
+        _queue_depths.pop(key, None)
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.9g}"
+    return str(value)
+
+
+def render_text() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = sorted(_opcodes.items())
+        queues = sorted(_queue_depths.items())
+        gauges = sorted(_gauges.items())
+
+        lines = [
+            "# TYPE dbz_uptime_seconds gauge",
+            f"dbz_uptime_seconds {_fmt(time.time() - _started_at)}",
+        ]
+        counters = (
+            ("dbz_packets_in_total", "packets_in"),
+            ("dbz_bytes_in_total", "bytes_in"),
+            ("dbz_packets_out_total", "packets_out"),
+            ("dbz_bytes_out_total", "bytes_out"),
+            ("dbz_parse_errors_total", "parse_errors"),
+        )
+        for metric, attr in counters:
+            lines.append(f"# TYPE {metric} counter")
+            for opcode, st in snapshot:
+                lines.append(f'{metric}{{opcode="0x{opcode:02X}"}} {getattr(st, attr)}')
+
+        lines.append("# TYPE dbz_handler_latency_seconds summary")
+        for opcode, st in snapshot:
+            hist = st.latency
+            if not hist.total:
+                continue
+            label = f'opcode="0x{opcode:02X}"'
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'dbz_handler_latency_seconds{{{label},quantile="{q}"}} {_fmt(hist.quantile(q))}')
+            lines.append(f"dbz_handler_latency_seconds_sum{{{label}}} {_fmt(hist.sum)}")
+            lines.append(f"dbz_handler_latency_seconds_count{{{label}}} {hist.total}")
+
+        lines.append("# TYPE dbz_outbound_queue_depth gauge")
+        for key, depth in queues:
+            lines.append(f'dbz_outbound_queue_depth{{session="{key}"}} {depth}')
+
+    # Gauges call back into server state, so sample them outside our lock
+    for name, (fn, label_name) in gauges:
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"[Metrics] Gauge {name} failed: {e}")
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                lines.append(f'{name}{{{label_name}="{label}"}} {_fmt(v)}')
+        else:
+            lines.append(f"{name} {_fmt(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def merge_text(texts: dict, label: str = "worker") -> str:
+    """
+    Combine render_text() output from several processes ({source: text})
+    into one exposition, each sample labelled with its source.
+    """
+    families = {}       # metric family -> [# TYPE line, samples...]
+    for source, text in texts.items():
+        family = ""
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                family = line.split()[2]
+                families.setdefault(family, [line])
+                continue
+            if not line or line.startswith("#"):
+                continue
+            series, _, value = line.rpartition(" ")
+            name, brace, labels = series.partition("{")
+            labels = f'{label}="{source}",{labels}' if brace else f'{label}="{source}"}}'
+            families.setdefault(family, []).append(f"{name}{{{labels} {value}")
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+def start_dump_thread(path: str = "metrics.txt", interval: float = 60.0):
+    """Periodically write render_text() to `path`, replacing it atomically."""
+    def _dump():
+        while True:
+            time.sleep(interval)
+            try:
+                dirpath = os.path.dirname(path) or "."
+                with tempfile.NamedTemporaryFile("w", dir=dirpath, delete=False, encoding="utf-8") as tf:
+                    tf.write(render_text())
+                os.replace(tf.name, path)
+            except OSError as e:
+                print(f"[Metrics] Failed to dump to {path}: {e}")
+
+    thread = threading.Thread(target=_dump, daemon=True)
+    thread.start()
+    print(f"[Metrics] Dumping to {path} every {interval:g}s")
+    return thread
+
+
+def _writable(sock, timeout: float) -> bool:
+    # poll() where there is one: select() can't take descriptors past FD_SETSIZE
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        return bool(poller.poll(timeout * 1000))
+    return bool(select.select((), (sock,), (), timeout)[1])
+
+
+class MeteredSocket:
+    """
+    Wraps a client socket so every sendall() is counted per opcode. The
+    session's outbound queue depth is the number of sendall() calls
+    currently blocked on the socket plus its movement outbox backlog
+    (set_backlog, see movement.py).
+
+    Many threads write to one client (its own connection thread, the
+    movement senders, other sessions' threads, the timers), so sendall()
+    holds a per-socket lock: each write goes out whole, never interleaved.
+    sendall(data, timeout) gives up after `timeout` seconds (TimeoutError),
+    for writers that must not wait out the socket's own timeout on a
+    stalled client; whatever it had written is then a torn frame, so the
+    caller has to drop the connection.
+    """
+
+    def __init__(self, conn, addr):
+        self._conn = conn
+        self._key = f"{addr[0]}:{addr[1]}"
+        self._pending = 0
+        self._backlog = 0
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        set_queue_depth(self._key, 0)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _adjust(self, delta: int) -> None:
+        with self._pending_lock:
+            self._pending += delta
+            if not self._closed:
+                set_queue_depth(self._key, self._pending + self._backlog)
+
+    def set_backlog(self, queued: int) -> None:
+        with self._pending_lock:
+            self._backlog = queued
+            if not self._closed:
+                set_queue_depth(self._key, self._pending + self._backlog)
+
+    def _send_within(self, data: bytes, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        if not self._send_lock.acquire(timeout=timeout):
+            raise TimeoutError("another write is stuck on the socket")
+        try:
+            view = memoryview(data)
+            while view:
+                left = deadline - time.monotonic()
+                if left <= 0 or not _writable(self._conn, left):
+                    raise TimeoutError(f"{len(view)} of {len(data)} bytes unsent")
+                view = view[self._conn.send(view):]
+        finally:
+            self._send_lock.release()
+
+    def sendall(self, data: bytes, timeout: float = None) -> None:
+        self._adjust(1)
+        try:
+            if timeout is None:
+                with self._send_lock:
+                    self._conn.sendall(data)
+            else:
+                self._send_within(data, timeout)
+        finally:
+            self._adjust(-1)
+        # A single write may carry several framed packets
+        offset = 0
+        while offset + 4 <= len(data):
+            opcode, length = struct.unpack_from(">HH", data, offset)
+            record_outbound(opcode, 4 + length)
+            offset += 4 + length
+
+    def close(self) -> None:
+        with self._pending_lock:
+            self._closed = True
+        clear_session(self._key)
+        self._conn.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Copy accounts, saves, character templates and guilds between storage backends.
+
+    python migrate_storage.py json sqlite:game.db      # Accounts.json + saves/ -> SQLite
+    python migrate_storage.py sqlite:game.db json      # and back
+    python migrate_storage.py json:/backup sqlite      # from another server root
+
+Backends are given as DBZ_STORAGE specs (see storage.py). The target is
+overwritten user by user; users only present in the target are left alone.
+Stop the server first, or at least make sure nobody is logged in.
+"""
+import argparse
+import sys
+
+from storage import open_storage
+
+
+def migrate(source, target, verify=True):
+    accounts = source.read_accounts()
+    target.write_accounts(accounts)
+    print(f"[Migrate] {len(accounts)} accounts")
+
+    # Before the saves: a save is read against the template version it was made on
+    templates = source.templates()
+    for template_id, version in templates:
+        target.save_template(template_id, version, source.load_template(template_id, version))
+    print(f"[Migrate] {len(templates)} character templates")
+
+    guilds = source.load_guilds()
+    for name, doc in guilds.items():
+        target.update_guild(name, lambda _, doc=doc: doc)
+    print(f"[Migrate] {len(guilds)} guilds")
+
+    users = source.user_ids()
+    chars = 0
+    for i, user_id in enumerate(users, 1):
+        _, doc = source.load_user(user_id)
+        if doc is None:
+            continue
+        target.save_user(user_id, doc)
+        chars += len(doc.get("characters") or [])
+        if verify:
+            _, copied = target.load_user(user_id)
+            if copied.get("characters") != doc.get("characters"):
+                raise RuntimeError(f"user {user_id} did not survive the copy")
+        if i % 500 == 0:
+            print(f"[Migrate] {i}/{len(users)} users")
+    print(f"[Migrate] {len(users)} users, {chars} characters")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Copy accounts and saves between storage backends")
+    ap.add_argument("source", help='e.g. "json" or "sqlite:game.db"')
+    ap.add_argument("target", help='e.g. "sqlite:game.db" or "json"')
+    ap.add_argument("--no-verify", action="store_true", help="skip reading every user back from the target")
+    args = ap.parse_args()
+
+    if args.source == args.target:
+        ap.error("source and target are the same")
+    migrate(open_storage(args.source), open_storage(args.target), verify=not args.no_verify)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
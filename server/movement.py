@@ -0,0 +1,252 @@
+# movement.py
+"""
+Latest-value-wins delivery of movement updates (0x0F for moving players
+and NPCs).
+
+Instead of writing every update straight to every observer's socket,
+each observer has an Outbox holding at most one pending packet per
+entity it sees: a newer update for the same entity replaces the pending
+one (counted as coalesced). The flusher sends what is due every
+FLUSH_INTERVAL as one write per observer. Entities far from the observer
+are due less often (RATE_TIERS), so their intermediate positions are
+coalesced away too. An observer whose socket is still busy with the
+previous write is skipped; its pending updates keep coalescing until it
+catches up, so a slow client never builds an unbounded queue. A write
+still unfinished after SEND_TIMEOUT drops the client, so a few stalled
+ones can't hold every send thread for the socket's 300 s timeout.
+
+    movement.publish(grid, ent_id, packet, x, y, exclude=session)
+    movement.discard(observer, ent_id)      # the entity left view: drop its update
+    movement.close(session)                 # on disconnect
+    movement.start_flusher()
+
+Pending updates thrown away unsent (the entity left view, the observer
+disconnected) are counted as dropped. counters() is a metrics gauge.
+
+The outbox also carries packets that must all arrive, in order (chat,
+see chat.py): push() appends them to a bounded queue and each flush
+sends at most QUEUED_PER_FLUSH of them after the movement updates, so a
+flood of them can delay itself but never the movement traffic.
+"""
+import socket
+import threading
+import time
+import weakref
+from collections import deque
+
+import aoi
+
+FLUSH_INTERVAL = 0.05       # seconds between flushes (20 Hz for nearby entities)
+SEND_THREADS = 4
+SEND_TIMEOUT = 5.0          # seconds a write may take before the observer is dropped
+QUEUED_PER_FLUSH = 8        # push()ed packets sent per observer per flush
+MAX_QUEUED = 256            # push()ed packets an observer may have waiting
+
+# (distance as a fraction of the view radius, flushes between updates)
+RATE_TIERS = ((0.5, 1), (1.0, 2), (float("inf"), 4))
+
+_counters = {"queued": 0, "coalesced": 0, "dropped": 0, "sent": 0, "writes": 0, "busy": 0,
+             "pushed": 0, "push_dropped": 0, "timed_out": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(**deltas) -> None:
+    with _counters_lock:
+        for key, delta in deltas.items():
+            _counters[key] += delta
+
+
+def counters() -> dict:
+    """Movement updates queued/coalesced/dropped/sent since start (a metrics gauge)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def _flushes_between(distance: float, radius: float) -> int:
+    for fraction, every in RATE_TIERS:
+        if distance <= radius * fraction:
+            return every
+    return RATE_TIERS[-1][1]
+
+
+class Outbox:
+    """One observer's pending movement updates, newest per entity."""
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.pending = {}       # entity ID -> (packet, x, y)
+        self.last_sent = {}     # entity ID -> flush number it was last sent on
+        self.queue = deque()    # push()ed packets, oldest first
+        self.busy = False       # a write to the socket is in progress
+
+    def __len__(self):
+        return len(self.pending) + len(self.queue)
+
+    def put(self, ent_id, packet: bytes, x: float, y: float) -> bool:
+        """Queue the entity's newest update. True if it replaced a pending one."""
+        with self.lock:
+            replaced = ent_id in self.pending
+            self.pending[ent_id] = (packet, x, y)
+            self._report()
+        return replaced
+
+    def push(self, packet: bytes) -> bool:
+        """Queue a packet to send in order. False if the queue was full (oldest dropped)."""
+        with self.lock:
+            full = len(self.queue) >= MAX_QUEUED
+            if full:
+                self.queue.popleft()
+            self.queue.append(packet)
+            self._report()
+        return not full
+
+    def discard(self, ent_id) -> bool:
+        with self.lock:
+            self.last_sent.pop(ent_id, None)
+            dropped = self.pending.pop(ent_id, None) is not None
+            self._report()
+        return dropped
+
+    def take_due(self, flush_no: int, origin, radius: float) -> list:
+        """
+        Remove and return the packets due on this flush. `origin` is the
+        observer's (x, y), or None to treat everything as nearby.
+        """
+        due = []
+        with self.lock:
+            for ent_id, (packet, x, y) in list(self.pending.items()):
+                if origin is not None:
+                    distance = ((x - origin[0]) ** 2 + (y - origin[1]) ** 2) ** 0.5
+                    every = _flushes_between(distance, radius)
+                    if flush_no - self.last_sent.get(ent_id, -every) < every:
+                        continue
+                del self.pending[ent_id]
+                self.last_sent[ent_id] = flush_no
+                due.append(packet)
+            for _ in range(min(QUEUED_PER_FLUSH, len(self.queue))):
+                due.append(self.queue.popleft())
+            self._report()
+        return due
+
+    def _report(self) -> None:
+        set_backlog = getattr(self.session.conn, "set_backlog", None)
+        if set_backlog is not None:
+            set_backlog(len(self.pending) + len(self.queue))
+
+
+_outboxes = {}      # session -> Outbox
+_outboxes_lock = threading.Lock()
+_closed = weakref.WeakSet()     # sessions close()d: a publish racing the disconnect mustn't revive them
+
+
+def outbox(session) -> Outbox:
+    box = _outboxes.get(session)
+    if box is None:
+        with _outboxes_lock:
+            if session in _closed:
+                return Outbox(session)      # never flushed
+            box = _outboxes.setdefault(session, Outbox(session))
+    return box
+
+
+def publish(grid, ent_id, packet: bytes, x: float, y: float, exclude=None) -> int:
+    """Queue `packet` for every session that sees `ent_id`. Returns how many."""
+    queued = coalesced = 0
+    for observer in grid.observers(ent_id):
+        if observer is exclude or not observer.world_loaded:
+            continue
+        coalesced += outbox(observer).put(ent_id, packet, x, y)
+        queued += 1
+    _count(queued=queued, coalesced=coalesced)
+    return queued
+
+
+def push(session, packet: bytes) -> None:
+    """Queue a packet for the session's next flush, behind its movement updates."""
+    if outbox(session).push(packet):
+        _count(pushed=1)
+    else:
+        _count(pushed=1, push_dropped=1)
+
+
+def discard(observer, ent_id) -> None:
+    """Forget the entity's pending update for this observer (it left view)."""
+    box = _outboxes.get(observer)
+    if box is not None and box.discard(ent_id):
+        _count(dropped=1)
+
+
+def close(session) -> None:
+    with _outboxes_lock:
+        box = _outboxes.pop(session, None)
+        _closed.add(session)
+    if box is not None:
+        with box.lock:
+            dropped = len(box.pending)
+            box.pending.clear()
+            box.queue.clear()
+        _count(dropped=dropped)
+
+
+def _write(box: Outbox, packets: list) -> None:
+    conn = box.session.conn
+    try:
+        conn.sendall(b"".join(packets), timeout=SEND_TIMEOUT)
+        _count(sent=len(packets), writes=1)
+    except TimeoutError as e:
+        # Part of a frame may be out: the stream is unusable, drop the client
+        print(f"[Movement] Dropping {box.session.addr}: send stalled ({e})")
+        _count(timed_out=1)
+        try:
+            conn.shutdown(socket.SHUT_RDWR)     # its handler sees EOF and cleans up
+        except OSError:
+            pass
+    except OSError:
+        pass    # its own handler notices the dead socket
+    finally:
+        box.busy = False
+
+
+def flush(flush_no: int, submit=None) -> int:
+    """Send every observer's due updates. Returns the number of packets."""
+    total = 0
+    with _outboxes_lock:
+        boxes = list(_outboxes.items())
+    for session, box in boxes:
+        if box.busy:
+            _count(busy=1)
+            continue
+        if not (box.pending or box.queue) or not session.world_loaded:
+            continue
+        grid = aoi.level_grid(session.current_level)
+        packets = box.take_due(flush_no, grid.position(session.clientEntID), grid.radius)
+        if not packets:
+            continue
+        total += len(packets)
+        box.busy = True
+        if submit is None:
+            _write(box, packets)
+        else:
+            submit(_write, box, packets)
+    return total
+
+
+def start_flusher(interval: float = FLUSH_INTERVAL) -> threading.Thread:
+    # concurrent.futures is slow to import, so not at module load
+    from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(max_workers=SEND_THREADS, thread_name_prefix="movement-send")
+
+    def run():
+        flush_no = 0
+        while True:
+            time.sleep(interval)
+            flush_no += 1
+            try:
+                flush(flush_no, pool.submit)
+            except Exception as e:
+                print(f"[Movement] Flush failed: {e}")
+
+    thread = threading.Thread(target=run, name="movement-flush", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,286 @@
+# npc_sim.py
+"""
+Server-side NPC movement, stepped for a whole level at once.
+
+Every NPC with a behavior_speed above 0 patrols around its spawn point,
+chases the nearest player that comes within AGGRO_RADIUS, and walks back
+home once the player gets away or it strays past LEASH_RADIUS. NPCs with
+no speed (vendors, trainers) stay idle. Levels are 2D side-scrollers, so
+NPCs move along x and keep their spawn height.
+
+One LevelSim per level owns that level's NPC dicts; every session in the
+level shares them, so a hit or a move is seen the same way by everyone.
+The world tick steps each level that has players in it and writes the
+NPCs that moved or turned to the level's entity store (entity_store.py);
+the store's dirty scan is the tick's dirty set, and only those NPCs are
+re-sent (0x0F) to the players that can see them (aoi.py, movement.py).
+
+Only the world tick thread moves NPCs and changes their HP: connection
+threads queue their hits (combat.py) and the tick resolves them, so that
+needs no lock per entity, GIL or not. Buffs are applied on the connection
+thread that got the 0x0B/0x0C, under the level's LevelBuffs lock; the
+tick expires them and sends the changes (buffs.py).
+
+    sim = level_sim("CraftTown")
+    sim.step(0.1, [(px, py), ...])             -> NPC IDs that changed
+    sim.publish(sim.take_dirty())
+    start_world_tick()
+
+The step runs on NumPy arrays when NumPy is installed and as a plain
+loop otherwise (see entity_store.py). `python bench_npc.py` times both.
+"""
+import struct
+import threading
+import time
+
+import aoi
+import buffs
+import combat
+import entity_store
+import movement
+from constants import Entity
+from entity import Send_Entity_Data
+from Entity_Data import load_npc_data_for_level
+
+np = entity_store.np
+
+IDLE, PATROL, CHASE, RETURN = 0, 1, 2, 3
+
+TICK_INTERVAL = 0.1         # seconds between world ticks
+BASE_SPEED = 150.0          # level units per second at behavior_speed 1.0
+CHASE_FACTOR = 1.5          # chasing is faster than patrolling
+PATROL_RANGE = 250.0        # how far either side of spawn a patrol goes
+AGGRO_RADIUS = 600.0        # a player this close gets chased
+DEAGGRO_RADIUS = 900.0      # ...until they are this far away
+LEASH_RADIUS = 1500.0       # never chase farther than this from spawn
+STOP_DISTANCE = 60.0        # close enough to the target to stop moving
+
+
+class LevelSim:
+    def __init__(self, level_name: str, npcs: list):
+        self.level_name = level_name
+        self.npcs = npcs
+        for npc in npcs:
+            # NPCs spawn active; players see this state from their first 0x08 on
+            npc["entState"] = Entity.const_78
+        self.by_id = {npc["id"]: npc for npc in npcs}
+        self.store = entity_store.level_store(level_name)
+        self.lock = threading.Lock()
+        n = len(npcs)
+        self.ids = [npc["id"] for npc in npcs]
+        spawn_x = [float(npc.get("x", 0.0)) for npc in npcs]
+        spawn_y = [float(npc.get("y", 0.0)) for npc in npcs]
+        speed = [float(npc.get("behavior_speed", 0.0)) * BASE_SPEED for npc in npcs]
+        mode = [PATROL if s > 0 else IDLE for s in speed]
+        heading = [-1.0 if npc.get("facing_left") else 1.0 for npc in npcs]
+        if np is not None:
+            self.spawn_x = np.array(spawn_x, dtype=np.float64)
+            self.spawn_y = np.array(spawn_y, dtype=np.float64)
+            self.x = self.spawn_x.copy()
+            self.speed = np.array(speed, dtype=np.float64)
+            self.mode = np.array(mode, dtype=np.int8)
+            self.heading = np.array(heading, dtype=np.float64)
+        else:
+            self.spawn_x, self.spawn_y = spawn_x, spawn_y
+            self.x = list(spawn_x)
+            self.speed, self.mode, self.heading = speed, mode, heading
+        self.size = n
+
+    # ─── one tick ────────────────────────────────────────────────────────
+    def step(self, dt: float, players) -> list:
+        """
+        Advance every NPC by `dt` seconds and write the new positions and
+        facings to the entity store. Returns the IDs that changed.
+        """
+        with self.lock:
+            if not self.size:
+                return []
+            if np is not None:
+                changed = self._step_arrays(dt, players)
+            else:
+                changed = self._step_loop(dt, players)
+            ids, x, y, heading = self.ids, self.x, self.spawn_y, self.heading
+            changed_ids = [ids[i] for i in changed]
+            self.store.set_positions(changed_ids, [float(x[i]) for i in changed],
+                                     [float(y[i]) for i in changed], [heading[i] < 0 for i in changed])
+            return changed_ids
+
+    def take_dirty(self) -> list:
+        """IDs of this level's NPCs the store has seen move or turn since the last call."""
+        by_id = self.by_id
+        return [ent_id for ent_id, _ in self.store.take_dirty(entity_store.DIRTY_POS | entity_store.DIRTY_STATE)
+                if ent_id in by_id]
+
+    def _step_arrays(self, dt, players):
+        x, sx, sy = self.x, self.spawn_x, self.spawn_y
+        mobile = self.speed > 0
+        if players:
+            p = np.asarray(players, dtype=np.float64).reshape(-1, 2)
+            dx = p[:, 0][None, :] - x[:, None]
+            dy = p[:, 1][None, :] - sy[:, None]
+            d2 = dx * dx + dy * dy
+            nearest = d2.argmin(axis=1)
+            near_d2 = d2[np.arange(self.size), nearest]
+            target_x = p[nearest, 0]
+        else:
+            near_d2 = np.full(self.size, np.inf)
+            target_x = x
+        from_home = np.abs(x - sx)
+
+        old_mode = self.mode
+        mode = old_mode.copy()
+        chasing = mode == CHASE
+        mode[chasing & ((near_d2 > DEAGGRO_RADIUS ** 2) | (from_home > LEASH_RADIUS))] = RETURN
+        mode[mobile & (mode != RETURN) & (near_d2 <= AGGRO_RADIUS ** 2) & (from_home <= LEASH_RADIUS)] = CHASE
+        mode[(mode == RETURN) & (from_home <= STOP_DISTANCE)] = PATROL
+        mode[~mobile] = IDLE
+
+        heading = self.heading.copy()
+        patrol = mode == PATROL
+        heading[patrol & (x >= sx + PATROL_RANGE)] = -1.0
+        heading[patrol & (x <= sx - PATROL_RANGE)] = 1.0
+        chase = mode == CHASE
+        gap = target_x - x
+        heading[chase] = np.where(gap[chase] < 0, -1.0, 1.0)
+        back = mode == RETURN
+        heading[back] = np.where(x[back] > sx[back], -1.0, 1.0)
+
+        v = self.speed * heading
+        v[chase] *= CHASE_FACTOR
+        v[chase & (np.abs(gap) <= STOP_DISTANCE)] = 0.0
+        v[mode == IDLE] = 0.0
+        new_x = x + v * dt
+        # don't walk past home on the way back
+        overshoot = back & ((new_x - sx) * (x - sx) < 0)
+        new_x[overshoot] = sx[overshoot]
+
+        changed = (new_x != x) | (mode != old_mode) | (heading != self.heading)
+        self.x, self.mode, self.heading = new_x, mode, heading
+        return np.flatnonzero(changed).tolist()
+
+    def _step_loop(self, dt, players):
+        changed = []
+        aggro2, deaggro2 = AGGRO_RADIUS ** 2, DEAGGRO_RADIUS ** 2
+        for i in range(self.size):
+            x, sx, sy, speed = self.x[i], self.spawn_x[i], self.spawn_y[i], self.speed[i]
+            near_d2, target_x = float("inf"), x
+            for px, py in players:
+                d2 = (px - x) ** 2 + (py - sy) ** 2
+                if d2 < near_d2:
+                    near_d2, target_x = d2, px
+            from_home = abs(x - sx)
+
+            old_mode = mode = self.mode[i]
+            if mode == CHASE and (near_d2 > deaggro2 or from_home > LEASH_RADIUS):
+                mode = RETURN
+            if speed > 0 and mode != RETURN and near_d2 <= aggro2 and from_home <= LEASH_RADIUS:
+                mode = CHASE
+            if mode == RETURN and from_home <= STOP_DISTANCE:
+                mode = PATROL
+            if speed <= 0:
+                mode = IDLE
+
+            old_heading = heading = self.heading[i]
+            gap = target_x - x
+            if mode == PATROL:
+                if x >= sx + PATROL_RANGE:
+                    heading = -1.0
+                elif x <= sx - PATROL_RANGE:
+                    heading = 1.0
+            elif mode == CHASE:
+                heading = -1.0 if gap < 0 else 1.0
+            elif mode == RETURN:
+                heading = -1.0 if x > sx else 1.0
+
+            v = speed * heading
+            if mode == CHASE:
+                v *= CHASE_FACTOR
+                if abs(gap) <= STOP_DISTANCE:
+                    v = 0.0
+            elif mode == IDLE:
+                v = 0.0
+            new_x = x + v * dt
+            if mode == RETURN and (new_x - sx) * (x - sx) < 0:
+                new_x = sx
+
+            if new_x != x or mode != old_mode or heading != old_heading:
+                changed.append(i)
+            self.x[i], self.mode[i], self.heading[i] = new_x, mode, heading
+        return changed
+
+    def publish(self, dirty_ids) -> int:
+        """Write moved NPCs back to their dicts and queue each one's 0x0F
+        for the players that see it."""
+        if not dirty_ids:
+            return 0
+        grid = aoi.level_grid(self.level_name)
+        index = {ent_id: i for i, ent_id in enumerate(self.ids)} if len(dirty_ids) > 8 else None
+        sent = 0
+        for ent_id in dirty_ids:
+            i = index[ent_id] if index is not None else self.ids.index(ent_id)
+            npc = self.by_id[ent_id]
+            x = float(self.x[i])
+            npc["x"] = x
+            npc["facing_left"] = bool(self.heading[i] < 0)
+            payload = Send_Entity_Data(npc, is_player=False)
+            sent += movement.publish(grid, ent_id, struct.pack(">HH", 0x0F, len(payload)) + payload,
+                                     x, npc.get("y", 0.0))
+        return sent
+
+
+_sims = {}
+_sims_lock = threading.Lock()
+
+
+def level_sim(level_name: str) -> LevelSim:
+    """The level's simulation, created (and its NPCs indexed) on first use."""
+    sim = _sims.get(level_name)
+    if sim is None:
+        with _sims_lock:
+            sim = _sims.get(level_name)
+            if sim is None:
+                sim = LevelSim(level_name, load_npc_data_for_level(level_name))
+                for npc in sim.npcs:
+                    sim.store.add_entity(npc["id"], npc)
+                sim.take_dirty()    # 0x08 sends the spawns; nothing to re-send yet
+                _sims[level_name] = sim
+    return sim
+
+
+def tick(dt: float) -> int:
+    """
+    Step every level someone is in, then resolve the hits queued since the
+    last tick (combat.py) and expire and send buff changes (buffs.py).
+    Returns the number of NPCs re-sent.
+    """
+    moved = 0
+    with _sims_lock:
+        sims = list(_sims.items())
+    for level_name, sim in sims:
+        players = aoi.level_grid(level_name).player_positions()
+        if not players:
+            continue    # nobody to see it: the level stays frozen
+        sim.step(dt, players)
+        dirty = sim.take_dirty()
+        sim.publish(dirty)
+        moved += len(dirty)
+    combat.tick()
+    buffs.tick()
+    return moved
+
+
+def start_world_tick(interval: float = TICK_INTERVAL) -> threading.Thread:
+    def run():
+        last = time.perf_counter()
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter()
+            try:
+                tick(now - last)
+            except Exception as e:
+                print(f"[Tick] NPC step failed: {e}")
+            last = now
+
+    thread = threading.Thread(target=run, name="world-tick", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,173 @@
+# packet_pool.py
+"""
+Optional worker processes for the two packets that are expensive to
+build: 0x10 (Player_Data_Packet, several ms per character) and 0x15
+(the login character list).
+
+Both are pure functions of the character, so a burst of logins and
+level transfers doesn't have to serialize on the connection threads'
+GIL. The connection thread takes a snapshot (pickle of the character;
+a TemplatedCharacter pickles as just what differs from its template),
+looks up what the packet shows that lives in this process (the clock,
+friends' and guildmates' online status, see WorldEnter.live_data) and
+hands both to a worker. It then waits for the bytes on a future, which
+lets the other threads run. Packets of SHM_THRESHOLD bytes or more come
+back through a shared memory block instead of the result pipe.
+
+Under low load (fewer than INLINE_BELOW builds already under way) and
+whenever the pool is off, broken or too slow, the packet is built
+inline, so the bytes are always the same.
+
+    packet_pool.start(2)                    # server.py --packet-workers 2
+    ...
+    packet_pool.stop()                      # on shutdown
+    conn.sendall(packet_pool.player_data(char, transfer_token=token))
+    conn.sendall(packet_pool.character_list(session.char_list))
+
+counters() is a metrics gauge.
+"""
+import pickle
+import threading
+
+from Character import build_login_character_list_bitpacked
+from WorldEnter import Player_Data_Packet, live_data
+
+INLINE_BELOW = 2                # builds under way before new ones go to the pool
+SHM_THRESHOLD = 32 * 1024       # bytes; smaller results come back through the pipe
+BUILD_TIMEOUT = 5.0             # seconds to wait for a worker before building inline
+
+_pool = None
+_lock = threading.Lock()
+_building = 0
+_counters = {"inline": 0, "pooled": 0, "shared_memory": 0, "fallback": 0}
+
+
+def _count(key: str) -> None:
+    with _lock:
+        _counters[key] += 1
+
+
+def counters() -> dict:
+    """Packets built inline, in the pool, returned through shared memory, and pool fallbacks."""
+    with _lock:
+        return dict(_counters)
+
+
+# ─── worker side ─────────────────────────────────────────────────────────
+def _return(data: bytes):
+    if len(data) < SHM_THRESHOLD:
+        return data
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    shm.close()     # the connection thread reads and unlinks it
+    return shm.name, len(data)
+
+
+def _build_player_data(snapshot: bytes, kwargs: dict):
+    return _return(Player_Data_Packet(pickle.loads(snapshot), **kwargs))
+
+
+def _build_character_list(snapshot: bytes):
+    return _return(build_login_character_list_bitpacked(pickle.loads(snapshot)))
+
+
+def _ready() -> bool:
+    return True
+
+
+def _init_worker() -> None:
+    # Ctrl-C reaches the whole process group; the server shuts us down itself
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# ─── connection side ─────────────────────────────────────────────────────
+def _receive(result) -> bytes:
+    if isinstance(result, bytes):
+        return result
+    from multiprocessing import shared_memory
+    name, size = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+        _count("shared_memory")
+
+
+def _discard(future) -> None:
+    # A build we stopped waiting for: don't leak its shared memory block
+    if not future.cancelled() and future.exception() is None:
+        _receive(future.result())
+
+
+def _build(inline, job, args) -> bytes:
+    """inline() now, or job(*args()) in the pool when enough builds are under way."""
+    global _building
+    with _lock:
+        pool = _pool if _building >= INLINE_BELOW else None
+        _building += 1
+    try:
+        if pool is not None:
+            future = None
+            try:
+                future = pool.submit(job, *args())
+                data = _receive(future.result(BUILD_TIMEOUT))
+                _count("pooled")
+                return data
+            except Exception as e:
+                print(f"[PacketPool] {job.__name__} failed in the pool, building inline: {e!r}")
+                _count("fallback")
+                if future is not None and not future.done():
+                    future.add_done_callback(_discard)
+        data = inline()
+        _count("inline")
+        return data
+    finally:
+        with _lock:
+            _building -= 1
+
+
+def player_data(char, **kwargs) -> bytes:
+    """Player_Data_Packet(char, **kwargs), in the pool when it's busy."""
+    kwargs["live"] = live_data(char)
+    return _build(lambda: Player_Data_Packet(char, **kwargs), _build_player_data,
+                  lambda: (pickle.dumps(char, pickle.HIGHEST_PROTOCOL), kwargs))
+
+
+def character_list(characters: list) -> bytes:
+    """build_login_character_list_bitpacked(characters), in the pool when it's busy."""
+    def snapshot():
+        # the list only shows these three
+        shown = [{"name": c["name"], "class": c["class"], "level": c["level"]} for c in characters]
+        return (pickle.dumps(shown, pickle.HIGHEST_PROTOCOL),)
+    return _build(lambda: build_login_character_list_bitpacked(characters), _build_character_list,
+                  snapshot)
+
+
+def start(processes: int):
+    """Start `processes` workers (spawned: the server is multi-threaded by now)."""
+    global _pool
+    # concurrent.futures is slow to import, so not at module load
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+    # Pay for the spawn and the imports now, not on the first busy login
+    for f in [pool.submit(_ready) for _ in range(processes)]:
+        f.result()
+    with _lock:
+        _pool = pool
+    print(f"[PacketPool] {processes} packet build workers")
+    return pool
+
+
+def stop() -> None:
+    """Shut the workers down; builds from here on run inline."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
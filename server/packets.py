@@ -0,0 +1,384 @@
+# packets.py
+"""
+Layouts of the busiest packets, as schemas (see schema.py):
+
+    ENTITY_PLAYER / ENTITY_NPC   0x0F entity update  (entity.Send_Entity_Data)
+    ENTER_WORLD                  0x21                (WorldEnter.build_enter_world_packet)
+    PLAYER_DATA                  0x10                (WorldEnter.Player_Data_Packet)
+    FRIEND                       one friends-list entry: 0x10's list and 0x92
+    MOVE                         0x07 from the client (server.py)
+    POWER_CAST                   0x09 from the client (server.py)
+
+The entity schemas read the entity dict as it is; 0x10 and 0x21 read a
+record their builders put together from the character (deadlines,
+padded lists, the live guild and friends data). Field comments give the
+client's names where they're known.
+"""
+from constants import (
+    CLASS_118_CONST_127, CLASS_NAME_TO_ID, ENTITY_CONST_244, GAME_CONST_209, GEARTYPE_BITS, GS_BITS,
+    MAX_CHAR_LEVEL_BITS, NUM_TALENT_SLOTS, SLOT_BIT_WIDTHS, Entity, Game, GearType, Game_const_646, Mission,
+    class_1_const_254, class_3, class_7, class_7_const_19, class_9_const_28, class_9_const_129, class_10_const_83,
+    class_10_const_665, class_16_const_167, class_20, class_21_const_763, class_64, class_64_const_218,
+    class_64_const_499, class_66_const_571, class_111, class_111_const_432, class_118, class_119,
+)
+from missions import var_238
+from schema import (Schema, branch, cond, const, flag, float32, group, optional, repeat, stream, string,
+                    svarint, svarint3, uint, varint, varint3, when)
+
+
+def _positive(v) -> bool:
+    return v > 0
+
+
+def _not_none(v) -> bool:
+    return v is not None
+
+
+def _not_one(v) -> bool:
+    return v != 1
+
+
+def _plus_one(v):
+    return 1 + v
+
+
+def _minus_one(v):
+    return v - 1
+
+
+# ─── 0x0F: entity update ─────────────────────────────────────────────────
+def _inflate_speed(speed) -> int:
+    return int(speed * Entity.VELOCITY_INFLATE)
+
+
+_ENTITY_HEAD = [
+    varint("id"),
+    string("name"),
+    const(0, 1),                                # appearance
+    svarint("x", default=0.0, convert=int),
+    svarint("y", default=0.0, convert=int),
+    svarint("z", default=0.0, convert=int),
+    uint("team", Entity.TEAM_BITS),
+]
+
+_ENTITY_MIDDLE = [
+    optional("level_str", string(None)),
+    optional("var_1958", string(None)),
+    optional("var_1879", string(None)),
+    optional("level", varint(None), default=0, present=_positive),
+    optional("power_id", varint(None), default=0, present=_positive),
+    uint("entState", Entity.const_316, default=Entity.const_6),
+    flag("facing_left"),
+]
+
+_ENTITY_TAIL = [
+    svarint("health_delta"),
+    repeat("buffs", "varint",
+           varint("type_id"), varint("param1"), varint("param2"), varint("param3"), varint("param4"),
+           optional("extra_data",
+                    repeat(None, "varint", varint("id"), repeat("values", "varint", float32(None))),
+                    default=())),
+]
+
+ENTITY_PLAYER = Schema("entity_player", _ENTITY_HEAD + [
+    const(1, 1),                                # is a player
+    uint("flag1", 1, default=False),
+    uint("flag2", 1, default=False),
+    uint("player_data1", class_7.const_19),
+    uint("player_data2", class_7.const_75),
+    uint("mount_data", class_20.const_297),
+    uint("additional_data", class_3.const_69),
+    when("has_additional_player_data",
+         uint("extra_data1", class_7.const_19), uint("extra_data2", class_7.const_75),
+         uint("extra_data3", class_7.const_19), uint("extra_data4", class_7.const_75),
+         uint("extra_data5", class_7.const_19), uint("extra_data6", class_7.const_75)),
+] + _ENTITY_MIDDLE + [
+    uint("player_level", Entity.MAX_CHAR_LEVEL_BITS),
+    uint("game_const", Game.const_209, default=Entity.const_526),
+    when("has_equipment",
+         group("equipment", *[
+             optional(str(slot), uint("index", class_118.const_127),
+                      uint("value", SLOT_BIT_WIDTHS[slot], convert=_plus_one))
+             for slot in range(class_118.const_43)])),
+] + _ENTITY_TAIL)
+
+ENTITY_NPC = Schema("entity_npc", _ENTITY_HEAD + [
+    const(0, 1),                                # not a player
+    flag("untargetable"),
+    svarint3("behavior_id"),
+    optional("behavior_speed", varint(None, convert=_inflate_speed), default=0.0, present=_positive),
+] + _ENTITY_MIDDLE + _ENTITY_TAIL)
+
+
+# ─── 0x21: enter world ───────────────────────────────────────────────────
+ENTER_WORLD = Schema("enter_world", [
+    varint("transfer_token"),                   # _loc4_
+    varint("old_level_id"),                     # _loc5_
+    string("old_swf"),                          # _loc6_
+    when("has_old_coord", varint("old_x"), varint("old_y")),
+    string("host"),                             # _loc9_
+    varint("port"),                             # _loc10_
+    string("new_level_swf"),                    # _loc11_
+    uint("new_map_lvl", MAX_CHAR_LEVEL_BITS),   # _loc12_
+    uint("new_base_lvl", MAX_CHAR_LEVEL_BITS),  # _loc13_
+    string("new_internal"),                     # _loc14_
+    string("new_moment"),                       # _loc15_
+    string("new_alter"),                        # _loc16_
+    flag("new_is_inst"),                        # _loc17_
+    when("new_has_coord", svarint("new_x"), svarint("new_y")),  # _loc18_, _loc20_, _loc21_
+    const(1, 1),                                # _loc19_: building data follows
+    varint("transfer_token"),                   # _loc22_: the new level ID
+    uint("master_class_id", GAME_CONST_209),    # _loc25_
+    group("stats",                              # _loc26_.._loc31_, from magicForge
+          uint(0, class_9_const_28), uint(1, class_9_const_28), uint(2, class_9_const_28),
+          uint(3, class_9_const_28), uint(4, class_9_const_28), uint(5, class_9_const_129)),
+])
+
+
+# ─── friends list entry (0x10, 0x92) ─────────────────────────────────────
+def _custom_name(f) -> bool:
+    return f.get("charName", "") != f["name"]
+
+
+def _class_id(class_name) -> int:
+    return CLASS_NAME_TO_ID.get(class_name, 0)
+
+
+_FRIEND = [
+    string("name"),
+    flag("isRequest"),
+    when("isOnline",
+         branch(None, [string("charName")], [], present=_custom_name),
+         uint("className", ENTITY_CONST_244, default="", convert=_class_id),
+         uint("level", MAX_CHAR_LEVEL_BITS, default=1)),
+]
+FRIEND = Schema("friend", _FRIEND)
+
+
+# ─── 0x10: player data ───────────────────────────────────────────────────
+def _has_modifiers(gear) -> bool:
+    # any rune or color that isn't 0
+    return any(gear.get("runes", ())) or any(gear.get("colors", ()))
+
+
+def _first_six(slots):
+    return (list(slots) + [0] * 6)[:6]
+
+
+def _clamp(high):
+    return lambda v: max(0, min(v, high))
+
+
+def _pack_craft_talents(points) -> int:
+    packed = 0
+    for i in range(5):
+        packed |= (points[i] & 0xF) << (i * 4)
+    return packed
+
+
+def _first_three(slots):
+    return (list(slots) + [0, 0, 0])[:3]
+
+
+def _first_seven(stats):
+    return stats[:7]
+
+
+def _forge_in_progress(status) -> bool:
+    return status == class_111.const_286
+
+
+def _cap_u16(v):
+    return min(v, 65535)
+
+
+def _mission_ready(state) -> bool:
+    return state == Mission.const_72
+
+
+def _mission_claimed(state) -> bool:
+    return state == Mission.const_58
+
+
+def _mission(mdef) -> list:
+    """The fields of one mission's state, which depend on its definition."""
+    if mdef.var_1775:       # one-shot: just "ready"
+        return [flag("state", default=None, convert=_mission_ready)]
+    ready = [flag("state", default=None, convert=_mission_claimed)]
+    if mdef.var_134:        # timed-mission extras
+        ready += [uint("var_588", class_119.const_228), varint("var_1745"), varint("var_2806")]
+    in_progress = [varint("currCount")] if mdef.var_908 > 1 else []
+    return [branch("state", ready, in_progress, default=None, present=_mission_ready)]
+
+
+def _slot_filled(slot) -> bool:
+    return slot is not None and slot["filled"]
+
+
+def _has_extra_value(pet) -> bool:
+    return "extraValue" in pet
+
+
+def _has_gear(gear) -> bool:
+    return bool(gear.get("gearID", 0))
+
+
+_MISSION_COUNT = len(var_238) - 1
+
+PLAYER_DATA = Schema("player_data", [
+    # (1) preamble
+    varint("transfer_token"),
+    varint("game_time"),
+    uint("scaling_factor", GS_BITS),
+    varint("bonus_levels"),
+
+    # (2) customization
+    string("name"),
+    const(1, 1),                                # hasCustomization
+    string("class"), string("gender"), string("headSet"), string("hairSet"), string("mouthSet"),
+    string("faceSet"),
+    uint("hairColor", 24), uint("skinColor", 24), uint("shirtColor", 24), uint("pantColor", 24),
+
+    # (3) gear slots
+    repeat("equippedGears", None,
+           when("gearID", uint("gearID", 11), const(0, 2),
+                group("runes", uint(0, 16), uint(1, 16), uint(2, 16), default=(0, 0, 0)),
+                group("colors", uint(0, 8), uint(1, 8), default=(0, 0)))),
+
+    # (4) numbers
+    uint("level", MAX_CHAR_LEVEL_BITS),
+    varint("xp"), varint("gold"), varint("Gems"), varint("DragonOre"), varint("mammothIdols"),
+    uint("showHigher", 1, default=True, convert=int),
+
+    # (5) quest tracker, (6) no door/teleport update, (7) extended data follows
+    optional("questTrackerState", varint(None), present=_not_none),
+    const(0, 1),
+    const(1, 1),
+
+    # (8) extended data: inventory
+    repeat("inventoryGears", GearType.GEARTYPE_BITSTOSEND,
+           uint("gearID", 11), uint("tier", GearType.const_176),
+           when(None,
+                group("runes", *[optional(i, uint(None, 16)) for i in range(3)], default=(0, 0, 0)),
+                group("colors", *[optional(i, uint(None, 8)) for i in range(2)], default=(0, 0)),
+                present=_has_modifiers)),
+    repeat("gearSets", GearType.const_348,
+           string("name"),
+           group("slots", *[uint(i, GearType.GEARTYPE_BITSTOSEND) for i in range(6)],
+                 default=(), convert=_first_six)),
+    const(0, 1),                                # no keybinds
+    repeat("mounts", "varint", varint(None)),
+    repeat("pets", "varint",
+           uint("typeID", 7, convert=_clamp(127)), uint("level", 6, convert=_clamp(63)),
+           varint("xp"), varint("attr2")),
+    stream("charms",
+           uint("charmID", class_64.const_101),
+           optional("count", varint(None), default=1, present=_not_one)),
+    stream("materials",
+           varint("materialID"),
+           optional("count", varint(None), default=1, present=_not_one)),
+    stream("lockboxes", varint("lockboxID"), varint("count", default=1)),
+    varint("DragonKeys"),                       # lockboxKeys
+    varint("SilverSigils"),                     # royalSigils
+    const(1, Game_const_646),                   # alert state
+    const((1 << class_21_const_763) - 1, class_21_const_763),  # every dye
+    stream("consumables", varint("consumableID"), varint("count", default=1)),
+
+    # missions, in ID order, each laid out by its definition
+    const(_MISSION_COUNT, None),
+    group("missions", *[
+        optional(str(mid), *_mission(var_238[mid]), present=_not_none)
+        for mid in range(1, _MISSION_COUNT + 1)]),
+
+    repeat("friends", "varint", *_FRIEND),
+
+    repeat("learnedAbilities", class_10_const_83,
+           uint("abilityID", class_10_const_83), uint("rank", class_10_const_665)),
+    group("activeAbilities", *[uint(i, class_10_const_83) for i in range(3)],
+          default=[0, 0, 0], convert=_first_three),
+    varint("craftTalentPoints", default=[0, 0, 0, 0, 0], convert=_pack_craft_talents),
+    repeat("towerPoints", None, uint(None, 6), default=[0, 0, 0]),
+
+    # magic forge
+    group("magicForge",
+          optional("stats", repeat(None, None, uint(None, class_9_const_28)), default=(),
+                   convert=_first_seven),
+          when("hasSession",
+               uint("primary", class_1_const_254),
+               branch("status",
+                      [varint("end_time")],
+                      [uint("var_8", class_64_const_499),
+                       cond("var_8", uint("secondary", class_64_const_218), uint("usedlist", class_111_const_432))],
+                      default=class_111.const_509, present=_forge_in_progress),
+               varint3("var_2675", convert=_cap_u16),
+               varint3("var_2316", convert=_cap_u16)),
+          flag("var_2434")),
+
+    # timers, as absolute end times
+    optional("research", uint("abilityID", class_10_const_83), varint("end_time")),
+    optional("buildingResearch", uint("slotID", class_9_const_129), varint("end_time")),
+    optional("towerResearch", uint("masterClassID", class_66_const_571), varint("end_time")),
+    optional("eggData", uint("typeID", class_16_const_167), varint("end_time")),
+
+    repeat("eggPetIDs", class_16_const_167, uint(None, class_16_const_167)),
+    varint("activeEggCount"),
+    group("restingPets", *[
+        optional(i, uint("typeID", class_7_const_19), varint("level"),
+                 *([cond(None, varint("extraValue"), present=_has_extra_value)] if i == 3 else []),
+                 present=_not_none)
+        for i in range(4)]),
+
+    # news
+    group("news", string(0), string(1), string(2), string(3)),
+    varint("event_end"),
+
+    # mastery tree of the selected master class
+    group("mastery",
+          uint("classID", GAME_CONST_209),
+          const(1, 1),                          # always a tree
+          group("slots", *[
+              optional(i, uint("nodeIdx", CLASS_118_CONST_127),
+                       uint("points", SLOT_BIT_WIDTHS[i], convert=_minus_one), present=_slot_filled)
+              for i in range(NUM_TALENT_SLOTS)])),
+
+    # equipped gear, slots 1 to 6
+    group("equipped", *[optional(i, uint("gearID", GEARTYPE_BITS), present=_has_gear) for i in range(6)]),
+    varint("equippedMount"),
+    varint("equippedPetID"),
+    varint("petIteration"),
+    varint("activeConsumableID"),
+    varint("queuedConsumableID"),
+
+    # (10) guild panel (method_933): only who's online, then yourself
+    optional("guild",
+             string("name"),
+             uint("rank", 3),
+             repeat("members", "varint",
+                    string("name"), uint("class_id", 2), uint("level", 6), uint("rank", 3)),
+             string("own_name"),
+             uint("own_class_id", 2),
+             uint("own_level", 6),
+             uint("rank", 3)),
+])
+
+
+# ─── from the client ─────────────────────────────────────────────────────
+MOVE = Schema("move", [
+    varint("ent_id"),
+    svarint("dx"),
+    svarint("dy"),
+    svarint("frame_acc"),
+    uint("ent_state", Entity.const_316),
+    flag("left"), flag("running"), flag("jumping"), flag("dropping"), flag("backpedal"),
+    optional("velocity_y", svarint(None)),      # raw, times LinkUpdater.VELOCITY_DEFLATE
+])
+
+POWER_CAST = Schema("power_cast", [
+    varint("ent_id"),
+    varint("power_type"),
+    flag("is_charged"),
+    optional("target_point", svarint("x"), svarint("y")),
+    optional("target_entity_id", varint(None)),
+    flag("is_queued"),
+    optional("extra_entity", flag("is_secondary"), varint("id")),
+])
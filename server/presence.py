@@ -0,0 +1,272 @@
+# presence.py
+"""
+Who is online, indexed by character name and by account.
+
+A character goes online when its session enters the world (0x1F) and
+offline when its last session disconnects. Door transfers reconnect, so
+going offline waits OFFLINE_GRACE seconds for the character's next
+session before anyone is told.
+
+Friends are watched by name: every online character registers interest
+in the names on its friends list, so a login or logout is pushed (0x92,
+one friend entry, encoded once) only to the players that have that
+character as a friend, instead of anyone resending the whole 0x10.
+
+    presence.go_online(session, char)
+    presence.lookup("Neo")               -> Presence or None
+    presence.friend_entries(friends)     -> friends with live online/level/class
+    presence.go_offline(session)
+    presence.listen(fn)                  # fn(ONLINE/OFFLINE/LEVEL, Presence, char)
+
+Player_Data_Packet fills the friends list from friend_entries(), one
+lookup per friend, instead of the isOnline saved with the character.
+
+With --workers, each worker indexes the characters it plays and tells
+the others about their logins, logouts and level changes over the
+worker queues (connect(), receive()), so a friend on another shard shows
+online. Lookups see every worker; sessions_of(), characters_of(),
+online_count() and listen() cover this worker's own characters only.
+"""
+import threading
+from collections import namedtuple
+
+from packets import FRIEND
+
+OFFLINE_GRACE = 5.0     # seconds a character stays online between sessions
+
+# What a friends list shows about an online character
+Presence = namedtuple("Presence", "name user_id class_name level")
+
+ONLINE = "online"
+OFFLINE = "offline"
+LEVEL = "level"
+
+_lock = threading.RLock()
+_online = {}        # character name -> Presence
+_sessions = {}      # character name -> sessions currently playing it
+_by_user = {}       # user ID -> names of its online characters
+_watchers = {}      # character name -> sessions with it on their friends list
+_watching = {}      # session -> names it watches
+_playing = {}       # session -> character name
+_listeners = []     # fn(kind, Presence, char or None), see listen()
+_remote = {}        # character name -> {worker index: Presence} for other workers' characters
+_worker = 0         # this worker's index, and how to reach the others (connect())
+_send_to_peers = None
+
+
+def listen(fn) -> None:
+    """
+    Call fn(kind, presence, char) after a character comes ONLINE (char is
+    its dict), goes OFFLINE or changes LEVEL (char is None).
+    """
+    _listeners.append(fn)
+
+
+def _notify(kind: str, p: Presence, char=None) -> None:
+    for fn in _listeners:
+        try:
+            fn(kind, p, char)
+        except Exception as e:
+            print(f"[Presence] {kind} listener failed for {p.name}: {e}")
+
+
+def connect(worker: int, send) -> None:
+    """
+    Share presence with the other workers: send(message) delivers to each
+    of them, and they hand what they get to receive().
+    """
+    global _worker, _send_to_peers
+    _worker, _send_to_peers = worker, send
+
+
+def _broadcast(kind: str, p: Presence) -> None:
+    if _send_to_peers is not None:
+        try:
+            _send_to_peers(("presence", _worker, kind, p))
+        except Exception as e:
+            print(f"[Presence] Failed to tell other workers {p.name} is {kind}: {e}")
+
+
+def receive(worker: int, kind: str, p: Presence) -> None:
+    """Another worker's character came ONLINE, went OFFLINE or changed LEVEL."""
+    with _lock:
+        before = lookup(p.name)
+        if kind == OFFLINE:
+            elsewhere = _remote.get(p.name)
+            if elsewhere is not None:
+                elsewhere.pop(worker, None)
+                if not elsewhere:
+                    del _remote[p.name]
+        else:
+            _remote.setdefault(p.name, {})[worker] = p
+        changed = lookup(p.name) != before
+    if changed:
+        _push(p.name)
+
+
+def lookup(name: str):
+    p = _online.get(name)
+    if p is None:
+        elsewhere = _remote.get(name)
+        if elsewhere:
+            p = next(iter(elsewhere.values()), None)
+    return p
+
+
+def worker_of(name: str):
+    """Index of the other worker playing `name`, or None if it is offline or played here."""
+    with _lock:
+        if name in _online:
+            return None
+        elsewhere = _remote.get(name)
+        return next(iter(elsewhere), None) if elsewhere else None
+
+
+def is_online(name: str) -> bool:
+    return lookup(name) is not None
+
+
+def sessions_of(name: str) -> list:
+    with _lock:
+        return list(_sessions.get(name, ()))
+
+
+def characters_of(user_id) -> list:
+    with _lock:
+        return sorted(_by_user.get(user_id, ()))
+
+
+def online_count() -> int:
+    return len(_online)
+
+
+def friend_entries(friends: list) -> list:
+    """The saved friends list with isOnline, level and className made live."""
+    entries = []
+    for f in friends:
+        entry = dict(f)
+        p = lookup(f.get("name"))
+        entry["isOnline"] = p is not None
+        if p is not None:
+            entry["charName"] = p.name
+            entry["className"] = p.class_name
+            entry["level"] = p.level
+        entries.append(entry)
+    return entries
+
+
+def friend_packet(f: dict) -> bytes:
+    """0x92: add or update one friend; the client shows "has logged on/off"."""
+    return FRIEND.frame(0x92, f)
+
+
+def _push(name: str) -> int:
+    """Tell everyone watching `name` its current status. Returns how many."""
+    with _lock:
+        watchers = list(_watchers.get(name, ()))
+        p = lookup(name)
+    if not watchers:
+        return 0
+    packets = {}
+    sent = 0
+    for session in watchers:
+        char = session.current_char_dict or {}
+        saved = next((f for f in char.get("friends", []) if f.get("name") == name), None)
+        if saved is None:
+            continue
+        is_request = bool(saved.get("isRequest", False))
+        if is_request not in packets:
+            entry = friend_entries([{"name": name, "isRequest": is_request}])[0] if p else \
+                {"name": name, "isRequest": is_request, "isOnline": False}
+            packets[is_request] = friend_packet(entry)
+        try:
+            session.conn.sendall(packets[is_request])
+            sent += 1
+        except OSError:
+            pass    # its own handler notices the dead socket
+    return sent
+
+
+def go_online(session, char: dict) -> None:
+    """Index the session's character and its friends list; push its login."""
+    name = char.get("name")
+    if not name:
+        return
+    if _playing.get(session) not in (None, name):
+        go_offline(session, grace=False)    # switched characters: the old one logs off now
+    with _lock:
+        first = not _sessions.get(name) and name not in _online
+        seen = lookup(name) is not None     # still online here, or on another worker
+        _sessions.setdefault(name, set()).add(session)
+        _playing[session] = name
+        user_id = char.get("user_id", session.user_id)
+        p = _online[name] = Presence(name, user_id, char.get("class", ""), char.get("level", 1))
+        _by_user.setdefault(user_id, set()).add(name)
+        names = {f.get("name") for f in char.get("friends", []) if f.get("name")}
+        for friend in _watching.get(session, set()) - names:
+            _watchers.get(friend, set()).discard(session)
+        _watching[session] = names
+        for friend in names:
+            _watchers.setdefault(friend, set()).add(session)
+    if first:
+        _broadcast(ONLINE, p)
+        if not seen:
+            _push(name)
+        _notify(ONLINE, p, char)
+
+
+def set_level(name: str, level: int) -> None:
+    """The character levelled up: update friends' lists (and listeners)."""
+    with _lock:
+        p = _online.get(name)
+        if p is None or p.level == level:
+            return
+        p = _online[name] = p._replace(level=level)
+    _broadcast(LEVEL, p)
+    _push(name)
+    _notify(LEVEL, p)
+
+
+def _expire(name: str) -> None:
+    with _lock:
+        if _sessions.get(name):
+            return      # came back (door transfer) within the grace period
+        _sessions.pop(name, None)
+        p = _online.pop(name, None)
+        if p is None:
+            return
+        names = _by_user.get(p.user_id)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del _by_user[p.user_id]
+        gone = lookup(name) is None
+    _broadcast(OFFLINE, p)
+    if gone:
+        _push(name)
+    _notify(OFFLINE, p)
+
+
+def go_offline(session, grace: bool = True) -> None:
+    """Forget the session; its character goes offline if no other session plays it."""
+    with _lock:
+        for friend in _watching.pop(session, ()):
+            watchers = _watchers.get(friend)
+            if watchers is not None:
+                watchers.discard(session)
+                if not watchers:
+                    del _watchers[friend]
+        name = _playing.pop(session, None)
+        if name is None:
+            return
+        sessions = _sessions.get(name)
+        if sessions is not None:
+            sessions.discard(session)
+            if sessions:
+                return
+    if grace:
+        timer = threading.Timer(OFFLINE_GRACE, _expire, args=(name,))
+        timer.daemon = True
+        timer.start()
+    else:
+        _expire(name)
@@ -0,0 +1,91 @@
+# registry.py
+"""
+Dicts shared by the connection threads (pending transfer tokens,
+persisted sessions, door activity, the session list), each behind its
+own lock.
+
+With the GIL, a plain dict survived being read and written from many
+threads; on free-threaded CPython (3.13t) iterating one while another
+thread inserts raises, and a check-then-act (`if k in d: d[k]`) can see
+the key vanish in between. A Registry takes its lock for every access,
+and items()/keys()/values()/iteration return a copy taken under it, so
+callers can loop without holding anything. Compound updates use
+`with registry.lock:` (an RLock, so the methods still work inside it).
+
+    pending_world = Registry()
+    pending_world[token] = char
+    char = pending_world.pop(token, None)
+    for token, char in pending_world.items(): ...       # a snapshot
+    recent_activity.remove_if(lambda key, v: v["timestamp"] < cutoff)
+"""
+import threading
+
+
+class Registry:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.lock = threading.RLock()
+        self._items = {}
+
+    def __len__(self):
+        with self.lock:
+            return len(self._items)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self._items
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._items[key] = value
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self._items[key]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._items.get(key, default)
+
+    def pop(self, key, *default):
+        with self.lock:
+            return self._items.pop(key, *default)
+
+    def setdefault(self, key, value):
+        with self.lock:
+            return self._items.setdefault(key, value)
+
+    def items(self) -> list:
+        with self.lock:
+            return list(self._items.items())
+
+    def keys(self) -> list:
+        with self.lock:
+            return list(self._items)
+
+    def values(self) -> list:
+        with self.lock:
+            return list(self._items.values())
+
+    def add(self, key) -> None:
+        """Use the registry as a set (the session list)."""
+        self[key] = True
+
+    def discard(self, key) -> bool:
+        with self.lock:
+            return self._items.pop(key, None) is not None
+
+    def remove_if(self, predicate) -> int:
+        """Drop every entry predicate(key, value) is true for. Returns how many."""
+        with self.lock:
+            doomed = [k for k, v in self._items.items() if predicate(k, v)]
+            for k in doomed:
+                del self._items[k]
+            return len(doomed)
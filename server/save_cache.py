@@ -0,0 +1,123 @@
+# save_cache.py
+"""
+Per-user save documents, parsed once and shared.
+
+The dict returned by load_save() is the same object every caller gets, so
+session.player_data and session.char_list (its "characters" list) stay one
+structure, and a transfer to another level in this process reuses it
+instead of reading the save again. Entries are checked against the storage
+backend's version token (file mtime, or the row version in SQLite) so a
+write from another worker process is picked up.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from char_template import from_saved
+from storage import get_storage
+
+MAX_CACHED_USERS = 1024
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # user_id -> (version, doc), least recently used first
+_inflight = {}              # user_id -> Future of a background read
+_prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="save-prefetch")
+
+
+def save_path(user_id: str) -> str:
+    """Where the user's save lives, for log lines."""
+    return get_storage().location(user_id)
+
+
+def _remember(user_id: str, version, doc) -> None:
+    _cache[user_id] = (version, doc)
+    _cache.move_to_end(user_id)
+    while len(_cache) > MAX_CACHED_USERS:
+        _cache.popitem(last=False)
+
+
+def _cached(user_id: str, version):
+    with _lock:
+        hit = _cache.get(user_id)
+        if hit is not None and hit[0] == version:
+            _cache.move_to_end(user_id)
+            return hit[1]
+    return None
+
+
+def _read(user_id: str):
+    storage = get_storage()
+    version = storage.user_version(user_id)
+    if version is None:
+        return None
+    doc = _cached(user_id, version)
+    if doc is not None:
+        return doc
+    version, doc = storage.load_user(user_id)
+    if doc is None:
+        return None
+    chars = doc.get("characters")
+    if isinstance(chars, list):
+        chars[:] = [from_saved(c) for c in chars]
+    with _lock:
+        _remember(user_id, version, doc)
+    return doc
+
+
+def load_save(user_id: str):
+    """
+    The user's save document, or None if they have no save file. Waits for
+    a prefetch of the same user that is still running.
+    """
+    with _lock:
+        pending = _inflight.get(user_id)
+    if pending is not None:
+        try:
+            pending.result()
+        except Exception as e:
+            print(f"[SaveCache] Prefetch for {user_id} failed: {e}")
+    return _read(user_id)
+
+
+def prefetch(user_id: str) -> None:
+    """Start reading a save on a background thread if it isn't cached yet."""
+    if _cached(user_id, get_storage().user_version(user_id)) is not None:
+        return
+    with _lock:
+        if user_id in _inflight:
+            return
+        future = _inflight[user_id] = _prefetcher.submit(_read, user_id)
+
+    def _done(_):
+        with _lock:
+            _inflight.pop(user_id, None)
+    future.add_done_callback(_done)
+
+
+def write_save(user_id: str, doc: dict) -> None:
+    """Write the whole of `doc` as the user's save and keep it as the cached copy."""
+    version = get_storage().save_user(user_id, doc)
+    with _lock:
+        _remember(user_id, version, doc)
+
+
+def save_character(user_id: str, doc: dict, char: dict, fields=None) -> None:
+    """
+    Persist one character of `doc` after a handler changed it. `fields`
+    names the top-level character keys that changed; backends that store
+    fields separately rewrite only those.
+    """
+    version = get_storage().save_character(user_id, doc, char, fields)
+    with _lock:
+        _remember(user_id, version, doc)
+
+
+def store(user_id: str, doc: dict) -> None:
+    """Adopt `doc` (e.g. handed over from another worker) as the current copy."""
+    with _lock:
+        _remember(user_id, get_storage().user_version(user_id), doc)
+
+
+def invalidate(user_id: str) -> None:
+    with _lock:
+        _cache.pop(user_id, None)
@@ -0,0 +1,467 @@
+# schema.py
+"""
+Packet layouts described once and compiled to plain Python.
+
+A Schema is a list of fields; each reads its value from the record
+being encoded (a dict, or anything with .get) and writes it the way the
+matching BitBuffer method does:
+
+    uint(key, width)    _append_bits / write_method_6 (low `width` bits)
+    flag(key)           one bit, 1 if the value is truthy
+    const(value, width) fixed bits, no key (width None: as a varint)
+    varint(key)         write_method_4   (4-bit size prefix)
+    svarint(key)        write_signed_method_45 (sign bit + method_4)
+    varint3(key)        write_method_91  (3-bit size prefix)
+    svarint3(key)       write_method_739 (sign bit + method_91)
+    string(key)         write_utf_string / write_method_13 (16-bit length + UTF-8)
+    float32(key)        write_float (byte aligned)
+
+and groups of fields:
+
+    optional(key, ...)  presence bit; the fields are read from record[key]
+    when(key, ...)      presence bit from record[key]; fields from the record itself
+    branch(key, yes, no)  that bit, then the `yes` or the `no` fields
+    cond(key, ...)      the fields only if record[key] allows, and no bit
+                        for it (the client knows from an earlier field)
+    repeat(key, count, ...)   count ("varint", a bit width, or None for
+                        none on the wire) then each element of record[key]
+    stream(key, ...)    1 before each element of record[key], 0 after the last
+    group(key, ...)     the fields read from record[key], nothing else written
+
+A key of None means the value itself (an element of a list of numbers, the
+string inside an optional), an int key indexes a list. default= is what a missing key reads as,
+convert= is applied to the value before writing it (e.g. int for a
+coordinate), present= decides an optional/when instead of truthiness.
+
+Schema() turns the fields into the source of one encode and one decode
+function (schema.source) and compiles them once, at import: widths are
+constants, runs of fixed-width fields share one bit count, and the bits
+collect in a single int that's turned into bytes once FLUSH_BITS have
+built up, so there's no per-field call or dispatch.
+
+    ENTER = Schema("enter", [varint("token"), optional("coords", svarint("x"), svarint("y"))])
+    payload = ENTER.encode({"token": 5, "coords": {"x": -3, "y": 7}})
+    frame = ENTER.frame(0x21, record)       # with the 4-byte header
+    record = ENTER.decode(payload)          # Truncated if the payload is short
+
+The output is the same, bit for bit, as the BitBuffer calls it replaces
+(bench_codec.py --check).
+"""
+import struct
+
+FLUSH_BITS = 1024       # bits collected before they're moved to the output
+
+_COMPOUND = ("optional", "when", "branch", "cond", "group", "repeat", "stream")
+
+
+class Truncated(ValueError):
+    """The payload ended before the schema did."""
+
+
+class Field:
+    def __init__(self, kind, key=None, width=None, default=0, convert=None, fields=(), count=None,
+                 present=None, value=None, otherwise=()):
+        self.kind = kind
+        self.key = key
+        self.width = width
+        self.default = default
+        self.convert = convert
+        self.fields = list(fields)
+        self.count = count
+        self.present = present
+        self.value = value
+        self.otherwise = list(otherwise)      # branch: the fields when the bit is 0
+
+
+def uint(key, width, default=0, convert=None):
+    return Field("uint", key, width, default, convert)
+
+
+def flag(key, default=False, convert=None):
+    return Field("flag", key, 1, default, convert)
+
+
+def const(value, width):
+    return Field("const", width=width, value=value)
+
+
+def varint(key, default=0, convert=None):
+    return Field("varint", key, default=default, convert=convert)
+
+
+def svarint(key, default=0, convert=None):
+    return Field("svarint", key, default=default, convert=convert)
+
+
+def varint3(key, default=0, convert=None):
+    return Field("varint3", key, default=default, convert=convert)
+
+
+def svarint3(key, default=0, convert=None):
+    return Field("svarint3", key, default=default, convert=convert)
+
+
+def string(key, default="", convert=None):
+    return Field("string", key, default=default, convert=convert)
+
+
+def float32(key, default=0.0, convert=None):
+    return Field("float32", key, default=default, convert=convert)
+
+
+def optional(key, *fields, default=None, convert=None, present=None):
+    return Field("optional", key, default=default, convert=convert, fields=fields, present=present)
+
+
+def when(key, *fields, default=False, present=None):
+    return Field("when", key, default=default, fields=fields, present=present)
+
+
+def branch(key, yes, no, default=False, present=None):
+    return Field("branch", key, default=default, fields=yes, otherwise=no, present=present)
+
+
+def cond(key, *fields, default=None, present=None):
+    return Field("cond", key, default=default, fields=fields, present=present)
+
+
+def repeat(key, count, *fields, default=(), convert=None):
+    return Field("repeat", key, default=default, convert=convert, fields=fields, count=count)
+
+
+def stream(key, *fields, default=()):
+    return Field("stream", key, default=default, fields=fields)
+
+
+def group(key, *fields, default=None, convert=None):
+    return Field("group", key, default=default if default is not None else {}, convert=convert, fields=fields)
+
+
+# ─── compiler ────────────────────────────────────────────────────────────
+class _Source:
+    def __init__(self):
+        self.lines = []
+        self.names = 0
+        self.namespace = {"Truncated": Truncated, "_f32": struct.Struct(">f")}
+
+    def var(self, prefix: str) -> str:
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def bind(self, obj, prefix: str = "_k") -> str:
+        name = self.var(prefix)
+        self.namespace[name] = obj
+        return name
+
+    def emit(self, depth: int, line: str) -> None:
+        self.lines.append("    " * depth + line)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _value(src: _Source, field: Field, record: str) -> str:
+    """Expression for the field's value in `record`."""
+    if field.key is None:
+        expr = record
+    elif isinstance(field.key, int):
+        expr = f"{record}[{field.key}]"
+    else:
+        expr = f"{record}.get({field.key!r}, {src.bind(field.default, '_d') if not _literal(field.default) else repr(field.default)})"
+    if field.convert is not None:
+        expr = f"{src.bind(field.convert, '_c')}({expr})"
+    return expr
+
+
+def _literal(value) -> bool:
+    return value is None or isinstance(value, (bool, int, float, str)) or value == ()
+
+
+class _Encoder:
+    """Emits the body of encode(); `pending` fixed bits are added to n lazily."""
+
+    def __init__(self, src: _Source):
+        self.src = src
+        self.pending = 0
+
+    def settle(self, depth: int) -> None:
+        if self.pending:
+            self.src.emit(depth, f"n += {self.pending}")
+            self.pending = 0
+
+    def fixed(self, depth: int, expr: str, width: int) -> None:
+        if expr == "0":
+            self.src.emit(depth, f"a <<= {width}")
+        else:
+            self.src.emit(depth, f"a = (a << {width}) | ({expr})")
+        self.pending += width
+
+    def varint(self, depth: int, expr: str, prefix_bits: int) -> None:
+        v, b = self.src.var("v"), self.src.var("b")
+        self.src.emit(depth, f"{v} = {expr}")
+        self.src.emit(depth, f"{b} = (({v}.bit_length() + 1) & ~1) if {v} > 0 else 2")
+        if prefix_bits == 4:
+            self.src.emit(depth, f"assert {b} <= 32, f\"Value too large for method_4: {{{v}}}\"")
+        self.src.emit(depth, f"a = (((a << {prefix_bits}) | ((({b} >> 1) - 1) & {(1 << prefix_bits) - 1})) << {b})"
+                             f" | ({v} & ((1 << {b}) - 1))")
+        self.src.emit(depth, f"n += {b}")
+        self.pending += prefix_bits
+
+    def signed(self, depth: int, expr: str, prefix_bits: int) -> None:
+        v = self.src.var("v")
+        self.src.emit(depth, f"{v} = {expr}")
+        self.fixed(depth, f"1 if {v} < 0 else 0", 1)
+        self.varint(depth, f"-{v} if {v} < 0 else {v}", prefix_bits)
+
+    def flush(self, depth: int) -> None:
+        self.settle(depth)
+        m = self.src.var("m")
+        self.src.emit(depth, f"if n >= {FLUSH_BITS}:")
+        self.src.emit(depth + 1, f"{m} = n & 7")
+        self.src.emit(depth + 1, f"out += (a >> {m}).to_bytes(n >> 3, 'big')")
+        self.src.emit(depth + 1, f"a &= (1 << {m}) - 1")
+        self.src.emit(depth + 1, f"n = {m}")
+
+    def fields(self, depth: int, fields, record: str) -> None:
+        for field in fields:
+            self.field(depth, field, record)
+            if field.kind in _COMPOUND:
+                # keep `a` short in long packets too, not only inside loops
+                self.flush(depth)
+
+    def field(self, depth: int, field: Field, record: str) -> None:
+        src, kind = self.src, field.kind
+        if kind == "const" and field.width is None:
+            self.varint(depth, repr(field.value), 4)
+        elif kind == "const":
+            self.fixed(depth, str(field.value & ((1 << field.width) - 1)), field.width)
+        elif kind == "uint":
+            self.fixed(depth, f"{_value(src, field, record)} & {(1 << field.width) - 1}", field.width)
+        elif kind == "flag":
+            self.fixed(depth, f"1 if {_value(src, field, record)} else 0", 1)
+        elif kind == "varint":
+            self.varint(depth, _value(src, field, record), 4)
+        elif kind == "varint3":
+            self.varint(depth, _value(src, field, record), 3)
+        elif kind == "svarint":
+            self.signed(depth, _value(src, field, record), 4)
+        elif kind == "svarint3":
+            self.signed(depth, _value(src, field, record), 3)
+        elif kind == "string":
+            d, k = src.var("s"), src.var("k")
+            src.emit(depth, f"{d} = ({_value(src, field, record)} or '').encode('utf-8')[:65535]")
+            src.emit(depth, f"{k} = len({d}) << 3")
+            src.emit(depth, f"a = (((a << 16) | ({k} >> 3)) << {k}) | int.from_bytes({d}, 'big')")
+            src.emit(depth, f"n += {k}")
+            self.pending += 16
+        elif kind == "float32":
+            self.settle(depth)
+            p = src.var("p")
+            src.emit(depth, f"{p} = -n & 7")
+            src.emit(depth, f"a = (a << ({p} + 32)) | int.from_bytes(_f32.pack({_value(src, field, record)}), 'big')")
+            src.emit(depth, f"n += {p}")
+            self.pending += 32
+        elif kind in ("optional", "when", "branch"):
+            v = src.var("r")
+            src.emit(depth, f"{v} = {_value(src, field, record)}")
+            test = f"{src.bind(field.present, '_p')}({v})" if field.present else v
+            self.settle(depth)
+            src.emit(depth, f"if {test}:")
+            self.fixed(depth + 1, "1", 1)
+            self.fields(depth + 1, field.fields, v if kind == "optional" else record)
+            self.settle(depth + 1)
+            src.emit(depth, "else:")
+            self.fixed(depth + 1, "0", 1)
+            if kind == "branch":
+                self.fields(depth + 1, field.otherwise, record)
+            self.settle(depth + 1)
+        elif kind == "cond":
+            v = src.var("r")
+            src.emit(depth, f"{v} = {_value(src, field, record)}")
+            test = f"{src.bind(field.present, '_p')}({v})" if field.present else v
+            self.settle(depth)
+            src.emit(depth, f"if {test}:")
+            src.emit(depth + 1, "pass")
+            self.fields(depth + 1, field.fields, record)
+            self.settle(depth + 1)
+        elif kind == "group":
+            v = src.var("r")
+            src.emit(depth, f"{v} = {_value(src, field, record)}")
+            self.fields(depth, field.fields, v)
+        elif kind in ("repeat", "stream"):
+            items, e = src.var("l"), src.var("e")
+            src.emit(depth, f"{items} = {_value(src, field, record)}")
+            if kind == "repeat" and field.count == "varint":
+                self.varint(depth, f"len({items})", 4)
+            elif kind == "repeat" and field.count is not None:
+                self.fixed(depth, f"len({items}) & {(1 << field.count) - 1}", field.count)
+            self.settle(depth)
+            src.emit(depth, f"for {e} in {items}:")
+            if kind == "stream":
+                self.fixed(depth + 1, "1", 1)
+            self.fields(depth + 1, field.fields, e)
+            self.flush(depth + 1)
+            if kind == "stream":
+                self.fixed(depth, "0", 1)
+        else:
+            raise ValueError(f"unknown field kind {kind!r}")
+
+
+class _Decoder:
+    def __init__(self, src: _Source, name: str):
+        self.src = src
+        self.name = name
+
+    def bits(self, depth: int, width) -> str:
+        """Emit a read of `width` bits (an int or an expression); returns the variable."""
+        src = self.src
+        x = src.var("x")
+        src.emit(depth, f"if p + {width} > t:")
+        src.emit(depth + 1, f"raise Truncated(f'{self.name}: needs {{p}} + {{{width}}} of {{t}} bits')")
+        src.emit(depth, f"{x} = (v >> (t - p - {width})) & ((1 << {width}) - 1)")
+        src.emit(depth, f"p += {width}")
+        return x
+
+    def varint(self, depth: int, prefix_bits: int) -> str:
+        prefix = self.bits(depth, prefix_bits)
+        return self.bits(depth, f"(({prefix} + 1) << 1)")
+
+    def store(self, depth: int, field: Field, record: str, expr: str) -> None:
+        if field.key is None:
+            self.src.emit(depth, f"{record} = {expr}")
+        else:
+            self.src.emit(depth, f"{record}[{field.key!r}] = {expr}")
+
+    def fields(self, depth: int, fields, record: str) -> None:
+        for field in fields:
+            self.field(depth, field, record)
+
+    def nested(self, depth: int, field: Field) -> str:
+        """A record (dict) for the field's sub-fields, or a plain variable for one unnamed field."""
+        r = self.src.var("r")
+        if not (len(field.fields) == 1 and field.fields[0].key is None):
+            self.src.emit(depth, f"{r} = {{}}")
+        return r
+
+    def field(self, depth: int, field: Field, record: str) -> None:
+        src, kind = self.src, field.kind
+        if kind == "const" and field.width is None:
+            self.varint(depth, 4)
+        elif kind == "const":
+            self.bits(depth, field.width)
+        elif kind == "uint":
+            self.store(depth, field, record, self.bits(depth, field.width))
+        elif kind == "flag":
+            self.store(depth, field, record, f"bool({self.bits(depth, 1)})")
+        elif kind in ("varint", "varint3"):
+            self.store(depth, field, record, self.varint(depth, 4 if kind == "varint" else 3))
+        elif kind in ("svarint", "svarint3"):
+            sign = self.bits(depth, 1)
+            m = self.varint(depth, 4 if kind == "svarint" else 3)
+            self.store(depth, field, record, f"-{m} if {sign} else {m}")
+        elif kind == "string":
+            k = self.bits(depth, 16)
+            d = self.bits(depth, f"({k} << 3)")
+            s = src.var("s")
+            src.emit(depth, f"{s} = {d}.to_bytes({k}, 'big')")
+            src.emit(depth, "try:")
+            src.emit(depth + 1, f"{s} = {s}.decode('utf-8')")
+            src.emit(depth, "except UnicodeDecodeError:")
+            src.emit(depth + 1, f"{s} = {s}.decode('latin1')")
+            self.store(depth, field, record, s)
+        elif kind == "float32":
+            src.emit(depth, "p += -p & 7")
+            x = self.bits(depth, 32)
+            self.store(depth, field, record, f"_f32.unpack({x}.to_bytes(4, 'big'))[0]")
+        elif kind == "cond":
+            # decided by a field already read into this record
+            test = f"{record}.get({field.key!r})" if field.key is not None else record
+            if field.present:
+                test = f"{src.bind(field.present, '_p')}({test})"
+            src.emit(depth, f"if {test}:")
+            src.emit(depth + 1, "pass")
+            self.fields(depth + 1, field.fields, record)
+        elif kind == "branch":
+            bit = self.bits(depth, 1)
+            src.emit(depth, f"if {bit}:")
+            src.emit(depth + 1, "pass")
+            self.fields(depth + 1, field.fields, record)
+            src.emit(depth, "else:")
+            src.emit(depth + 1, "pass")
+            self.fields(depth + 1, field.otherwise, record)
+        elif kind in ("optional", "when"):
+            bit = self.bits(depth, 1)
+            if kind == "when" and field.key is not None:
+                self.store(depth, field, record, f"bool({bit})")
+            src.emit(depth, f"if {bit}:")
+            if kind == "optional":
+                r = self.nested(depth + 1, field)
+                self.fields(depth + 1, field.fields, r)
+                self.store(depth + 1, field, record, r)
+                src.emit(depth, "else:")
+                self.store(depth + 1, field, record, "None")
+            else:
+                self.fields(depth + 1, field.fields, record)
+                src.emit(depth + 1, "pass")
+        elif kind == "group":
+            r = self.nested(depth, field)
+            self.fields(depth, field.fields, r)
+            self.store(depth, field, record, r)
+        elif kind in ("repeat", "stream"):
+            items = src.var("l")
+            src.emit(depth, f"{items} = []")
+            if kind == "repeat":
+                count = self.varint(depth, 4) if field.count == "varint" else self.bits(depth, field.count)
+                src.emit(depth, f"for _ in range({count}):")
+            else:
+                src.emit(depth, "while True:")
+                more = self.bits(depth + 1, 1)
+                src.emit(depth + 1, f"if not {more}:")
+                src.emit(depth + 2, "break")
+            r = self.nested(depth + 1, field)
+            self.fields(depth + 1, field.fields, r)
+            src.emit(depth + 1, f"{items}.append({r})")
+            self.store(depth, field, record, items)
+        else:
+            raise ValueError(f"unknown field kind {kind!r}")
+
+
+def _decodable(fields) -> bool:
+    return all(not (f.kind == "repeat" and f.count is None) and _decodable(f.fields)
+               and _decodable(f.otherwise) for f in fields)
+
+
+class Schema:
+    def __init__(self, name: str, fields):
+        self.name = name
+        self.fields = list(fields)
+        src = _Source()
+        src.emit(0, f"def encode_{name}(r):")
+        src.emit(1, "out = bytearray()")
+        src.emit(1, "a = n = 0")
+        enc = _Encoder(src)
+        enc.fields(1, self.fields, "r")
+        enc.settle(1)
+        src.emit(1, "pad = -n & 7")
+        src.emit(1, "out += (a << pad).to_bytes((n + pad) >> 3, 'big')")
+        src.emit(1, "return bytes(out)")
+        src.emit(0, "")
+        src.emit(0, f"def decode_{name}(data):")
+        src.emit(1, "v = int.from_bytes(data, 'big')")
+        src.emit(1, "t = len(data) << 3")
+        src.emit(1, "p = 0")
+        src.emit(1, "r = {}")
+        if _decodable(self.fields):
+            _Decoder(src, name).fields(1, self.fields, "r")
+            src.emit(1, "return r")
+        else:
+            src.emit(1, f"raise TypeError('schema {name} has a repeat with no count: it can only be encoded')")
+        self.source = src.text()
+        namespace = src.namespace
+        exec(compile(self.source, f"<schema {name}>", "exec"), namespace)
+        self.encode = namespace[f"encode_{name}"]
+        self.decode = namespace[f"decode_{name}"]
+
+    def frame(self, packet_id: int, record) -> bytes:
+        payload = self.encode(record)
+        return struct.pack(">HH", packet_id, len(payload)) + payload
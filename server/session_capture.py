@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Inbound traffic capture and replay.
+
+Recording is opt-in: start the server with DBZ_CAPTURE=<file> and every
+inbound frame is appended to that file together with the session it came
+from and when it arrived. Transfer tokens handed out in 0x21 are recorded
+too, so a replay can follow a client from one connection to the next.
+
+Replaying starts a server in-process on a scratch copy of saves/ and
+Accounts.json (or targets a running one with --external) and feeds the
+recorded frames back, one connection per recorded session:
+
+    python session_capture.py replay capture.bin --speed 4
+    python session_capture.py replay capture.bin --speed 0 --port 18080   # as fast as possible
+    python session_capture.py info capture.bin
+
+File layout: the MAGIC header, then records of
+    kind:u8  t:f64 (seconds since capture start)  session:u32  opcode:u16  length:u16  payload
+"""
+import argparse
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from BitUtils import BitBuffer
+from bitreader import BitReader
+from storage import SQLITE_FILE
+
+MAGIC = b"DBZCAP01"
+REC_OPEN, REC_FRAME, REC_TOKEN, REC_CLOSE = range(4)
+_RECORD = struct.Struct(">BdIHH")
+
+# Opcodes whose payload starts with the sender's entity id (method_4)
+ENTITY_OPCODES = (0x07, 0x09, 0x2C)
+
+_recorder = None
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._next_session = 1
+        self._last_flush = self._started
+
+    def _write(self, kind, session, opcode=0, payload=b""):
+        now = time.perf_counter()
+        with self._lock:
+            self._file.write(_RECORD.pack(kind, now - self._started, session, opcode, len(payload)))
+            self._file.write(payload)
+            if now - self._last_flush > 1.0:
+                self._file.flush()
+                self._last_flush = now
+
+    def open_session(self, addr) -> int:
+        with self._lock:
+            session = self._next_session
+            self._next_session += 1
+        self._write(REC_OPEN, session, payload=f"{addr[0]}:{addr[1]}".encode())
+        return session
+
+    def frame(self, session, opcode, payload):
+        self._write(REC_FRAME, session, opcode, payload)
+
+    def token(self, session, token):
+        self._write(REC_TOKEN, session, payload=struct.pack(">I", token))
+
+    def close_session(self, session):
+        self._write(REC_CLOSE, session)
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def start_recording(path: str) -> Recorder:
+    global _recorder
+    _recorder = Recorder(path)
+    print(f"[Capture] Recording inbound traffic to {path}")
+    return _recorder
+
+
+# Server hooks; all of them are no-ops unless recording was started.
+def open_session(addr):
+    return _recorder.open_session(addr) if _recorder else 0
+
+
+def record_frame(session, opcode, payload):
+    if _recorder:
+        _recorder.frame(session, opcode, payload)
+
+
+def record_token(session, token):
+    if _recorder:
+        _recorder.token(session, token)
+
+
+def close_session(session):
+    if _recorder:
+        _recorder.close_session(session)
+
+
+# ─── reading ─────────────────────────────────────────────────────────────
+def read_capture(path):
+    """Yields (kind, t, session, opcode, payload) tuples."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            kind, t, session, opcode, length = _RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # truncated tail from a server that was killed
+            yield kind, t, session, opcode, payload
+
+
+def replace_entity_id(payload, old_id, new_id):
+    """Swap the leading method_4 entity id of a payload, keeping the rest bit-exact."""
+    br = BitReader(payload)
+    ent_id = br.read_method_4()
+    if ent_id != old_id:
+        return payload
+    rest_bits = len(payload) * 8 - br.bit_index
+    bb = BitBuffer()
+    bb.write_method_4(new_id)
+    bb._append_bits(int.from_bytes(payload, "big") & ((1 << rest_bits) - 1), rest_bits)
+    return bb.to_bytes()
+
+
+# ─── replay ──────────────────────────────────────────────────────────────
+class TokenMap:
+    """Recorded transfer token -> token the live server issued for it."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._map = {}
+
+    def put(self, recorded, live):
+        with self._cond:
+            self._map[recorded] = live
+            self._cond.notify_all()
+
+    def get(self, recorded, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: recorded in self._map, timeout)
+            return self._map.get(recorded)
+
+
+class ReplaySession(threading.Thread):
+    def __init__(self, sid, records, tokens, args, started, stats):
+        super().__init__(daemon=True)
+        self.sid = sid
+        self.records = records          # [(kind, t, opcode, payload)]
+        self.tokens = tokens
+        self.args = args
+        self.started = started
+        self.stats = stats
+        self.recorded_tokens = [int.from_bytes(p, "big") for k, _, _, p in records if k == REC_TOKEN]
+        self.live_tokens = 0
+        self.tokens_seen = threading.Condition()
+        self.ent_map = (None, None)     # (recorded entity id, live entity id)
+
+    def _wait_until(self, t):
+        if self.args.speed > 0:
+            delay = self.started + t / self.args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _read_loop(self, sock):
+        def read_exact(n):
+            buf = b""
+            while len(buf) < n:
+                chunk = sock.recv(n - len(buf))
+                if not chunk:
+                    return None
+                buf += chunk
+            return buf
+        try:
+            while True:
+                hdr = read_exact(4)
+                if hdr is None:
+                    return
+                opcode, length = struct.unpack(">HH", hdr)
+                payload = read_exact(length) if length else b""
+                if payload is None:
+                    return
+                if opcode == 0x21 and self.live_tokens < len(self.recorded_tokens):
+                    live = BitReader(payload).read_method_4()
+                    self.tokens.put(self.recorded_tokens[self.live_tokens], live)
+                    with self.tokens_seen:
+                        self.live_tokens += 1
+                        self.tokens_seen.notify_all()
+        except OSError:
+            pass
+
+    def run(self):
+        sock = None
+        issued = 0
+        try:
+            for kind, t, opcode, payload in self.records:
+                self._wait_until(t)
+                if kind == REC_OPEN:
+                    sock = socket.create_connection((self.args.host, self.args.port), timeout=10)
+                    sock.settimeout(None)
+                    threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+                elif kind == REC_FRAME and sock is not None:
+                    if opcode == 0x1F and len(payload) >= 4:
+                        recorded = int.from_bytes(payload[:4], "big")
+                        live = self.tokens.get(recorded, self.args.token_timeout)
+                        if live is None:
+                            print(f"[Replay] session {self.sid}: no live token for {recorded}, using it as-is")
+                            live = recorded
+                        self.ent_map = (recorded, live)
+                        payload = struct.pack(">I", live) + payload[4:]
+                    elif opcode in ENTITY_OPCODES and self.ent_map[0] is not None:
+                        try:
+                            payload = replace_entity_id(payload, *self.ent_map)
+                        except ValueError:
+                            pass
+                    sock.sendall(struct.pack(">HH", opcode, len(payload)) + payload)
+                    self.stats.sent(opcode, len(payload))
+                elif kind == REC_TOKEN:
+                    issued += 1
+                elif kind == REC_CLOSE and sock is not None:
+                    # Don't hang up before the server has sent the 0x21 the
+                    # recorded client got, or the next connection can't use it.
+                    with self.tokens_seen:
+                        self.tokens_seen.wait_for(lambda: self.live_tokens >= issued, self.args.token_timeout)
+                    sock.close()
+                    sock = None
+        except OSError as e:
+            print(f"[Replay] session {self.sid} stopped: {e}")
+        finally:
+            if sock is not None:
+                sock.close()
+
+
+class ReplayStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_opcode = {}
+
+    def sent(self, opcode, nbytes):
+        with self.lock:
+            count, total = self.by_opcode.get(opcode, (0, 0))
+            self.by_opcode[opcode] = (count + 1, total + nbytes)
+
+
+def _group_sessions(path):
+    sessions = {}
+    for kind, t, sid, opcode, payload in read_capture(path):
+        sessions.setdefault(sid, []).append((kind, t, opcode, payload))
+    return sessions
+
+
+def _prepare_scratch(args):
+    """Scratch server root: data/ linked, Accounts.json, saves/ and game.db copied."""
+    scratch = tempfile.mkdtemp(prefix="dbz-replay-")
+    src = os.path.abspath(args.server_root)
+    os.symlink(os.path.join(src, "data"), os.path.join(scratch, "data"))
+    accounts = os.path.join(src, "Accounts.json")
+    if os.path.exists(accounts):
+        shutil.copy2(accounts, scratch)
+    saves = args.saves or os.path.join(src, "saves")
+    if os.path.isdir(saves):
+        shutil.copytree(saves, os.path.join(scratch, "saves"))
+    else:
+        os.makedirs(os.path.join(scratch, "saves"))
+    db = os.path.join(src, SQLITE_FILE)
+    if os.path.exists(db):
+        # backup() also picks up pages still sitting in the WAL
+        import sqlite3
+        source, target = sqlite3.connect(db), sqlite3.connect(os.path.join(scratch, SQLITE_FILE))
+        source.backup(target)
+        source.close()
+        target.close()
+    return scratch
+
+
+def replay(args):
+    sessions = _group_sessions(args.capture)
+    if not sessions:
+        print("[Replay] Capture is empty")
+        return 1
+
+    scratch = None
+    if not args.external:
+        scratch = _prepare_scratch(args)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(scratch)
+        # The default backends live next to storage.py: point this one at the scratch copy
+        kind, _, arg = os.environ.get("DBZ_STORAGE", "json").partition(":")
+        os.environ["DBZ_STORAGE"] = (f"sqlite:{os.path.join(scratch, arg or SQLITE_FILE)}"
+                                     if kind.strip().lower() == "sqlite" else f"json:{scratch}")
+        import server
+        server.HOST = args.host
+        server.PORTS = [args.port]
+        if not server.start_servers():
+            return 1
+        print(f"[Replay] In-process server on {args.host}:{args.port}, scratch dir {scratch}")
+
+    tokens = TokenMap()
+    stats = ReplayStats()
+    started = time.perf_counter()
+    threads = [ReplaySession(sid, recs, tokens, args, started, stats) for sid, recs in sorted(sessions.items())]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    # Let the server drain whatever is still queued before reporting
+    time.sleep(args.settle)
+    elapsed = time.perf_counter() - started
+
+    frames = sum(c for c, _ in stats.by_opcode.values())
+    print(f"[Replay] {len(threads)} sessions, {frames} frames in {elapsed:.2f}s ({frames / elapsed:.0f} frames/s)")
+    for opcode, (count, nbytes) in sorted(stats.by_opcode.items()):
+        print(f"  0x{opcode:02X}  {count:>8} frames  {nbytes:>10} bytes")
+    if not args.external:
+        import metrics
+        print()
+        print("\n".join(line for line in metrics.render_text().splitlines()
+                        if line.startswith("dbz_handler_latency_seconds{")))
+        if not args.keep_scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+def info(args):
+    sessions = _group_sessions(args.capture)
+    opcodes = {}
+    duration = 0.0
+    for recs in sessions.values():
+        for kind, t, opcode, payload in recs:
+            duration = max(duration, t)
+            if kind == REC_FRAME:
+                opcodes[opcode] = opcodes.get(opcode, 0) + 1
+    print(f"{args.capture}: {len(sessions)} sessions, {sum(opcodes.values())} frames over {duration:.1f}s")
+    for opcode, count in sorted(opcodes.items(), key=lambda kv: -kv[1]):
+        print(f"  0x{opcode:02X}  {count}")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay or inspect a DBZ_CAPTURE file")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    rp = sub.add_parser("replay")
+    rp.add_argument("capture")
+    rp.add_argument("--speed", type=float, default=1.0, help="time scale; 0 replays as fast as possible")
+    rp.add_argument("--host", default="127.0.0.1")
+    rp.add_argument("--port", type=int, default=18080)
+    rp.add_argument("--external", action="store_true", help="target an already running server")
+    rp.add_argument("--server-root", default=os.path.dirname(os.path.abspath(__file__)),
+                    help="directory holding data/, Accounts.json and saves/ to copy")
+    rp.add_argument("--saves", help="saves directory to seed the scratch copy with")
+    rp.add_argument("--keep-scratch", action="store_true")
+    rp.add_argument("--token-timeout", type=float, default=10.0)
+    rp.add_argument("--settle", type=float, default=0.5)
+    rp.set_defaults(func=replay)
+
+    ip = sub.add_parser("info")
+    ip.add_argument("capture")
+    ip.set_defaults(func=info)
+
+    args = ap.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# sharding.py
+"""
+Level -> worker process assignment for multi-process mode.
+
+Every level in LEVEL_CONFIG is owned by exactly one worker; worker i
+listens on base_port + i. Transfers (0x16, 0x1D) send the client to the
+owning worker and hand the character over on that worker's queue.
+"""
+from level_config import LEVEL_CONFIG
+
+# Levels everybody passes through get a worker to themselves where possible
+HUB_LEVELS = ("CraftTown", "BridgeTown", "NewbieRoad")
+
+
+def assign_levels(level_names, workers: int) -> dict:
+    """
+    Deterministic level -> worker index map. Hub levels are spread first,
+    the rest are dealt round-robin in LEVEL_CONFIG order, starting after
+    the hubs so those workers get fewer extra levels.
+    """
+    owners = {}
+    hubs = [lvl for lvl in HUB_LEVELS if lvl in level_names]
+    for i, lvl in enumerate(hubs):
+        owners[lvl] = i % workers
+    slot = len(hubs)
+    for lvl in level_names:
+        if lvl in owners:
+            continue
+        owners[lvl] = slot % workers
+        slot += 1
+    return owners
+
+
+class ShardMap:
+    def __init__(self, workers: int, host: str = "127.0.0.1", base_port: int = 8080):
+        self.workers = workers
+        self.host = host
+        self.base_port = base_port
+        self.owners = assign_levels(list(LEVEL_CONFIG), workers)
+
+    def owner(self, level_name: str) -> int:
+        # Unknown levels stay with worker 0, where logins land
+        return self.owners.get(level_name, 0)
+
+    def port(self, worker: int) -> int:
+        return self.base_port + worker
+
+    def address(self, level_name: str):
+        return self.host, self.port(self.owner(level_name))
+
+    def levels_of(self, worker: int) -> list:
+        return [lvl for lvl, w in self.owners.items() if w == worker]
@@ -0,0 +1,166 @@
+# static_data.py
+"""
+Static game data from data/*.json, loaded once into immutable,
+integer-indexed tables.
+
+    STATIC.dye(7)                  -> Dye, or None
+    STATIC.dye_color(7)            -> int, or None
+    STATIC.gears("paladin")        -> tuple of Gear, in file order
+    STATIC.mastery_trees("mage")   -> the class's trees
+    STATIC.reward_packs            -> tuple of RewardEntry
+    STATIC.reward_pack(1)          -> one pack's entries, by position
+    STATIC.reward_pack_id("Lockbox01SafeLegendary") -> 3, or None
+
+Paths are resolved from this file, not the CWD. When data/boot.snapshot
+(`python server.py --build-snapshot`) is current, the registry is
+unpickled from it instead of parsing the JSON files.
+"""
+import json
+import os
+from collections import namedtuple
+from types import MappingProxyType
+
+import boot
+
+DATA_DIR = boot.DATA_DIR
+
+CLASSES = ("paladin", "rogue", "mage")
+
+
+class Dye(namedtuple("Dye", "dye_id name color highlight shadow rarity")):
+    __slots__ = ()
+
+
+class Gear(namedtuple("Gear", "gear_id tier runes colors")):
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        """The mutable form characters keep in inventoryGears."""
+        return {"gearID": self.gear_id, "tier": self.tier,
+                "runes": list(self.runes), "colors": list(self.colors)}
+
+
+class MasterySlot(namedtuple("MasterySlot", "filled points node_idx")):
+    __slots__ = ()
+
+
+class MasteryTree(namedtuple("MasteryTree", "master_class_id class_id class_name slots")):
+    # master_class_id is the MasteryClass.json key; the stored classID
+    # doesn't always match it (paladin "6" says 5)
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        return {"classID": self.class_id,
+                "slots": [{"filled": s.filled, "points": s.points, "nodeIdx": s.node_idx}
+                          for s in self.slots]}
+
+
+class RewardEntry(namedtuple("RewardEntry", "name reward_type rarity pack_id position value item_id alternate")):
+    # (pack_id, position) is what 0x108 sends; item_id is the mount/pet/
+    # charm/consumable ID the reward grants, when it grants one
+    __slots__ = ()
+
+
+def _indexed(items, key):
+    """Tuple where position key(item) holds item, None elsewhere."""
+    items = list(items)
+    table = [None] * (max((key(i) for i in items), default=-1) + 1)
+    for item in items:
+        table[key(item)] = item
+    return tuple(table)
+
+
+class StaticData:
+    """Read-only registry; use STATIC or load_from_json() rather than building one."""
+
+    __slots__ = ("dyes", "_gears", "_mastery", "_mastery_by_class", "reward_packs", "_packs", "_pack_ids")
+
+    def __init__(self, dyes, gears, mastery, reward_packs, pack_ids):
+        s = object.__setattr__
+        s(self, "dyes", _indexed(dyes, lambda d: d.dye_id))
+        s(self, "_gears", MappingProxyType({cls: tuple(g) for cls, g in gears.items()}))
+        s(self, "_mastery", tuple(mastery))
+        s(self, "_mastery_by_class", MappingProxyType(
+            {cls: tuple(t for t in mastery if t.class_name == cls) for cls in gears}))
+        s(self, "reward_packs", tuple(reward_packs))
+        packs = {}
+        for entry in self.reward_packs:
+            packs.setdefault(entry.pack_id, []).append(entry)
+        s(self, "_packs", MappingProxyType({p: tuple(e) for p, e in packs.items()}))
+        s(self, "_pack_ids", MappingProxyType(dict(pack_ids)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StaticData is read-only")
+
+    def __reduce__(self):
+        dyes = [d for d in self.dyes if d is not None]
+        return StaticData, (dyes, dict(self._gears), self._mastery, self.reward_packs, dict(self._pack_ids))
+
+    def dye(self, dye_id):
+        if 0 <= dye_id < len(self.dyes):
+            return self.dyes[dye_id]
+        return None
+
+    def dye_color(self, dye_id):
+        dye = self.dye(dye_id)
+        return dye.color if dye is not None else None
+
+    def gears(self, class_name: str):
+        return self._gears.get(class_name.lower(), ())
+
+    def mastery_trees(self, class_name: str):
+        return self._mastery_by_class.get(class_name.lower(), ())
+
+    def reward_pack(self, pack_id: int):
+        return self._packs.get(pack_id, ())
+
+    def reward_pack_id(self, pack_name: str):
+        return self._pack_ids.get(pack_name)
+
+
+def _read_json(name: str):
+    with open(os.path.join(DATA_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_from_json() -> StaticData:
+    dyes = [Dye(int(dye_id), d["name"], d["color"], d.get("highlight"), d.get("shadow"), d.get("rarity"))
+            for dye_id, d in _read_json("DyeTypes.json").items()]
+
+    gears = {}
+    for cls in CLASSES:
+        try:
+            raw = _read_json(f"{cls}_gears.json")
+        except Exception as e:
+            print(f"Failed to load {cls} gear data: {e}")
+            raw = []
+        gears[cls] = [Gear(g["gearID"], g.get("tier", 0), tuple(g.get("runes", (0, 0, 0))),
+                           tuple(g.get("colors", (0, 0))))
+                      for g in raw]
+
+    mastery = []
+    for cls, trees in _read_json("MasteryClass.json").items():
+        for master_class_id, tree in trees.items():
+            slots = tuple(MasterySlot(s["filled"], s["points"], s["nodeIdx"]) for s in tree["slots"])
+            mastery.append(MasteryTree(int(master_class_id), tree["classID"], cls, slots))
+
+    # Like the client's loader: an entry naming a RewardpackID starts a new
+    # pack, the ones after it belong to that pack in order
+    rewards = []
+    pack_ids = {}
+    pack_id, position = None, 0
+    for r in _read_json("rewardpack_types.json"):
+        if r.get("RewardpackID") is not None:
+            pack_id, position = int(r["RewardpackID"]), 0
+            pack_ids[r.get("RewardpackName")] = pack_id
+        else:
+            position += 1
+        value = r.get("Value")
+        rewards.append(RewardEntry(r.get("RewardItem") or r.get("RewardpackName"), r["RewardType"], r["Rarity"],
+                                   pack_id, position, int(value) if value is not None else None,
+                                   r.get("ItemID"), r.get("AlternateRewardpack")))
+
+    return StaticData(dyes, gears, mastery, rewards, pack_ids)
+
+
+STATIC = boot.section("static_data") or load_from_json()
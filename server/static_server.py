@@ -5,11 +5,29 @@ from http.server import HTTPServer, SimpleHTTPRequestHandler
 def start_static_server(
     host: str = "127.0.0.1",
     port: int = 80,
-    directory: str = "content/localhost"
+    directory: str = "content/localhost",
+    routes: dict = None
 ):
+    """
+    Serve `directory` over HTTP. `routes` maps a request path to a callable
+    returning text, served as text/plain instead of a file (e.g. /metrics).
+    """
+    routes = routes or {}
+
     class _Handler(SimpleHTTPRequestHandler):
         def __init__(self, *args, **kwargs):
             super().__init__(*args, directory=directory, **kwargs)
+
+        def do_GET(self):
+            route = routes.get(self.path.split("?", 1)[0])
+            if route is None:
+                return super().do_GET()
+            body = route().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
     httpd = HTTPServer((host, port), _Handler)
     threading.Thread(target=httpd.serve_forever, daemon=True).start()
     print(f"[Static] Serving ./{directory} at http://{host}:{port}/")
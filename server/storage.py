@@ -0,0 +1,757 @@
+# storage.py
+"""
+Where accounts and save documents live.
+
+Two backends share one interface:
+
+    json    Accounts.json + saves/<user_id>.json (the default); handler
+            saves append to saves/<user_id>.journal and are folded into
+            the .json snapshot in the background
+    sqlite  one WAL-mode database; characters get indexed columns and every
+            top-level character field is its own JSON blob, so a handler
+            that only touched "gearSets" rewrites that one row
+
+Each backend also keeps every character template version its saves were
+made against (char_template.py), so the two always travel together, and
+the guild rosters (guilds.py), one document per guild. The
+default files are next to this module, wherever the server is started
+from.
+
+Pick one with DBZ_STORAGE, e.g. DBZ_STORAGE=sqlite:game.db. Everything
+above this module (accounts.py, save_cache.py, Character.py, Commands.py)
+goes through get_storage(); migrate_storage.py copies between backends.
+
+Every write returns a version token and user_version() returns the current
+one, so save_cache can tell whether its parsed copy is still current.
+
+Both backends may be shared by several processes (--workers). SQLite
+locks for itself; the json backend takes a byte-range lock per user in
+saves/.lock around every load, append and compaction, so one process
+folding a journal can't drop another's appends. Guild updates reload
+the roster under a lock of their own, so concurrent ones all land.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import boot
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+from char_template import REMOVED_KEY, VERSION_KEY, stored_form, to_saved
+
+ACCOUNTS_FILE = "Accounts.json"
+SAVES_DIR = "saves"
+SQLITE_FILE = "game.db"
+TEMPLATES_DIR = "templates"     # under the saves directory: <class>.<version>.json
+GUILDS_FILE = "guilds.json"     # under the saves directory: {guild name: roster}
+
+DEFAULT_ACCOUNTS_PATH = os.path.join(boot.SERVER_DIR, ACCOUNTS_FILE)
+DEFAULT_SAVES_DIR = os.path.join(boot.SERVER_DIR, SAVES_DIR)
+DEFAULT_SQLITE_PATH = os.path.join(boot.SERVER_DIR, SQLITE_FILE)
+
+# Character fields that also get their own column (and index) in SQLite
+INDEXED_FIELDS = ("name", "class", "level", "CurrentLevel")
+
+# Journal records a user may pile up before the compactor folds them into
+# the snapshot, and whether every append is fsync'd before the handler
+# carries on.
+JOURNAL_COMPACT_AFTER = 64
+JOURNAL_FSYNC = True
+
+LOCK_SLOTS = 1024       # users hashed onto this many lock bytes, then Accounts.json's and guilds.json's
+ACCOUNTS_SLOT = LOCK_SLOTS
+GUILDS_SLOT = LOCK_SLOTS + 1
+
+
+# The process umask, for the mode a plain open() would have given a new file
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(path: str) -> int:
+    """The existing file's permissions, or what open() would create it with."""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def _atomic_write(path: str, data) -> None:
+    """
+    Atomically write JSON-serializable `data` to `path`.
+    Writes to a temp file then renames it into place.
+    """
+    dirpath = os.path.dirname(path) or "."
+    os.makedirs(dirpath, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile("w", dir=dirpath, delete=False, encoding="utf-8") as tf:
+        json.dump(data, tf, ensure_ascii=False, indent=2, default=to_saved)
+        tf.flush()
+        os.fsync(tf.fileno())
+
+    # NamedTemporaryFile creates 0600; keep the mode the file had (or would have)
+    os.chmod(tf.name, _file_mode(path))
+    os.replace(tf.name, path)
+
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _file_id(path: str):
+    """[inode, mtime_ns]; _atomic_write always produces a new inode."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_ino, st.st_mtime_ns]
+
+
+def _size(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+class _FileLocks:
+    """
+    Exclusive locks on single bytes of one file, shared by every process
+    that opens it. Within a process, callers must already hold a
+    threading lock for the slot: the OS lock is per process, not per thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._fd_lock = threading.Lock()    # opening, and seeking for msvcrt
+
+    def _file(self) -> int:
+        with self._fd_lock:
+            if self._fd is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                # Never closed: closing any descriptor of the file drops our locks
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, _file_mode(self.path))
+            return self._fd
+
+    def acquire(self, slot: int) -> None:
+        fd = self._file()
+        if fcntl is not None:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, slot)
+            return
+        while True:
+            with self._fd_lock:
+                os.lseek(fd, slot, os.SEEK_SET)
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    return
+                except OSError:
+                    pass
+            time.sleep(0.005)
+
+    def release(self, slot: int) -> None:
+        fd = self._file()
+        if fcntl is not None:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, slot)
+            return
+        with self._fd_lock:
+            os.lseek(fd, slot, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def apply_mutation(doc: dict, record: dict) -> None:
+    """Apply one journal record {"op": "set"|"del", "path": [...], "value": ...}."""
+    *parents, key = record["path"]
+    target = doc
+    for part in parents:
+        target = target[part]
+    if record["op"] == "del":
+        if isinstance(target, dict):
+            target.pop(key, None)
+        elif key < len(target):
+            del target[key]
+    elif isinstance(target, list) and key == len(target):
+        target.append(record["value"])
+    else:
+        target[key] = record["value"]
+
+
+class JsonStorage:
+    """Accounts.json plus one pretty-printed JSON file per user."""
+
+    kind = "json"
+
+    def __init__(self, accounts_path=DEFAULT_ACCOUNTS_PATH, saves_dir=DEFAULT_SAVES_DIR):
+        self.accounts_path = accounts_path
+        self.saves_dir = saves_dir
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._file_locks = _FileLocks(os.path.join(saves_dir, ".lock"))
+        self._pending = {}        # user_id -> journal records since the last snapshot
+        self._journal_base = {}   # user_id -> snapshot id the journal was last seen on
+        self._compact_lock = threading.Lock()
+        self._compacting = set()
+        self._compactor = None    # started by the first compaction (concurrent.futures is slow to import)
+
+    # ─── accounts ────────────────────────────────────────────────────────
+    def accounts_version(self):
+        return _mtime(self.accounts_path)
+
+    def read_accounts(self) -> dict:
+        try:
+            with open(self.accounts_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # entries is a list of {"email":..., "user_id":...}
+        return {e["email"]: e["user_id"] for e in entries}
+
+    def write_accounts(self, index: dict) -> None:
+        entries = [{"email": email, "user_id": uid} for email, uid in index.items()]
+        _atomic_write(self.accounts_path, entries)
+
+    def add_account(self, email: str, user_id: str) -> None:
+        with self._locked(ACCOUNTS_SLOT):
+            index = self.read_accounts()
+            index[email] = user_id
+            self.write_accounts(index)
+
+    @contextmanager
+    def _locked(self, slot: int):
+        with self._locks[slot % len(self._locks)]:
+            self._file_locks.acquire(slot)
+            try:
+                yield
+            finally:
+                self._file_locks.release(slot)
+
+    # ─── users ───────────────────────────────────────────────────────────
+    #
+    # saves/<user_id>.json is the snapshot. save_character() only appends
+    # mutation records to saves/<user_id>.journal, whose first line names
+    # the snapshot it applies to ({"base": [inode, mtime_ns]}); a journal
+    # whose base no longer matches was already folded in (or superseded by
+    # a full save) and is ignored. A torn last line from a crash is dropped.
+    def location(self, user_id: str) -> str:
+        return os.path.join(self.saves_dir, f"{user_id}.json")
+
+    def journal_path(self, user_id: str) -> str:
+        return os.path.join(self.saves_dir, f"{user_id}.journal")
+
+    def _user_lock(self, user_id: str):
+        # crc32, not hash(): every process has to pick the same slot
+        return self._locked(zlib.crc32(user_id.encode("utf-8")) % LOCK_SLOTS)
+
+    def user_version(self, user_id: str):
+        base = _file_id(self.location(user_id))
+        if base is None:
+            return None
+        return (*base, _size(self.journal_path(user_id)))
+
+    def user_ids(self):
+        try:
+            names = sorted(os.listdir(self.saves_dir))
+        except FileNotFoundError:
+            return []
+        return [n[:-5] for n in names if n.endswith(".json")]
+
+    def _read_journal(self, user_id: str, base):
+        """
+        (records, torn): the records that apply on top of snapshot `base`,
+        oldest first, and whether the file ends in a half-written record.
+        """
+        try:
+            with open(self.journal_path(user_id), "r", encoding="utf-8") as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return [], False
+        try:
+            if json.loads(lines[0]).get("base") != base:
+                return [], False
+        except ValueError:
+            return [], False
+        records = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                return records, True
+        return records, False
+
+    def _load_locked(self, user_id: str):
+        path = self.location(user_id)
+        version = self.user_version(user_id)
+        if version is None:
+            return None, None, 0, False
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        records, torn = self._read_journal(user_id, list(version[:2]))
+        for record in records:
+            apply_mutation(doc, record)
+        return version, doc, len(records), torn
+
+    def load_user(self, user_id: str):
+        """(version, doc), or (None, None) if the user has no save."""
+        with self._user_lock(user_id):
+            version, doc, pending, torn = self._load_locked(user_id)
+            if torn:
+                # Nothing may be appended after a torn record, so fold now
+                version = self._write_snapshot_locked(user_id, doc)
+                pending = 0
+            self._pending[user_id] = pending
+        if pending >= JOURNAL_COMPACT_AFTER:
+            self._schedule_compaction(user_id)
+        return version, doc
+
+    def _write_snapshot_locked(self, user_id: str, doc: dict):
+        _atomic_write(self.location(user_id), doc)
+        try:
+            os.remove(self.journal_path(user_id))
+        except FileNotFoundError:
+            pass
+        self._pending[user_id] = 0
+        return self.user_version(user_id)
+
+    def save_user(self, user_id: str, doc: dict):
+        with self._user_lock(user_id):
+            return self._write_snapshot_locked(user_id, doc)
+
+    def save_character(self, user_id: str, doc: dict, char: dict, fields=None):
+        """
+        Append set/del records for `fields` of `char` (or the whole
+        character) to the journal instead of rewriting the snapshot.
+        """
+        chars = doc.get("characters") or []
+        slot = next((i for i, c in enumerate(chars) if c is char), None)
+        if slot is None:
+            return self.save_user(user_id, doc)
+        if fields is None:
+            records = [{"op": "set", "path": ["characters", slot], "value": char}]
+        else:
+            stored, fields = _stored_fields(char, fields)
+            records = [{"op": "set", "path": ["characters", slot, f], "value": stored[f]} if f in stored
+                       else {"op": "del", "path": ["characters", slot, f]}
+                       for f in fields]
+
+        with self._user_lock(user_id):
+            base = _file_id(self.location(user_id))
+            if base is None:
+                return self._write_snapshot_locked(user_id, doc)
+            with open(self.journal_path(user_id), "a", encoding="utf-8") as f:
+                if f.tell() == 0:
+                    f.write(_dumps({"base": base}) + "\n")
+                elif self._journal_base.get(user_id) != base and \
+                        self._read_journal_base(user_id) != base:
+                    # Left over from a snapshot that has since been replaced
+                    f.truncate(0)
+                    f.write(_dumps({"base": base}) + "\n")
+                self._journal_base[user_id] = base
+                f.write("".join(_dumps(r) + "\n" for r in records))
+                f.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(f.fileno())
+            pending = self._pending[user_id] = self._pending.get(user_id, 0) + len(records)
+            version = self.user_version(user_id)
+        if pending >= JOURNAL_COMPACT_AFTER:
+            self._schedule_compaction(user_id)
+        return version
+
+    # ─── character templates ─────────────────────────────────────────────
+    def template_path(self, template_id: str, version: str) -> str:
+        return os.path.join(self.saves_dir, TEMPLATES_DIR, f"{template_id}.{version}.json")
+
+    def load_template(self, template_id: str, version: str):
+        try:
+            with open(self.template_path(template_id, version), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_template(self, template_id: str, version: str, template: dict) -> None:
+        """Archive a template version; versions are content hashes, so never rewritten."""
+        path = self.template_path(template_id, version)
+        if not os.path.exists(path):
+            _atomic_write(path, template)
+
+    def templates(self):
+        """[(template_id, version)] of every archived template."""
+        try:
+            names = sorted(os.listdir(os.path.join(self.saves_dir, TEMPLATES_DIR)))
+        except FileNotFoundError:
+            return []
+        return [tuple(n[:-5].rsplit(".", 1)) for n in names if n.endswith(".json") and n.count(".") == 2]
+
+    # ─── guilds ──────────────────────────────────────────────────────────
+    def guilds_path(self) -> str:
+        return os.path.join(self.saves_dir, GUILDS_FILE)
+
+    def load_guilds(self) -> dict:
+        """{guild name: roster document} of every stored guild."""
+        try:
+            with open(self.guilds_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update_guild(self, name: str, fn) -> dict:
+        """
+        Replace guild `name` with fn(its stored document, or None), read
+        and written under the guilds lock. Returns the new document.
+        """
+        with self._locked(GUILDS_SLOT):
+            guilds = self.load_guilds()
+            doc = guilds[name] = fn(guilds.get(name))
+            _atomic_write(self.guilds_path(), guilds)
+            return doc
+
+    def _read_journal_base(self, user_id: str):
+        try:
+            with open(self.journal_path(user_id), "r", encoding="utf-8") as f:
+                return json.loads(f.readline()).get("base")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _schedule_compaction(self, user_id: str) -> None:
+        with self._compact_lock:
+            if user_id in self._compacting:
+                return
+            self._compacting.add(user_id)
+            if self._compactor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal-compactor")
+        self._compactor.submit(self._compact, user_id)
+
+    def _compact(self, user_id: str) -> None:
+        try:
+            self.compact(user_id)
+        except Exception as e:
+            print(f"[Storage] Compacting journal of {user_id} failed: {e}")
+        finally:
+            with self._compact_lock:
+                self._compacting.discard(user_id)
+
+    def compact(self, user_id: str) -> bool:
+        """Fold the user's journal into their snapshot. False if there was nothing to fold."""
+        with self._user_lock(user_id):
+            if not os.path.exists(self.journal_path(user_id)):
+                return False
+            _, doc, _, _ = self._load_locked(user_id)
+            if doc is None:
+                return False
+            self._write_snapshot_locked(user_id, doc)
+        return True
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    email   TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    extra   TEXT NOT NULL DEFAULT '{}',   -- the save document minus "characters"
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS characters (
+    user_id       TEXT NOT NULL,
+    slot          INTEGER NOT NULL,
+    name          TEXT,
+    class         TEXT,
+    level         INTEGER,
+    current_level TEXT,
+    PRIMARY KEY (user_id, slot)
+);
+CREATE INDEX IF NOT EXISTS characters_name ON characters (name);
+CREATE INDEX IF NOT EXISTS characters_current_level ON characters (current_level);
+CREATE TABLE IF NOT EXISTS templates (
+    template_id TEXT NOT NULL,
+    version     TEXT NOT NULL,
+    body        TEXT NOT NULL,
+    PRIMARY KEY (template_id, version)
+);
+CREATE TABLE IF NOT EXISTS guilds (
+    name TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS character_fields (
+    user_id TEXT NOT NULL,
+    slot    INTEGER NOT NULL,
+    field   TEXT NOT NULL,
+    value   TEXT NOT NULL,
+    PRIMARY KEY (user_id, slot, field)
+);
+"""
+
+
+def _indexed_columns(char: dict):
+    current = char.get("CurrentLevel")
+    if isinstance(current, dict):
+        current = current.get("name")
+    level = char.get("level")
+    return (char.get("name"), char.get("class"),
+            level if isinstance(level, int) else None,
+            current if isinstance(current, str) else None)
+
+
+def _stored_fields(char, fields):
+    """
+    The persisted form of `char` and which of its keys to write for
+    `fields` (all of them for None). For a templated character a field back
+    at its template value is absent, i.e. gets deleted, and the list of
+    removed template fields and the template version are always
+    rewritten; all of them are after a rebase (char_template.from_saved).
+    """
+    stored = stored_form(char)
+    if fields is None:
+        return stored, list(stored)
+    if stored is not char:
+        if char.rebased:
+            # Saved against an older template: every field may differ now
+            fields = {*char, *stored}
+            char.rebased = False
+        fields = [*fields, REMOVED_KEY, VERSION_KEY]
+    return stored, fields
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=to_saved)
+
+
+class SqliteStorage:
+    """
+    Single-file SQLite store in WAL mode, shared by all worker processes.
+    Each thread gets its own connection; writes run in BEGIN IMMEDIATE
+    transactions so concurrent writers queue on the lock instead of failing.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, busy_timeout=30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import sqlite3      # only the SQLite backend pays for the import
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn, *args):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # ─── accounts ────────────────────────────────────────────────────────
+    def accounts_version(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'accounts'").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _bump_accounts(conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('accounts', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def read_accounts(self) -> dict:
+        rows = self._conn().execute("SELECT email, user_id FROM accounts ORDER BY rowid")
+        return dict(rows.fetchall())
+
+    def write_accounts(self, index: dict) -> None:
+        def run(conn):
+            conn.execute("DELETE FROM accounts")
+            conn.executemany("INSERT INTO accounts (email, user_id) VALUES (?, ?)", index.items())
+            self._bump_accounts(conn)
+        self._write(run)
+
+    def add_account(self, email: str, user_id: str) -> None:
+        def run(conn):
+            conn.execute("INSERT OR REPLACE INTO accounts (email, user_id) VALUES (?, ?)", (email, user_id))
+            self._bump_accounts(conn)
+        self._write(run)
+
+    # ─── users ───────────────────────────────────────────────────────────
+    def location(self, user_id: str) -> str:
+        return f"{self.path}#{user_id}"
+
+    def user_version(self, user_id: str):
+        row = self._conn().execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def user_ids(self):
+        return [r[0] for r in self._conn().execute("SELECT user_id FROM users ORDER BY user_id")]
+
+    def load_user(self, user_id: str):
+        """(version, doc), or (None, None) if the user has no save."""
+        conn = self._conn()
+        # One read transaction so the three selects see the same snapshot
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT extra, version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None, None
+            doc = json.loads(row[0])
+            slots = [r[0] for r in conn.execute(
+                "SELECT slot FROM characters WHERE user_id = ? ORDER BY slot", (user_id,))]
+            chars = {slot: {} for slot in slots}
+            for slot, field, value in conn.execute(
+                    "SELECT slot, field, value FROM character_fields WHERE user_id = ? ORDER BY rowid",
+                    (user_id,)):
+                chars.setdefault(slot, {})[field] = json.loads(value)
+        finally:
+            conn.execute("COMMIT")
+        doc["characters"] = [chars[slot] for slot in sorted(chars)]
+        return row[1], doc
+
+    @staticmethod
+    def _bump_user(conn, user_id):
+        return conn.execute("UPDATE users SET version = version + 1 WHERE user_id = ? RETURNING version",
+                            (user_id,)).fetchone()[0]
+
+    @staticmethod
+    def _insert_character(conn, user_id, slot, char):
+        conn.execute("INSERT INTO characters (user_id, slot, name, class, level, current_level) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (user_id, slot, *_indexed_columns(char)))
+        conn.executemany("INSERT INTO character_fields (user_id, slot, field, value) VALUES (?, ?, ?, ?)",
+                         [(user_id, slot, k, _dumps(v)) for k, v in stored_form(char).items()])
+
+    def save_user(self, user_id: str, doc: dict):
+        extra = _dumps({k: v for k, v in doc.items() if k != "characters"})
+        chars = doc.get("characters") or []
+
+        def run(conn):
+            conn.execute("INSERT INTO users (user_id, extra) VALUES (?, ?) "
+                         "ON CONFLICT (user_id) DO UPDATE SET extra = excluded.extra", (user_id, extra))
+            conn.execute("DELETE FROM characters WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM character_fields WHERE user_id = ?", (user_id,))
+            for slot, char in enumerate(chars):
+                self._insert_character(conn, user_id, slot, char)
+            return self._bump_user(conn, user_id)
+        return self._write(run)
+
+    def save_character(self, user_id: str, doc: dict, char: dict, fields=None):
+        """
+        Persist one character of `doc`. With `fields`, only those top-level
+        keys are rewritten (a key missing from `char` is deleted); without,
+        the whole character is. Falls back to save_user() when the character
+        isn't in the stored document yet.
+        """
+        chars = doc.get("characters") or []
+        slot = next((i for i, c in enumerate(chars) if c is char), None)
+        if slot is None:
+            return self.save_user(user_id, doc)
+
+        def run(conn):
+            exists = conn.execute("SELECT 1 FROM characters WHERE user_id = ? AND slot = ?",
+                                  (user_id, slot)).fetchone()
+            if exists is None:
+                return None
+            conn.execute("UPDATE characters SET name = ?, class = ?, level = ?, current_level = ? "
+                         "WHERE user_id = ? AND slot = ?", (*_indexed_columns(char), user_id, slot))
+            if fields is None:
+                conn.execute("DELETE FROM character_fields WHERE user_id = ? AND slot = ?", (user_id, slot))
+            stored, names = _stored_fields(char, fields)
+            for field in names:
+                if field in stored:
+                    conn.execute("INSERT INTO character_fields (user_id, slot, field, value) VALUES (?, ?, ?, ?) "
+                                 "ON CONFLICT (user_id, slot, field) DO UPDATE SET value = excluded.value",
+                                 (user_id, slot, field, _dumps(stored[field])))
+                else:
+                    conn.execute("DELETE FROM character_fields WHERE user_id = ? AND slot = ? AND field = ?",
+                                 (user_id, slot, field))
+            return self._bump_user(conn, user_id)
+
+        version = self._write(run)
+        if version is None:
+            return self.save_user(user_id, doc)
+        return version
+
+    # ─── character templates ─────────────────────────────────────────────
+    def load_template(self, template_id: str, version: str):
+        row = self._conn().execute("SELECT body FROM templates WHERE template_id = ? AND version = ?",
+                                   (template_id, version)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_template(self, template_id: str, version: str, template: dict) -> None:
+        self._write(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO templates (template_id, version, body) VALUES (?, ?, ?)",
+            (template_id, version, _dumps(template))))
+
+    def templates(self):
+        return self._conn().execute("SELECT template_id, version FROM templates ORDER BY rowid").fetchall()
+
+    # ─── guilds ──────────────────────────────────────────────────────────
+    def load_guilds(self) -> dict:
+        rows = self._conn().execute("SELECT name, body FROM guilds ORDER BY rowid").fetchall()
+        return {name: json.loads(body) for name, body in rows}
+
+    def update_guild(self, name: str, fn) -> dict:
+        def run(conn):
+            row = conn.execute("SELECT body FROM guilds WHERE name = ?", (name,)).fetchone()
+            doc = fn(json.loads(row[0]) if row else None)
+            conn.execute("INSERT OR REPLACE INTO guilds (name, body) VALUES (?, ?)", (name, _dumps(doc)))
+            return doc
+        return self._write(run)
+
+    def find_characters(self, name: str):
+        """[(user_id, slot)] of characters called `name` (uses the name index)."""
+        return self._conn().execute("SELECT user_id, slot FROM characters WHERE name = ?", (name,)).fetchall()
+
+
+def open_storage(spec: str):
+    """
+    Backend from a spec string: "json", "json:<dir>" (holding Accounts.json
+    and saves/), "sqlite" or "sqlite:<path>".
+    """
+    kind, _, arg = spec.partition(":")
+    kind = kind.strip().lower()
+    if kind == "json":
+        if arg:
+            return JsonStorage(os.path.join(arg, ACCOUNTS_FILE), os.path.join(arg, SAVES_DIR))
+        return JsonStorage()
+    if kind == "sqlite":
+        return SqliteStorage(arg or DEFAULT_SQLITE_PATH)
+    raise ValueError(f"unknown storage backend {spec!r}")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """The process-wide backend, chosen by DBZ_STORAGE (default "json")."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = open_storage(os.environ.get("DBZ_STORAGE", "json"))
+                print(f"[Storage] Using {_storage.kind} backend")
+    return _storage
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Thread-safety stress test for the shared server state, meant for
+free-threaded CPython (3.13t) as well as the regular build.
+
+Two phases, in one process:
+
+  registries  THREADS threads issue and take transfer tokens and churn
+              the door-activity and persisted-session registries at
+              once; each token must come back to the thread that issued it.
+  bots        the game server is started in-process and --bots loadgen
+              bots move, cast, chat and walk through doors against it.
+              Once they disconnect (and presence's grace period has
+              passed) nothing may be left behind: no sessions, online
+              characters, AOI players or outboxes.
+
+On a free-threaded build the whole run is repeated with the GIL forced
+on (PYTHON_GIL=1) and off (PYTHON_GIL=0) and the throughput compared.
+Run it on a scratch copy of the server, like loadgen.py (bots create
+accounts and saves):
+
+    python stress_threads.py --bots 300 --duration 20
+    python stress_threads.py --bots 50 --duration 5 --once
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import sysconfig
+import threading
+import time
+
+THREADS = 16
+
+
+def gil_enabled() -> bool:
+    check = getattr(sys, "_is_gil_enabled", None)
+    return check() if check is not None else True
+
+
+def stress_registries(server, rounds: int) -> list:
+    """Problems found hammering pending_world and friends from THREADS threads."""
+    taken = [[] for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+
+    def worker(i):
+        barrier.wait()
+        for n in range(rounds):
+            char = {"name": f"Stress{i}_{n}", "user_id": f"stress{i}"}
+            token = server.new_transfer_token(char)
+            server.track_door_activity("StressLevel", n % 7, "StressTarget", {"user_id": char["user_id"]})
+            server.persistent_sessions[char["user_id"]] = {"user_id": char["user_id"], "n": n}
+            taken[i].append(server.take_pending(token) is char)
+            list(server.pending_world.items())
+            server.persistent_sessions.pop(char["user_id"], None)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    problems = []
+    lost = sum(not ok for ts in taken for ok in ts)
+    if lost:
+        problems.append(f"{lost} transfer tokens were taken by the wrong thread or lost")
+    if len(server.pending_world):
+        problems.append(f"{len(server.pending_world)} transfer tokens left in pending_world")
+    if len(server.persistent_sessions):
+        problems.append(f"{len(server.persistent_sessions)} persisted sessions left behind")
+    return problems
+
+
+def leftovers(server) -> list:
+    """Problems: per-session state still around after every bot disconnected."""
+    import aoi
+    import movement
+    import presence
+    problems = []
+    if len(server.all_sessions):
+        problems.append(f"{len(server.all_sessions)} sessions still registered")
+    if presence.online_count():
+        problems.append(f"{presence.online_count()} characters still online")
+    players = {level: n for level, n in aoi.players_per_level().items() if n}
+    if players:
+        problems.append(f"players still in the AOI grids: {players}")
+    with movement._outboxes_lock:
+        outboxes = len(movement._outboxes)
+    if outboxes:
+        problems.append(f"{outboxes} movement outboxes not closed")
+    return problems
+
+
+def run_once(args) -> dict:
+    import loadgen
+    import presence
+    import server
+
+    t0 = time.perf_counter()
+    problems = stress_registries(server, args.rounds)
+    registry_seconds = time.perf_counter() - t0
+
+    server.PORTS = [args.port]
+    server.start_servers()
+    stats = loadgen.LoadStats()
+    bot_args = argparse.Namespace(
+        host="127.0.0.1", port=args.port, move_hz=10.0, cast_hz=1.0, chat_interval=10.0,
+        door_interval=args.door_interval, timeout=10.0, prefix="Stress", domain="stress.local",
+        seed=1)
+    started = time.monotonic()
+    stop_at = started + args.ramp + args.duration
+    bots = []
+    for i in range(args.bots):
+        bot = loadgen.Bot(i, bot_args, stats, stop_at)
+        bot.start()
+        bots.append(bot)
+        time.sleep(args.ramp / args.bots)
+    for bot in bots:
+        bot.join(max(0.0, stop_at - time.monotonic()) + 20)
+    elapsed = time.monotonic() - started
+
+    time.sleep(presence.OFFLINE_GRACE + 2)
+    problems += leftovers(server)
+    failures = sum(stats.failures.values())
+    if failures:
+        problems.append(f"{failures} bot steps failed: {stats.failures}")
+    return {
+        "gil": gil_enabled(),
+        "registry_ops_per_s": THREADS * args.rounds / registry_seconds,
+        "packets_in_per_s": stats.packets_in / elapsed,
+        "packets_out_per_s": stats.packets_out / elapsed,
+        "problems": problems,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Free-threading stress test")
+    ap.add_argument("--bots", type=int, default=200)
+    ap.add_argument("--duration", type=float, default=15.0, help="seconds of in-world traffic")
+    ap.add_argument("--ramp", type=float, default=5.0)
+    ap.add_argument("--door-interval", type=float, default=5.0)
+    ap.add_argument("--rounds", type=int, default=2000, help="registry operations per thread")
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--once", action="store_true", help="one run with this interpreter's GIL setting")
+    ap.add_argument("--json", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    free_threaded = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+    if args.once or not free_threaded:
+        if not free_threaded:
+            print("[Stress] Not a free-threaded build: one run with the GIL")
+        result = run_once(args)
+        if args.json:
+            print("RESULT " + json.dumps(result))
+        results = [result]
+    else:
+        results = []
+        for gil in ("1", "0"):
+            cmd = [sys.executable, __file__, "--once", "--json", "--bots", str(args.bots),
+                   "--duration", str(args.duration), "--ramp", str(args.ramp),
+                   "--door-interval", str(args.door_interval), "--rounds", str(args.rounds),
+                   "--port", str(args.port)]
+            out = subprocess.run(cmd, env=dict(os.environ, PYTHON_GIL=gil), capture_output=True, text=True)
+            line = next((l for l in out.stdout.splitlines() if l.startswith("RESULT ")), None)
+            if line is None:
+                print(out.stdout[-2000:], out.stderr[-2000:])
+                return 1
+            results.append(json.loads(line[len("RESULT "):]))
+
+    print(f"{'GIL':>5}{'registry ops/s':>16}{'packets in/s':>14}{'packets out/s':>15}{'problems':>10}")
+    for r in results:
+        print(f"{'on' if r['gil'] else 'off':>5}{r['registry_ops_per_s']:>16.0f}"
+              f"{r['packets_in_per_s']:>14.0f}{r['packets_out_per_s']:>15.0f}{len(r['problems']):>10}")
+    if len(results) == 2 and results[0]["packets_in_per_s"]:
+        print(f"\n[Stress] Without the GIL: {results[1]['packets_in_per_s'] / results[0]['packets_in_per_s']:.2f}x "
+              f"packets delivered")
+    bad = [p for r in results for p in r["problems"]]
+    for p in bad:
+        print(f"[Stress] {p}")
+    if not bad:
+        print("[Stress] Consistent: nothing lost or left behind")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# timers.py
+"""
+Server-side deadlines for character timers (forge, skill research,
+building upgrade, tower research, egg reset), on a hierarchical timing
+wheel.
+
+Each timer lives in one slot of one of four wheels (256 one-second
+slots, then 64 slots of 256 s, 16384 s and 1048576 s), so scheduling
+and cancelling are a dict insert/delete however many timers are pending.
+Every tick fires the current one-second slot; when a wheel comes round,
+the next slot of the wheel above is spread into the wheels below.
+Deadlines past the top wheel wait in an overflow bucket.
+
+    schedule(key, deadline, fn, *args)    # replaces any timer with that key
+    cancel(key)
+    start()                               # the ticking thread (after load_all())
+
+Character timers are kept as absolute deadlines (unix seconds) next to
+the old remaining-time fields (CHARACTER_TIMERS). track_character()
+converts a save that only has the remaining time and schedules every
+running timer; on completion the deadline is dropped and the save is
+updated whether the player is online or not, and an online player gets
+the packet for it (0xCD for the forge). load_all() tracks every saved
+character at startup.
+
+With --workers, worker OWNER schedules every character timer, so each
+fires once. The other workers forward their schedules and cancels to it
+(connect(), receive()), and it hands a finished timer to whichever
+worker is playing the character, which completes it there.
+`python bench_timers.py` measures the wheel.
+"""
+import threading
+import time
+
+TICK = 1.0                      # seconds per slot of the first wheel
+OWNER = 0                       # --workers: the worker holding every character timer
+WHEEL_BITS = (8, 6, 6, 6)       # slots per wheel: 256, 64, 64, 64
+
+# field -> (absolute deadline key, remaining-milliseconds key, default remaining ms)
+CHARACTER_TIMERS = {
+    "magicForge": ("endsAt", "duration", 60000),
+    "research": ("readyAt", "ReadyTime", 0),
+    "buildingResearch": ("finishAt", "finishTime", 0),
+    "towerResearch": ("endsAt", "endTime", 0),
+    "eggData": ("resetAt", "resetEndTime", 0),
+}
+
+
+class Timer:
+    __slots__ = ("key", "tick", "fn", "args", "bucket")
+
+    def __init__(self, key, tick, fn, args):
+        self.key = key
+        self.tick = tick
+        self.fn = fn
+        self.args = args
+        self.bucket = None      # the slot dict holding it
+
+
+class TimingWheel:
+    def __init__(self, now: float = None, tick: float = TICK, wheel_bits=WHEEL_BITS):
+        self.tick = tick
+        self._now = int((time.time() if now is None else now) // tick)
+        self._shifts = []
+        shift = 0
+        for bits in wheel_bits:
+            self._shifts.append((shift, bits))
+            shift += bits
+        self._span = 1 << shift         # ticks the wheels cover
+        self._wheels = [[{} for _ in range(1 << bits)] for bits in wheel_bits]
+        self._overflow = {}
+        self._due = {}                  # already past when scheduled: fire on the next advance
+        self._timers = {}               # key -> Timer
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _place(self, timer: Timer) -> None:
+        delta = timer.tick - self._now
+        if delta <= 0:
+            bucket = self._due
+        elif delta >= self._span:
+            bucket = self._overflow
+        else:
+            for level, (shift, bits) in enumerate(self._shifts):
+                if delta < 1 << (shift + bits):
+                    bucket = self._wheels[level][(timer.tick >> shift) & ((1 << bits) - 1)]
+                    break
+        bucket[timer.key] = timer
+        timer.bucket = bucket
+
+    def schedule(self, key, deadline: float, fn, *args) -> Timer:
+        """Call fn(*args) once `deadline` (unix seconds) has passed."""
+        timer = Timer(key, int(-(-deadline // self.tick)), fn, args)
+        with self._lock:
+            old = self._timers.pop(key, None)
+            if old is not None:
+                del old.bucket[key]
+            self._timers[key] = timer
+            self._place(timer)
+        return timer
+
+    def cancel(self, key) -> bool:
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is None:
+                return False
+            del timer.bucket[key]
+            return True
+
+    def deadline(self, key):
+        timer = self._timers.get(key)
+        return timer.tick * self.tick if timer is not None else None
+
+    def _collect(self, bucket: dict, fired: list) -> None:
+        for timer in bucket.values():
+            del self._timers[timer.key]
+            fired.append(timer)
+        bucket.clear()
+
+    def _cascade(self, bucket: dict) -> None:
+        timers = list(bucket.values())
+        bucket.clear()
+        for timer in timers:
+            self._place(timer)
+
+    def advance(self, now: float = None) -> int:
+        """Fire every timer due by `now`. Returns how many fired."""
+        target = int((time.time() if now is None else now) // self.tick)
+        fired = []
+        with self._lock:
+            self._collect(self._due, fired)
+            while self._now < target:
+                self._now += 1
+                t = self._now
+                if t & (self._span - 1) == 0 and self._overflow:
+                    self._cascade(self._overflow)
+                for level in range(len(self._shifts) - 1, 0, -1):
+                    shift, bits = self._shifts[level]
+                    if t & ((1 << shift) - 1) == 0:
+                        self._cascade(self._wheels[level][(t >> shift) & ((1 << bits) - 1)])
+                self._collect(self._wheels[0][t & ((1 << self._shifts[0][1]) - 1)], fired)
+                self._collect(self._due, fired)
+        for timer in fired:
+            try:
+                timer.fn(*timer.args)
+            except Exception as e:
+                print(f"[Timers] {timer.key} failed: {e}")
+        return len(fired)
+
+
+_wheel = TimingWheel()
+_worker = OWNER
+_send = None        # fn(worker index, message) with --workers, see connect()
+
+
+def schedule(key, deadline: float, fn, *args) -> Timer:
+    return _wheel.schedule(key, deadline, fn, *args)
+
+
+def cancel(key) -> bool:
+    return _wheel.cancel(key)
+
+
+def pending() -> int:
+    """Timers waiting to fire (a metrics gauge)."""
+    return len(_wheel)
+
+
+def start(load_saves: bool = True, interval: float = TICK) -> threading.Thread:
+    """Tick the wheel in a thread, first tracking every save if load_saves."""
+    def run():
+        if load_saves:
+            print(f"[Timers] Tracking {load_all()} timers from saves")
+        while True:
+            time.sleep(interval)
+            _wheel.advance()
+
+    thread = threading.Thread(target=run, name="timers", daemon=True)
+    thread.start()
+    return thread
+
+
+# ─── character timers ────────────────────────────────────────────────────
+def connect(worker: int, send) -> None:
+    """Run as worker `worker`; send(index, message) delivers to another worker's receive()."""
+    global _worker, _send
+    _worker, _send = worker, send
+
+
+def receive(op: str, user_id, char_name: str, field: str, at: float = None) -> None:
+    """A character timer message from another worker."""
+    key = timer_key(user_id, char_name, field)
+    if op == "schedule":
+        schedule(key, at, _complete, user_id, char_name, field)
+    elif op == "cancel":
+        cancel(key)
+    elif op == "complete":
+        schedule(key, 0, _finish, user_id, char_name, field)     # on our timers thread
+
+
+def _schedule_character(user_id, char_name: str, field: str, at: float) -> None:
+    if _send is not None and _worker != OWNER:
+        _send(OWNER, ("timers", "schedule", user_id, char_name, field, at))
+    else:
+        schedule(timer_key(user_id, char_name, field), at, _complete, user_id, char_name, field)
+
+
+def _cancel_character(user_id, char_name: str, field: str) -> None:
+    if _send is not None and _worker != OWNER:
+        _send(OWNER, ("timers", "cancel", user_id, char_name, field))
+    else:
+        cancel(timer_key(user_id, char_name, field))
+
+
+def deadline(entry: dict, field: str, now: float = None) -> int:
+    """
+    The timer's absolute deadline in unix seconds. Saves from before
+    deadlines were stored only have the remaining time, counted from now.
+    """
+    abs_key, ms_key, default_ms = CHARACTER_TIMERS[field]
+    at = entry.get(abs_key)
+    if at is not None:
+        return int(at)
+    now = int(time.time()) if now is None else int(now)
+    remaining = min((entry.get(ms_key, default_ms) + 999) // 1000, (2 ** 30) - 1)
+    return now + remaining
+
+
+def _running(char, field: str):
+    entry = char.get(field)
+    if not entry:
+        return None
+    if field == "magicForge":
+        from constants import class_111
+        if not entry.get("hasSession") or entry.get("status") != class_111.const_286:
+            return None
+    return entry
+
+
+def timer_key(user_id, char_name: str, field: str) -> tuple:
+    return (user_id, char_name, field)
+
+
+def start_timer(user_id, char, field: str, seconds: float) -> int:
+    """Start (or restart) one of the character's timers. Returns the deadline."""
+    abs_key, ms_key, _ = CHARACTER_TIMERS[field]
+    entry = char.setdefault(field, {})
+    at = int(time.time() + seconds)
+    entry[abs_key] = at
+    entry[ms_key] = int(seconds * 1000)
+    _schedule_character(user_id, char["name"], field, at)
+    return at
+
+
+def stop_timer(user_id, char, field: str) -> None:
+    """The timer was finished early or abandoned (speed-up, collect, cancel)."""
+    _cancel_character(user_id, char["name"], field)
+    entry = char.get(field)
+    if entry:
+        entry.pop(CHARACTER_TIMERS[field][0], None)
+
+
+def track_character(user_id, char) -> list:
+    """
+    Schedule the character's running timers, storing absolute deadlines
+    for any that only had a remaining time. Returns the fields changed.
+    """
+    changed = []
+    now = int(time.time())
+    for field, (abs_key, ms_key, _) in CHARACTER_TIMERS.items():
+        entry = _running(char, field)
+        if entry is None:
+            continue
+        if entry.get(ms_key) == 0:
+            # finished; saves from before _complete dropped the deadline still have it
+            if entry.pop(abs_key, None) is not None:
+                changed.append(field)
+            continue
+        at = deadline(entry, field, now)
+        if entry.get(abs_key) is None:
+            if at <= now:
+                continue    # nothing left to run: leave old saves alone
+            entry[abs_key] = at
+            changed.append(field)
+        _schedule_character(user_id, char["name"], field, at)
+    return changed
+
+
+def _complete(user_id, char_name: str, field: str) -> None:
+    import presence
+    worker = presence.worker_of(char_name) if _send is not None else None
+    if worker is not None:
+        # its worker holds the live character: finish it there
+        _send(worker, ("timers", "complete", user_id, char_name, field))
+        return
+    _finish(user_id, char_name, field)
+
+
+def _finish(user_id, char_name: str, field: str) -> None:
+    import save_cache
+    import presence
+    doc = save_cache.load_save(user_id)
+    chars = doc.get("characters", []) if doc else []
+    char = next((c for c in chars if c.get("name") == char_name), None)
+    entry = _running(char, field) if char is not None else None
+    if entry is None:
+        return
+    abs_key, ms_key, _ = CHARACTER_TIMERS[field]
+    at = entry.get(abs_key)
+    if at is not None and at > time.time() + 1:
+        # the save was given a later deadline behind our back
+        _schedule_character(user_id, char_name, field, at)
+        return
+    entry[ms_key] = 0
+    entry.pop(abs_key, None)    # done: nothing for track_character() to schedule again
+    packet = None
+    if field == "magicForge":
+        from constants import class_111
+        from Commands import forge_update_packet
+        entry["status"] = class_111.const_264
+        packet = forge_update_packet(entry)
+    save_cache.save_character(user_id, doc, char, [field])
+    print(f"[Timers] {char_name}: {field} finished")
+    if packet is not None:
+        for session in presence.sessions_of(char_name):
+            try:
+                session.conn.sendall(packet)
+            except OSError:
+                pass    # its own handler notices the dead socket
+
+
+def load_all() -> int:
+    """Track every saved character's timers (run once at startup). Returns how many."""
+    import save_cache
+    from storage import get_storage
+    before = pending()
+    for user_id in get_storage().user_ids():
+        try:
+            doc = save_cache.load_save(user_id)
+            for char in (doc or {}).get("characters", []):
+                changed = track_character(user_id, char)
+                if changed:
+                    save_cache.save_character(user_id, doc, char, changed)
+        except Exception as e:
+            print(f"[Timers] Could not load timers for {user_id}: {e}")
+    return pending() - before